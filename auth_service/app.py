@@ -1,43 +1,131 @@
+import contextvars
 import json
+import os
+import sys
 import jwt
 import requests
 from flask import Flask, request, jsonify
-from flask_restx import Api, Resource
+from flask_restx import Namespace, Resource
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from urllib.parse import urlencode
 
-app = Flask(__name__)
-
-# Define the security schema for Swagger
-authorizations = {
-    "Bearer": {
-        "type": "apiKey",
-        "in": "header",
-        "name": "Authorization",
-        "description": "Enter 'Bearer <your-token>'",
-    }
-}
-
-# Initialize API with security definitions
-api = Api(
-    app,
-    doc="/",
-    title="Auth Service API",
-    authorizations=authorizations,
-    security="Bearer",
+# Make the shared "common" package importable when run from this directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from breaker import CircuitBreaker, CircuitOpen
+from common.api import create_api
+from common.config import (
+    DESTINATION_SERVICE_URL,
+    INTERNAL_API_KEY,
+    JWKS_REFRESH_INTERVAL,
+    JWKS_URL,
+    JWT_ALGORITHM,
+    RATE_LIMIT_ENABLED,
+    RATE_LIMIT_REDIS_URL,
+    REVOCATION_SYNC_INTERVAL,
+    REVOCATIONS_URL,
+    SECRET_KEY,
+    TOKEN_CACHE_SIZE,
+    env_flag,
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_READ_TIMEOUT,
+    USER_BATCH_MAX,
+    USER_SERVICE_URL,
 )
+from common.instrumentation import instrument, span
+from common.profiling import register_profiler
+from common.ratelimit import RateLimiter, open_backend, parse_rate, too_many_requests
+from common.revocation import RevocationList, http_fetch
+from common.token_cache import TokenCache
+from common.tokens import TokenVerifier
+from singleflight import SingleFlight
+from upstream import UpstreamClient
+from user_batch import UserBatcher
 
-# JWT secret key shared with user_service
-SECRET_KEY = "supersecretkey"
+# Query parameters and response headers passed through to/from destination_service
+DESTINATION_PARAMS = ("limit", "after", "fields", "location")
+DESTINATION_HEADERS = ("X-Next-After",)
 
-USER_SERVICE_URL = "http://localhost:5001"
-DESTINATION_SERVICE_URL = "http://localhost:5002"
+# Verified claims are cached until the token expires
+token_cache = TokenCache(maxsize=TOKEN_CACHE_SIZE)
+
+# Checks signatures with SECRET_KEY, or with user_service's published keys
+verifier = TokenVerifier(
+    JWT_ALGORITHM,
+    secret=SECRET_KEY,
+    jwks_url=JWKS_URL,
+    refresh_interval=JWKS_REFRESH_INTERVAL,
+)
+
+# Sessions revoked in user_service, synced incrementally in the background;
+# checked after the claims cache, so a cached token is rejected too
+revocations = RevocationList(
+    http_fetch(REVOCATIONS_URL), interval=REVOCATION_SYNC_INTERVAL
+)
+
+# Requests per token on the proxy routes, counted per session so that
+# refreshing the token does not reset the count
+limiter = RateLimiter(
+    {"proxy_token": parse_rate(os.environ.get("PROXY_RATE_LIMIT_TOKEN", "300/60"))},
+    backend=open_backend(RATE_LIMIT_REDIS_URL),
+    enabled=RATE_LIMIT_ENABLED,
+)
+
+
+def make_breaker(name):
+    """Circuit breaker for one upstream service.
+
+    Opens when BREAKER_ERROR_RATE of the calls in the last BREAKER_WINDOW
+    seconds failed, or BREAKER_SLOW_CALL_RATE of them took at least
+    BREAKER_SLOW_CALL_SECONDS; then calls fail fast for BREAKER_OPEN_SECONDS
+    before one probe is let through.
+    """
+    return CircuitBreaker(
+        name,
+        window=float(os.environ.get("BREAKER_WINDOW", "30")),
+        min_requests=int(os.environ.get("BREAKER_MIN_REQUESTS", "20")),
+        error_rate=float(os.environ.get("BREAKER_ERROR_RATE", "0.5")),
+        slow_call_seconds=float(os.environ.get("BREAKER_SLOW_CALL_SECONDS", "2.0")),
+        slow_rate=float(os.environ.get("BREAKER_SLOW_CALL_RATE", "0.8")),
+        open_seconds=float(os.environ.get("BREAKER_OPEN_SECONDS", "10")),
+    )
+
+
+# One keep-alive connection pool shared by every request thread, with a
+# circuit breaker per upstream and optional hedging of slow GETs
+upstream = UpstreamClient(
+    pool_size=int(os.environ.get("UPSTREAM_POOL_SIZE", "20")),
+    connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+    read_timeout=UPSTREAM_READ_TIMEOUT,
+    retries=int(os.environ.get("UPSTREAM_RETRIES", "2")),
+    backoff=float(os.environ.get("UPSTREAM_RETRY_BACKOFF", "0.1")),
+    upstreams={"user": USER_SERVICE_URL, "destination": DESTINATION_SERVICE_URL},
+    breaker=make_breaker if env_flag("BREAKER_ENABLED", "true") else None,
+    hedge=env_flag("UPSTREAM_HEDGE", "false"),
+    hedge_min_delay=float(os.environ.get("UPSTREAM_HEDGE_MIN_DELAY_MS", "20")) / 1000,
+    hedge_budget=float(os.environ.get("UPSTREAM_HEDGE_BUDGET", "0.1")),
+)
+
+
+# Threads used to query several upstream services concurrently
+fanout = ThreadPoolExecutor(max_workers=int(os.environ.get("FANOUT_WORKERS", "16")))
+
+# Identical upstream calls in flight at the same time share one request
+flights = SingleFlight()
+
+
+def decode_token(token):
+    return verifier.decode(token)
 
 
 # Helper function to verify JWT token
 def verify_token(token):
     try:
-        # Decode JWT token
-        decoded = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        # Decode JWT token, skipping verification for recently seen tokens
+        with span("token_verify"):
+            decoded = token_cache.decode(token, decode_token)
+        if revocations.is_revoked(decoded):
+            return {"message": "Token has been revoked"}, 401
         return decoded  # Return decoded token if valid
     except jwt.ExpiredSignatureError:
         return {"message": "Token has expired"}, 401
@@ -45,8 +133,122 @@ def verify_token(token):
         return {"message": "Invalid token"}, 401
 
 
+def throttle(decoded_token):
+    """Count a proxied request against its token; 0 if allowed"""
+    return limiter.hit(
+        "proxy_token", decoded_token.get("sid") or decoded_token.get("email")
+    )
+
+
+# Upstream calls made by the proxy routes
+def fetch_profile(token):
+    """Fetch the token holder's profile from user_service"""
+    try:
+        with span("upstream_user"):
+            user_profile = upstream.get(
+                f"{USER_SERVICE_URL}/users/profile",
+                headers={"Authorization": f"Bearer {token}"},
+            )
+        user_profile.raise_for_status()  # Will raise HTTPError for bad responses
+    except CircuitOpen as e:
+        return {"message": str(e)}, 503, {"Retry-After": str(e.retry_after)}
+    except requests.exceptions.RequestException as e:
+        return {"message": f"Error communicating with User Service: {str(e)}"}, 500
+
+    return user_profile.json(), 200
+
+
+def destination_query(params):
+    """The passed-through query parameters, in a canonical order"""
+    return tuple(
+        sorted((k, v) for k, v in (params or {}).items() if k in DESTINATION_PARAMS)
+    )
+
+
+def fetch_destinations(params=None):
+    """Fetch destinations from destination_service as (body, status, headers)"""
+    url = f"{DESTINATION_SERVICE_URL}/destinations/"
+    query = destination_query(params)
+    if query:
+        url = f"{url}?{urlencode(query)}"
+    try:
+        # Revalidates the last response with its ETag instead of re-downloading it
+        with span("upstream_destination"):
+            destinations, headers = upstream.get_json(url)
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and 400 <= e.response.status_code < 500:
+            try:
+                body = e.response.json()
+            except ValueError:  # E.g. an HTML error page from a proxy
+                body = {"message": e.response.text}
+            return body, e.response.status_code, {}
+        return (
+            {"message": f"Error communicating with Destination Service: {str(e)}"},
+            500,
+            {},
+        )
+    except CircuitOpen as e:
+        return {"message": str(e)}, 503, {"Retry-After": str(e.retry_after)}
+    except requests.exceptions.RequestException as e:
+        return (
+            {"message": f"Error communicating with Destination Service: {str(e)}"},
+            500,
+            {},
+        )
+
+    return (
+        destinations,
+        200,
+        {h: headers[h] for h in DESTINATION_HEADERS if h in headers},
+    )
+
+
+def shared_profile(token, decoded_token):
+    """fetch_profile, made once for concurrent requests of the same user.
+
+    The profile only depends on the email, and every waiting request's own
+    token has already been verified and checked for revocation here.
+    """
+    return flights.do(("profile", decoded_token.get("email")), fetch_profile, token)
+
+
+def shared_destinations(params=None):
+    """fetch_destinations, made once for concurrent requests of the same page"""
+    return flights.do(
+        ("destinations", destination_query(params)), fetch_destinations, params
+    )
+
+
+def fetch_user_batch(emails):
+    """Profiles of many users from one POST /users/batch call"""
+    with span("upstream_user_batch"):
+        response = upstream.post(
+            f"{USER_SERVICE_URL}/users/batch",
+            json={"emails": emails},
+            headers={"X-Internal-Key": INTERNAL_API_KEY},
+        )
+    response.raise_for_status()
+    return response.json()["users"]
+
+
+# Lookups made by concurrent requests within the window share one call
+user_batcher = UserBatcher(
+    fetch_user_batch,
+    window=float(os.environ.get("USER_BATCH_WINDOW_MS", "2")) / 1000,
+    max_batch=USER_BATCH_MAX,
+)
+
+
+def lookup_users(emails):
+    """Return ``{email: profile}`` for the registered users among emails.
+
+    Raises ``requests.exceptions.RequestException`` if user_service fails.
+    """
+    return user_batcher.get_many(emails)
+
+
 # Create an API namespace for auth operations
-auth_ns = api.namespace("auth", description="Authentication and access operations")
+auth_ns = Namespace("auth", description="Authentication and access operations")
 
 
 @auth_ns.route("/profile")
@@ -62,25 +264,23 @@ class Profile(Resource):
         token = auth_header.split(" ")[1]
         decoded_token = verify_token(token)
 
-        if isinstance(decoded_token, dict) and decoded_token.get("message"):
+        if isinstance(decoded_token, tuple):
             return decoded_token  # If there is an error, return it immediately
 
-        # Forward request to user_service to get user profile
-        try:
-            user_profile = requests.get(
-                f"{USER_SERVICE_URL}/users/profile",
-                headers={"Authorization": f"Bearer {token}"},
-            )
-            user_profile.raise_for_status()  # Will raise HTTPError for bad responses
-        except requests.exceptions.RequestException as e:
-            return {"message": f"Error communicating with User Service: {str(e)}"}, 500
+        retry_after = throttle(decoded_token)
+        if retry_after:
+            return too_many_requests(retry_after)
 
-        return user_profile.json(), 200
+        # Forward request to user_service to get user profile
+        return shared_profile(token, decoded_token)
 
 
 @auth_ns.route("/destinations")
 class Destinations(Resource):
-    @auth_ns.doc(security="Bearer")  # This route requires a valid token
+    @auth_ns.doc(
+        security="Bearer",  # This route requires a valid token
+        params={p: "Passed through to destination_service" for p in DESTINATION_PARAMS},
+    )
     def get(self):
         """Get the list of all destinations (only accessible to authenticated users)"""
         auth_header = request.headers.get("Authorization")
@@ -91,25 +291,128 @@ class Destinations(Resource):
         token = auth_header.split(" ")[1]
         decoded_token = verify_token(token)
 
-        if isinstance(decoded_token, dict) and decoded_token.get("message"):
+        if isinstance(decoded_token, tuple):
             return decoded_token  # If there is an error, return it immediately
 
+        retry_after = throttle(decoded_token)
+        if retry_after:
+            return too_many_requests(retry_after)
+
         # Optionally, you can check the role of the user
         user_role = decoded_token.get("role")
         if user_role not in ["User", "Admin"]:
             return {"message": "You do not have permission to access destinations"}, 403
 
         # Forward request to destination_service to get the list of destinations
-        try:
-            destinations = requests.get(f"{DESTINATION_SERVICE_URL}/destinations")
-            destinations.raise_for_status()  # Will raise HTTPError for bad responses
-        except requests.exceptions.RequestException as e:
-            return {
-                "message": f"Error communicating with Destination Service: {str(e)}"
-            }, 500
+        return shared_destinations(request.args)
+
+
+@auth_ns.route("/overview")
+class Overview(Resource):
+    @auth_ns.doc(security="Bearer")  # This route requires a valid token
+    def get(self):
+        """Get the user profile and all destinations in one round trip"""
+        auth_header = request.headers.get("Authorization")
 
-        return destinations.json(), 200
+        if not auth_header or not auth_header.startswith("Bearer "):
+            return {"message": "Token is missing or invalid"}, 401
+
+        token = auth_header.split(" ")[1]
+        decoded_token = verify_token(token)
+
+        if isinstance(decoded_token, tuple):
+            return decoded_token  # If there is an error, return it immediately
+
+        retry_after = throttle(decoded_token)
+        if retry_after:
+            return too_many_requests(retry_after)
+
+        if decoded_token.get("role") not in ["User", "Admin"]:
+            return {"message": "You do not have permission to access destinations"}, 403
+
+        # Query both services concurrently instead of one after the other;
+        # each call carries the request's context so its spans are reported
+        profile = fanout.submit(
+            contextvars.copy_context().run, shared_profile, token, decoded_token
+        )
+        destinations = fanout.submit(
+            contextvars.copy_context().run, shared_destinations
+        )
+        # Errors are returned whole, so a 503 keeps its Retry-After header
+        profile_result = profile.result()
+        destinations_result = destinations.result()
+        if profile_result[1] != 200:
+            return profile_result
+        if destinations_result[1] != 200:
+            return destinations_result
+        return {
+            "profile": profile_result[0],
+            "destinations": destinations_result[0],
+        }, 200
+
+
+@auth_ns.route("/token-cache")
+class TokenCacheStats(Resource):
+    def get(self):
+        """Hit/miss counters of the verified-token cache"""
+        return token_cache.stats(), 200
+
+
+@auth_ns.route("/upstream-pool")
+class UpstreamPoolStats(Resource):
+    def get(self):
+        """Connection pool usage of the upstream HTTP client"""
+        return upstream.stats(), 200
+
+
+def is_admin(auth_header):
+    """Whether the Authorization header carries a valid Admin token"""
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return False
+    decoded_token = verify_token(auth_header.split(" ")[1])
+    return not isinstance(decoded_token, tuple) and decoded_token.get("role") == "Admin"
+
+
+def warm():
+    """Load signing keys and revoked sessions before serving requests"""
+    verifier.warm()
+    revocations.warm()
+
+
+def shut_down():
+    verifier.close()
+    revocations.close()
+
+
+def create_app():
+    """Build the Flask app; the module-level ``app`` is built on first access"""
+    app = Flask(__name__)
+    api = create_api(app, "Auth Service API", [auth_ns])
+
+    # Request latencies and timing spans, served on /metrics
+    metrics = instrument(app)
+    metrics.add_collector("token_cache", token_cache.stats)
+    metrics.add_collector("upstream", upstream.stats)
+    metrics.add_collector("jwks", verifier.stats)
+    metrics.add_collector("revocations", revocations.stats)
+    metrics.add_collector("ratelimit", limiter.stats)
+    metrics.add_collector("user_batch", user_batcher.stats)
+    metrics.add_collector("singleflight", flights.stats)
+    metrics.add_collector("breaker", upstream.breaker_stats)
+    # Admin-only sampling profiler and per-request cProfile
+    register_profiler(api, is_admin)
+    return app
+
+
+def __getattr__(name):
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
-    app.run(port=5003, debug=True)
+    from common.serving import serve
+
+    serve(create_app(), 5003, warm=warm, on_exit=shut_down)
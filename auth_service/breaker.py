@@ -0,0 +1,162 @@
+import math
+import threading
+import time
+from collections import deque
+
+import requests
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+# Numeric form of the state for /metrics
+STATE_CODES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(requests.exceptions.ConnectionError):
+    """Raised instead of calling an upstream whose breaker is open"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is unavailable (circuit open)")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Error-rate and latency circuit breaker for one upstream service.
+
+    Outcomes are counted in ``buckets`` slices of a rolling ``window``. The
+    breaker opens once the window holds ``min_requests`` calls and either
+    ``error_rate`` of them failed (an exception or a 5xx) or ``slow_rate``
+    of them took ``slow_call_seconds`` or longer. While open, calls fail
+    fast with CircuitOpen. After ``open_seconds`` a single probe call is
+    let through: it closes the breaker if it succeeds in time and opens it
+    again otherwise.
+
+    The latencies of the last ``latency_samples`` successful calls are kept
+    for percentiles, e.g. the delay before a hedged request.
+    """
+
+    def __init__(
+        self,
+        name,
+        window=30.0,
+        buckets=10,
+        min_requests=20,
+        error_rate=0.5,
+        slow_call_seconds=2.0,
+        slow_rate=0.8,
+        open_seconds=10.0,
+        latency_samples=256,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.window = window
+        self.bucket_width = window / buckets
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        # [slice number, calls, failures, slow calls] per slice of the window
+        self._buckets = [[-1, 0, 0, 0] for _ in range(buckets)]
+        self._latencies = deque(maxlen=latency_samples)
+        self._sorted = None
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self.trips = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(self._clock())
+
+    def _current_state(self, now):
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+        return self._state
+
+    def allow(self):
+        """Admit a call or raise CircuitOpen; return whether it is the probe"""
+        with self._lock:
+            now = self._clock()
+            state = self._current_state(now)
+            if state == CLOSED:
+                return False
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            retry_after = max(1, math.ceil(self._opened_at + self.open_seconds - now))
+        raise CircuitOpen(self.name, retry_after)
+
+    def record(self, elapsed, ok, probe=False):
+        """Count the outcome of a call admitted by allow()"""
+        slow = elapsed >= self.slow_call_seconds
+        with self._lock:
+            now = self._clock()
+            if ok:
+                self._latencies.append(elapsed)
+                self._sorted = None
+            if probe:
+                self._probing = False
+                if ok and not slow:
+                    self._state = CLOSED
+                    for bucket in self._buckets:
+                        bucket[:] = [-1, 0, 0, 0]
+                else:
+                    self._trip(now)
+                return
+            if self._current_state(now) != CLOSED:
+                return  # A call started before the breaker opened
+            index = int(now // self.bucket_width)
+            bucket = self._buckets[index % len(self._buckets)]
+            if bucket[0] != index:
+                bucket[:] = [index, 0, 0, 0]
+            bucket[1] += 1
+            bucket[2] += not ok
+            bucket[3] += slow
+            calls, failures, slow_calls = self._totals(index)
+            if calls >= self.min_requests and (
+                failures >= self.error_rate * calls
+                or slow_calls >= self.slow_rate * calls
+            ):
+                self._trip(now)
+
+    def _totals(self, index):
+        calls = failures = slow_calls = 0
+        for bucket in self._buckets:
+            if index - bucket[0] < len(self._buckets):
+                calls += bucket[1]
+                failures += bucket[2]
+                slow_calls += bucket[3]
+        return calls, failures, slow_calls
+
+    def _trip(self, now):
+        self._state = OPEN
+        self._opened_at = now
+        self.trips += 1
+
+    def percentile(self, fraction, min_samples=20):
+        """Latency percentile of recent successful calls, or None"""
+        with self._lock:
+            if len(self._latencies) < min_samples:
+                return None
+            if self._sorted is None:
+                self._sorted = sorted(self._latencies)
+            return self._sorted[int(fraction * (len(self._sorted) - 1))]
+
+    def stats(self):
+        p95 = self.percentile(0.95, min_samples=1)
+        with self._lock:
+            now = self._clock()
+            calls, failures, slow_calls = self._totals(int(now // self.bucket_width))
+            return {
+                "state": STATE_CODES[self._current_state(now)],
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "window_calls": calls,
+                "window_failures": failures,
+                "window_slow_calls": slow_calls,
+                "latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else 0,
+            }
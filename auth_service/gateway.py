@@ -0,0 +1,275 @@
+"""Asyncio serving mode for auth_service's proxy routes.
+
+Serves /auth/profile, /auth/destinations and /auth/overview from one event
+loop with a non-blocking HTTP client, so a single process can keep
+thousands of upstream calls in flight instead of one per WSGI worker.
+
+    python gateway.py
+
+It runs under gunicorn's aiohttp worker with the same WEB_* settings as the
+Flask entry points (WEB_THREADS does not apply).
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from functools import partial
+from urllib.parse import urlencode
+
+from aiohttp import (
+    ClientError,
+    ClientResponseError,
+    ClientSession,
+    ClientTimeout,
+    TCPConnector,
+    web,
+)
+
+from app import (
+    DESTINATION_HEADERS,
+    destination_query,
+    make_breaker,
+    shut_down,
+    throttle,
+    verify_token,
+    warm,
+)
+from common.config import (
+    DESTINATION_SERVICE_URL,
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_READ_TIMEOUT,
+    USER_SERVICE_URL,
+)
+from breaker import CircuitOpen
+from common.serving import serve
+from singleflight import AsyncSingleFlight
+
+CLIENT_KEY = web.AppKey("client", ClientSession)
+USER_URL_KEY = web.AppKey("user_service_url", str)
+DESTINATION_URL_KEY = web.AppKey("destination_service_url", str)
+CONDITIONAL_KEY = web.AppKey("conditional", OrderedDict)
+FLIGHTS_KEY = web.AppKey("flights", AsyncSingleFlight)
+BREAKERS_KEY = web.AppKey("breakers", dict)
+CONDITIONAL_CACHE_SIZE = 256
+
+
+def authenticate(request):
+    """Return (token, claims) or (None, error response)"""
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return None, web.json_response(
+            {"message": "Token is missing or invalid"}, status=401
+        )
+
+    token = auth_header.split(" ")[1]
+    decoded_token = verify_token(token)
+    if isinstance(decoded_token, tuple):
+        body, status = decoded_token
+        return None, web.json_response(body, status=status)
+    retry_after = throttle(decoded_token)
+    if retry_after:
+        return None, web.json_response(
+            {"message": "Too many requests, please retry later"},
+            status=429,
+            headers={"Retry-After": str(retry_after)},
+        )
+    return token, decoded_token
+
+
+async def fetch_json(
+    client,
+    url,
+    service,
+    headers=None,
+    conditional=None,
+    client_errors=False,
+    breaker=None,
+):
+    """GET url and return (body, status, headers) the way the Flask routes do.
+
+    With a ``conditional`` cache the last body is revalidated with
+    If-None-Match instead of being downloaded again. ``client_errors``
+    passes 4xx responses through instead of reporting them as a 500. While
+    the ``breaker`` is open the call fails fast with a 503.
+    """
+    probe = False
+    if breaker is not None:
+        try:
+            probe = breaker.allow()
+        except CircuitOpen as e:
+            return {"message": str(e)}, 503, {"Retry-After": str(e.retry_after)}
+    headers = dict(headers or {})
+    cached = conditional.get(url) if conditional is not None else None
+    if cached is not None:
+        headers["If-None-Match"] = cached[0]
+    ok = False
+    start = time.perf_counter()
+    try:
+        async with client.get(url, headers=headers) as response:
+            ok = response.status < 500
+            if response.status == 304 and cached is not None:
+                conditional.move_to_end(url)
+                return cached[1], 200, cached[2]
+            if client_errors and 400 <= response.status < 500:
+                text = await response.text()
+                try:
+                    body = json.loads(text)
+                except ValueError:  # E.g. an HTML error page from a proxy
+                    body = {"message": text}
+                return body, response.status, {}
+            response.raise_for_status()
+            body = await response.json()
+            etag = response.headers.get("ETag")
+            if conditional is not None and etag:
+                conditional[url] = (etag, body, response.headers.copy())
+                conditional.move_to_end(url)
+                while len(conditional) > CONDITIONAL_CACHE_SIZE:
+                    conditional.popitem(last=False)
+            return body, 200, response.headers.copy()
+    except ClientResponseError as e:
+        # The upstream answered; ok already reflects its status
+        return {"message": f"Error communicating with {service}: {str(e)}"}, 500, {}
+    except (ClientError, asyncio.TimeoutError) as e:
+        ok = False
+        return {"message": f"Error communicating with {service}: {str(e)}"}, 500, {}
+    finally:
+        if breaker is not None:
+            breaker.record(time.perf_counter() - start, ok, probe)
+
+
+def fetch_profile(request, token, claims):
+    # Shared by concurrent requests of the same user, as in the Flask routes
+    return request.app[FLIGHTS_KEY].do(
+        ("profile", claims.get("email")),
+        partial(
+            fetch_json,
+            request.app[CLIENT_KEY],
+            f"{request.app[USER_URL_KEY]}/users/profile",
+            "User Service",
+            headers={"Authorization": f"Bearer {token}"},
+            breaker=request.app[BREAKERS_KEY]["user"],
+        ),
+    )
+
+
+def fetch_destinations(request, params=None):
+    url = f"{request.app[DESTINATION_URL_KEY]}/destinations/"
+    query = destination_query(params)
+    if query:
+        url = f"{url}?{urlencode(query)}"
+    return request.app[FLIGHTS_KEY].do(
+        ("destinations", url),
+        partial(
+            fetch_json,
+            request.app[CLIENT_KEY],
+            url,
+            "Destination Service",
+            conditional=request.app[CONDITIONAL_KEY],
+            client_errors=True,
+            breaker=request.app[BREAKERS_KEY]["destination"],
+        ),
+    )
+
+
+def retry_after(headers):
+    """The Retry-After header of a failed upstream call, if it has one"""
+    return {h: headers[h] for h in ("Retry-After",) if h in headers}
+
+
+def can_view_destinations(claims):
+    return claims.get("role") in ["User", "Admin"]
+
+
+async def profile(request):
+    token, claims = authenticate(request)
+    if token is None:
+        return claims
+    body, status, headers = await fetch_profile(request, token, claims)
+    if status != 200:
+        return web.json_response(body, status=status, headers=retry_after(headers))
+    return web.json_response(body, status=status)
+
+
+async def destinations(request):
+    token, claims = authenticate(request)
+    if token is None:
+        return claims
+    if not can_view_destinations(claims):
+        return web.json_response(
+            {"message": "You do not have permission to access destinations"},
+            status=403,
+        )
+    body, status, headers = await fetch_destinations(request, request.query)
+    passthrough = {h: headers[h] for h in DESTINATION_HEADERS if h in headers}
+    passthrough.update(retry_after(headers))
+    return web.json_response(body, status=status, headers=passthrough)
+
+
+async def overview(request):
+    token, claims = authenticate(request)
+    if token is None:
+        return claims
+    if not can_view_destinations(claims):
+        return web.json_response(
+            {"message": "You do not have permission to access destinations"},
+            status=403,
+        )
+    profile_result, dest_result = await asyncio.gather(
+        fetch_profile(request, token, claims), fetch_destinations(request)
+    )
+    for body, status, headers in (profile_result, dest_result):
+        if status != 200:
+            return web.json_response(body, status=status, headers=retry_after(headers))
+    return web.json_response(
+        {"profile": profile_result[0], "destinations": dest_result[0]}
+    )
+
+
+async def client_session(app):
+    """Open one pooled client for the gateway's lifetime"""
+    connector = TCPConnector(
+        limit=int(os.environ.get("GATEWAY_POOL_SIZE", "1000")),
+        keepalive_timeout=30,
+    )
+    timeout = ClientTimeout(
+        sock_connect=UPSTREAM_CONNECT_TIMEOUT,
+        sock_read=UPSTREAM_READ_TIMEOUT,
+    )
+    async with ClientSession(connector=connector, timeout=timeout) as client:
+        app[CLIENT_KEY] = client
+        yield
+
+
+def create_gateway(
+    user_service_url=USER_SERVICE_URL, destination_service_url=DESTINATION_SERVICE_URL
+):
+    gateway = web.Application()
+    gateway[USER_URL_KEY] = user_service_url
+    gateway[DESTINATION_URL_KEY] = destination_service_url
+    gateway[CONDITIONAL_KEY] = OrderedDict()
+    gateway[FLIGHTS_KEY] = AsyncSingleFlight()
+    # Same settings as the Flask routes' breakers, but this process's own
+    gateway[BREAKERS_KEY] = {
+        "user": make_breaker("user"),
+        "destination": make_breaker("destination"),
+    }
+    gateway.cleanup_ctx.append(client_session)
+    gateway.router.add_get("/auth/profile", profile)
+    gateway.router.add_get("/auth/destinations", destinations)
+    gateway.router.add_get("/auth/overview", overview)
+    return gateway
+
+
+if __name__ == "__main__":
+    gateway = create_gateway()
+    serve(
+        gateway,
+        5003,
+        # Keys and revocations load before the event loop starts, not by a request
+        warm=warm,
+        on_exit=shut_down,
+        worker_class="aiohttp.GunicornWebWorker",
+        fallback=lambda host, port: web.run_app(gateway, host=host, port=port),
+    )
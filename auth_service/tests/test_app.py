@@ -1,6 +1,18 @@
 import pytest
-from unittest.mock import patch
-from app import app, verify_token
+import threading
+import time
+import datetime
+import jwt
+import requests
+from unittest.mock import MagicMock, patch
+from app import app, verify_token, SECRET_KEY
+import app as app_module
+from common.ratelimit import RateLimiter
+from common.revocation import RevocationList
+from common.token_cache import TokenCache
+from singleflight import SingleFlight
+from upstream import UpstreamClient
+from user_batch import UserBatcher
 
 
 @pytest.fixture
@@ -11,6 +23,13 @@ def client():
         yield client
 
 
+@pytest.fixture(autouse=True)
+def limiter():
+    """Fresh rate limit counters for every test"""
+    with patch("app.limiter", RateLimiter(app_module.limiter.rules)) as limiter:
+        yield limiter
+
+
 # Mock JWT tokens
 VALID_USER_TOKEN = "valid_user_token"
 VALID_ADMIN_TOKEN = "valid_admin_token"
@@ -32,7 +51,7 @@ def mock_verify_token(token):
 
 
 @patch("app.verify_token", side_effect=mock_verify_token)
-@patch("requests.get")
+@patch("app.upstream.get")
 def test_profile_valid_token(mock_requests_get, mock_verify_token, client):
     """Test /auth/profile with a valid token"""
     mock_requests_get.return_value.status_code = 200
@@ -72,7 +91,7 @@ def test_profile_missing_token(mock_verify_token, client):
 
 
 @patch("app.verify_token", side_effect=mock_verify_token)
-@patch("requests.get")
+@patch("app.upstream.get")
 def test_destinations_valid_user(mock_requests_get, mock_verify_token, client):
     """Test /auth/destinations with a valid user token"""
     mock_requests_get.return_value.status_code = 200
@@ -89,7 +108,7 @@ def test_destinations_valid_user(mock_requests_get, mock_verify_token, client):
 
 
 @patch("app.verify_token", side_effect=mock_verify_token)
-@patch("requests.get")
+@patch("app.upstream.get")
 def test_destinations_valid_admin(mock_requests_get, mock_verify_token, client):
     """Test /auth/destinations with a valid admin token"""
     mock_requests_get.return_value.status_code = 200
@@ -122,7 +141,10 @@ def test_destinations_missing_token(mock_verify_token, client):
 
 
 @patch("app.verify_token", side_effect=mock_verify_token)
-@patch("requests.get", side_effect=Exception("Service unavailable"))
+@patch(
+    "app.upstream.get",
+    side_effect=requests.exceptions.ConnectionError("Service unavailable"),
+)
 def test_destinations_service_error(mock_requests_get, mock_verify_token, client):
     """Test /auth/destinations with a service error"""
     response = client.get(
@@ -130,3 +152,333 @@ def test_destinations_service_error(mock_requests_get, mock_verify_token, client
     )
     assert response.status_code == 500
     assert "Error communicating with Destination Service" in response.json["message"]
+
+
+def make_token(**claims):
+    return jwt.encode(claims, SECRET_KEY, algorithm="HS256")
+
+
+def test_verify_token_serves_repeat_calls_from_cache():
+    exp = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+    token = make_token(email="user@example.com", role="User", exp=exp)
+    with patch("app.token_cache", TokenCache()) as cache, patch(
+        "app.decode_token",
+        wraps=lambda t: jwt.decode(t, SECRET_KEY, algorithms=["HS256"]),
+    ) as decode:
+        assert verify_token(token)["email"] == "user@example.com"
+        assert verify_token(token)["email"] == "user@example.com"
+    assert decode.call_count == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_verify_token_never_caches_invalid_tokens():
+    with patch("app.token_cache", TokenCache()) as cache:
+        assert verify_token("not-a-jwt") == ({"message": "Invalid token"}, 401)
+        assert verify_token("not-a-jwt") == ({"message": "Invalid token"}, 401)
+    assert cache.stats()["size"] == 0
+
+
+def test_token_cache_evicts_at_expiry():
+    now = [1000.0]
+    cache = TokenCache(maxsize=2, clock=lambda: now[0])
+    cache.put("a", {"exp": 1010})
+    assert cache.get("a") == {"exp": 1010}
+    now[0] = 1010.0
+    assert cache.get("a") is None
+    cache.put("expired", {"exp": 1000})
+    assert cache.stats()["size"] == 0
+
+
+def test_token_cache_is_bounded_lru():
+    cache = TokenCache(maxsize=2, clock=lambda: 0)
+    cache.put("a", {"exp": 10})
+    cache.put("b", {"exp": 10})
+    cache.get("a")
+    cache.put("c", {"exp": 10})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_token_cache_stats(client):
+    response = client.get("/auth/token-cache")
+    assert response.status_code == 200
+    assert set(response.json) >= {"hits", "misses", "size"}
+
+
+def test_upstream_client_reuses_one_pool_across_threads():
+    import threading
+
+    client = UpstreamClient(pool_size=5)
+    sessions = []
+    worker = threading.Thread(target=lambda: sessions.append(client._session()))
+    worker.start()
+    worker.join()
+    sessions.append(client._session())
+    assert sessions[0] is not sessions[1]
+    assert sessions[0].get_adapter("http://x") is sessions[1].get_adapter("http://x")
+
+
+def test_upstream_client_applies_default_timeout():
+    client = UpstreamClient(connect_timeout=1.5, read_timeout=3.0)
+    with patch("requests.Session.get") as session_get:
+        client.get("http://localhost:5001/users/profile")
+    assert session_get.call_args.kwargs["timeout"] == (1.5, 3.0)
+    assert client.stats()["requests"] == 1
+    assert client.stats()["in_flight"] == 0
+
+
+def test_upstream_pool_stats(client):
+    response = client.get("/auth/upstream-pool")
+    assert response.status_code == 200
+    assert response.json["pool_size"] == 20
+
+
+@patch("app.verify_token", side_effect=mock_verify_token)
+@patch("app.fetch_destinations", return_value=([{"id": 1, "name": "Paris"}], 200, {}))
+@patch("app.fetch_profile", return_value=({"name": "John Doe"}, 200))
+def test_overview_combines_profile_and_destinations(
+    mock_profile, mock_destinations, mock_verify_token, client
+):
+    """Test /auth/overview returns both upstream payloads"""
+    response = client.get(
+        "/auth/overview", headers={"Authorization": f"Bearer {VALID_USER_TOKEN}"}
+    )
+    assert response.status_code == 200
+    assert response.json == {
+        "profile": {"name": "John Doe"},
+        "destinations": [{"id": 1, "name": "Paris"}],
+    }
+    mock_profile.assert_called_once_with(VALID_USER_TOKEN)
+
+
+@patch("app.verify_token", side_effect=mock_verify_token)
+@patch("app.fetch_destinations", return_value=([], 200, {}))
+@patch("app.fetch_profile", return_value=({"message": "Error"}, 500))
+def test_overview_upstream_error(
+    mock_profile, mock_destinations, mock_verify_token, client
+):
+    """Test /auth/overview surfaces an upstream failure"""
+    response = client.get(
+        "/auth/overview", headers={"Authorization": f"Bearer {VALID_USER_TOKEN}"}
+    )
+    assert response.status_code == 500
+
+
+def test_upstream_get_json_revalidates_with_etag():
+    client = UpstreamClient()
+    full = MagicMock(status_code=200, headers={"ETag": '"v1"'})
+    full.json.return_value = [{"id": 1, "name": "Paris"}]
+    not_modified = MagicMock(status_code=304, headers={"ETag": '"v1"'})
+    with patch.object(client, "get", side_effect=[full, not_modified]) as get:
+        assert client.get_json("http://dest/destinations/")[0] == [
+            {"id": 1, "name": "Paris"}
+        ]
+        assert client.get_json("http://dest/destinations/")[0] == [
+            {"id": 1, "name": "Paris"}
+        ]
+    assert get.call_args.kwargs["headers"] == {"If-None-Match": '"v1"'}
+    assert not_modified.json.call_count == 0
+    assert client.stats()["not_modified"] == 1
+
+
+@patch("app.verify_token", side_effect=mock_verify_token)
+@patch("app.upstream.get")
+def test_destinations_passes_page_params_through(
+    mock_requests_get, mock_verify_token, client
+):
+    """Test /auth/destinations forwards paging params and the next cursor"""
+    mock_requests_get.return_value.status_code = 200
+    mock_requests_get.return_value.headers = {"X-Next-After": "7", "ETag": '"p"'}
+    mock_requests_get.return_value.json.return_value = [{"id": 7, "name": "Rome"}]
+
+    response = client.get(
+        "/auth/destinations?limit=1&after=6&fields=id,name&debug=1",
+        headers={"Authorization": f"Bearer {VALID_USER_TOKEN}"},
+    )
+    assert response.status_code == 200
+    assert response.headers["X-Next-After"] == "7"
+    url = mock_requests_get.call_args.args[0]
+    assert url.endswith("/destinations/?after=6&fields=id%2Cname&limit=1")
+
+
+@patch("app.verify_token", side_effect=mock_verify_token)
+@patch("app.upstream.get")
+def test_overview_reports_upstream_spans(mock_get, mock_verify_token, client):
+    """Spans recorded on fan-out threads reach the request's Server-Timing"""
+    upstream_response = MagicMock(status_code=200, headers={})
+    upstream_response.json.return_value = {}
+    mock_get.return_value = upstream_response
+    response = client.get(
+        "/auth/overview", headers={"Authorization": f"Bearer {VALID_USER_TOKEN}"}
+    )
+    assert response.status_code == 200
+    timing = response.headers["Server-Timing"]
+    assert "upstream_user;dur=" in timing
+    assert "upstream_destination;dur=" in timing
+    assert "total;dur=" in timing
+
+    metrics = client.get("/metrics").get_data(as_text=True)
+    assert 'route="/auth/overview",status="200",le="+Inf"}' in metrics
+    assert 'span_duration_seconds_count{span="upstream_user"}' in metrics
+    assert "upstream_requests " in metrics
+
+
+@patch("app.verify_token", side_effect=mock_verify_token)
+def test_profile_endpoint_is_admin_only(mock_verify_token, client):
+    response = client.get(
+        "/debug/profile?seconds=0.01",
+        headers={"Authorization": f"Bearer {VALID_USER_TOKEN}"},
+    )
+    assert response.status_code == 403
+    response = client.get(
+        "/debug/profile?seconds=0.01",
+        headers={"Authorization": f"Bearer {VALID_ADMIN_TOKEN}"},
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+
+
+def test_verify_token_rejects_revoked_session_even_when_cached():
+    exp = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+    token = make_token(email="user@example.com", role="User", sid="s1", exp=exp)
+    log = {"revocations": [], "last": 0}
+    revocations = RevocationList(lambda since: (log["revocations"], log["last"]))
+    with patch("app.token_cache", TokenCache()), patch("app.revocations", revocations):
+        assert verify_token(token)["email"] == "user@example.com"
+        log.update(revocations=[{"sid": "s1", "expires_at": exp.timestamp()}], last=1)
+        revocations.sync()
+        assert verify_token(token) == ({"message": "Token has been revoked"}, 401)
+    revocations.close()
+
+
+@patch("app.verify_token", side_effect=mock_verify_token)
+@patch("app.fetch_profile", return_value=({"email": "user@example.com"}, 200))
+def test_proxy_routes_are_limited_per_token(
+    mock_fetch_profile, mock_verify_token, client, limiter
+):
+    limiter.rules["proxy_token"] = (2, 60)
+    user = {"Authorization": f"Bearer {VALID_USER_TOKEN}"}
+    admin = {"Authorization": f"Bearer {VALID_ADMIN_TOKEN}"}
+    assert client.get("/auth/profile", headers=user).status_code == 200
+    assert client.get("/auth/profile", headers=user).status_code == 200
+    response = client.get("/auth/profile", headers=user)
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+    assert mock_fetch_profile.call_count == 2  # Never forwarded upstream
+    assert client.get("/auth/profile", headers=admin).status_code == 200
+
+
+def test_concurrent_user_lookups_share_one_batch():
+    calls = []
+
+    def fetch(emails):
+        calls.append(emails)
+        return {e: {"email": e} for e in emails if e != "nobody@example.com"}
+
+    batcher = UserBatcher(fetch, window=0.2, max_batch=100)
+    results = {}
+
+    def lookup(i):
+        results[i] = batcher.get(f"user{i}@example.com")
+
+    threads = [threading.Thread(target=lookup, args=(i,)) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert sorted(calls[0]) == sorted(f"user{i}@example.com" for i in range(10))
+    assert results[3] == {"email": "user3@example.com"}
+    assert batcher.get("nobody@example.com") is None
+    assert batcher.stats()["lookups"] == 11
+
+
+def test_user_batches_are_split_at_the_maximum_size():
+    calls = []
+    batcher = UserBatcher(
+        lambda emails: calls.append(emails) or {e: {} for e in emails},
+        window=0,
+        max_batch=3,
+    )
+    assert len(batcher.get_many([f"u{i}" for i in range(7)])) == 7
+    assert [len(c) for c in calls] == [3, 3, 1]
+
+
+@patch("app.upstream.post")
+def test_lookup_users_errors_reach_every_caller(mock_post):
+    mock_post.side_effect = requests.exceptions.ConnectionError("down")
+    with patch("app.user_batcher", UserBatcher(app_module.fetch_user_batch)):
+        with pytest.raises(requests.exceptions.RequestException):
+            app_module.lookup_users(["user@example.com"])
+    url = mock_post.call_args.args[0]
+    assert url.endswith("/users/batch")
+    assert mock_post.call_args.kwargs["headers"]["X-Internal-Key"]
+
+
+@patch("app.fetch_destinations")
+def test_concurrent_identical_upstream_calls_are_shared(mock_fetch):
+    started = threading.Event()
+    release = threading.Event()
+
+    def fetch(params=None):
+        started.set()
+        release.wait(2)
+        return [{"id": 1}], 200, {}
+
+    mock_fetch.side_effect = fetch
+    results = []
+    with patch("app.flights", SingleFlight()) as flights:
+        first = threading.Thread(
+            target=lambda: results.append(app_module.shared_destinations({}))
+        )
+        first.start()
+        started.wait(2)
+        # Arrive while the first call is in flight; "debug" is not passed on
+        others = [
+            threading.Thread(
+                target=lambda: results.append(
+                    app_module.shared_destinations({"debug": "1"})
+                )
+            )
+            for _ in range(4)
+        ]
+        for thread in others:
+            thread.start()
+        while flights.stats()["shared"] < 4:
+            time.sleep(0.01)
+        release.set()
+        for thread in [first, *others]:
+            thread.join()
+        assert flights.stats() == {"calls": 1, "shared": 4, "in_flight": 0}
+    assert mock_fetch.call_count == 1
+    assert results == [([{"id": 1}], 200, {})] * 5
+
+
+def test_single_flight_shares_errors_and_does_not_cache():
+    flights = SingleFlight()
+    with pytest.raises(ValueError):
+        flights.do("k", lambda: int("x"))
+    assert flights.do("k", lambda: 1) == 1
+    assert flights.do("k", lambda: 2) == 2
+
+
+@patch("app.verify_token", side_effect=mock_verify_token)
+@patch("app.fetch_profile", return_value=({"email": "user@example.com"}, 200))
+def test_profile_is_shared_per_user(mock_fetch_profile, mock_verify_token, client):
+    with patch("app.flights") as flights:
+        flights.do.side_effect = lambda key, fn, *args: fn(*args)
+        client.get(
+            "/auth/profile", headers={"Authorization": f"Bearer {VALID_USER_TOKEN}"}
+        )
+    key = flights.do.call_args.args[0]
+    assert key == ("profile", "user@example.com")
+
+
+def test_destinations_relays_non_json_client_errors():
+    html = MagicMock(status_code=404, text="<h1>Not Found</h1>")
+    html.json.side_effect = ValueError("Expecting value")
+    error = requests.exceptions.HTTPError("404", response=html)
+    with patch("app.upstream.get_json", side_effect=error):
+        body, status, _ = app_module.fetch_destinations()
+    assert (body, status) == ({"message": "<h1>Not Found</h1>"}, 404)
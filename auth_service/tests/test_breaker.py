@@ -0,0 +1,153 @@
+import contextvars
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+import app as app_module
+from breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+from upstream import UpstreamClient
+
+REQUEST = contextvars.ContextVar("request", default=None)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(clock, **options):
+    options = {"min_requests": 4, "open_seconds": 10, **options}
+    return CircuitBreaker("user", window=10, clock=clock, **options)
+
+
+def test_breaker_opens_on_error_rate_and_closes_after_a_good_probe():
+    clock = Clock()
+    breaker = make_breaker(clock)
+    for ok in (True, False, True, False):
+        breaker.record(0.01, ok, breaker.allow())
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpen) as error:
+        breaker.allow()
+    assert error.value.retry_after == 10
+
+    clock.now += 10
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() is True
+    with pytest.raises(CircuitOpen):
+        breaker.allow()  # Only one probe at a time
+    breaker.record(0.01, True, probe=True)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["trips"] == 1
+    assert breaker.stats()["rejected"] == 2
+    assert breaker.stats()["window_calls"] == 0
+
+
+def test_breaker_opens_on_slow_calls_and_a_slow_probe_reopens_it():
+    clock = Clock()
+    breaker = make_breaker(clock, slow_call_seconds=1.0, slow_rate=0.75)
+    for elapsed in (0.1, 1.5, 2.0, 3.0):
+        breaker.record(elapsed, True, breaker.allow())
+    assert breaker.state == OPEN
+    clock.now += 10
+    breaker.record(1.5, True, breaker.allow())
+    assert breaker.state == OPEN
+    assert breaker.stats()["trips"] == 2
+
+
+def test_breaker_forgets_outcomes_older_than_the_window():
+    clock = Clock()
+    breaker = make_breaker(clock)
+    for _ in range(3):
+        breaker.record(0.01, False)
+    clock.now += 11
+    breaker.record(0.01, False)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["window_failures"] == 1
+
+
+def test_upstream_client_fails_fast_once_the_breaker_opens():
+    client = UpstreamClient(
+        upstreams={"user": "http://localhost:5001"},
+        breaker=lambda name: CircuitBreaker(name, min_requests=3),
+    )
+    with patch(
+        "requests.Session.get", side_effect=requests.exceptions.ConnectTimeout
+    ) as session_get:
+        for _ in range(3):
+            with pytest.raises(requests.exceptions.ConnectTimeout):
+                client.get("http://localhost:5001/users/profile")
+        with pytest.raises(CircuitOpen):
+            client.get("http://localhost:5001/users/profile")
+    assert session_get.call_count == 3
+    stats = client.breaker_stats()["user"]
+    assert stats["state"] == 2
+    assert stats["trips"] == 1
+
+
+def test_slow_get_is_hedged_after_the_p95_latency():
+    client = UpstreamClient(
+        upstreams={"destination": "http://localhost:5002"},
+        breaker=lambda name: CircuitBreaker(name),
+        hedge=True,
+        hedge_min_delay=0.01,
+        hedge_budget=1.0,
+    )
+    breaker = client.breaker("http://localhost:5002/destinations/")
+    for _ in range(20):
+        breaker.record(0.01, True)
+    calls = []
+    responses = [MagicMock(status_code=200), MagicMock(status_code=200)]
+    release = threading.Event()
+    contexts = []
+    REQUEST.set("request-1")
+
+    def get(url, **kwargs):
+        calls.append(url)
+        contexts.append(REQUEST.get())
+        if len(calls) == 1:
+            release.wait(2)  # The first attempt is stuck
+        return responses[len(calls) - 1]
+
+    with patch("requests.Session.get", side_effect=get):
+        start = time.monotonic()
+        response = client.get("http://localhost:5002/destinations/")
+        assert time.monotonic() - start < 0.5
+        release.set()
+    assert response is responses[1]
+    assert len(calls) == 2
+    assert client.stats()["hedge_wins"] == 1
+    # Both attempts ran in the caller's context, where spans are recorded
+    assert contexts == ["request-1", "request-1"]
+
+
+@patch("app.upstream.get_json", side_effect=CircuitOpen("destination", 7))
+def test_open_breaker_answers_503_with_retry_after(mock_get_json):
+    body, status, headers = app_module.fetch_destinations()
+    assert status == 503
+    assert headers == {"Retry-After": "7"}
+    assert "circuit open" in body["message"]
+
+
+@patch("app.verify_token", return_value={"email": "user@example.com", "role": "User"})
+@patch("app.upstream.get", side_effect=CircuitOpen("user", 4))
+def test_open_user_breaker_answers_503_with_retry_after(mock_get, mock_verify_token):
+    client = app_module.app.test_client()
+    headers = {"Authorization": "Bearer token"}
+    with patch("app.fetch_destinations", return_value=([], 200, {})):
+        for path in ("/auth/profile", "/auth/overview"):
+            response = client.get(path, headers=headers)
+            assert response.status_code == 503
+            assert response.headers["Retry-After"] == "4"
+
+
+def test_breaker_state_is_exported_in_metrics():
+    app_module.upstream.breaker("http://localhost:5001/users/profile")
+    metrics = app_module.app.test_client().get("/metrics").get_data(as_text=True)
+    assert "breaker_user_state 0" in metrics
+    assert "breaker_user_trips 0" in metrics
@@ -0,0 +1,161 @@
+import asyncio
+import datetime
+import jwt
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestClient, TestServer
+from app import SECRET_KEY
+from breaker import CircuitBreaker
+from gateway import create_gateway, fetch_json
+
+PROFILE = {"name": "John Doe", "email": "user@example.com", "role": "User"}
+DESTINATIONS = [{"id": 1, "name": "Paris"}, {"id": 2, "name": "Tokyo"}]
+DESTINATION_CALLS = []
+
+
+def make_token(role="User"):
+    exp = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+    return jwt.encode(
+        {"email": "user@example.com", "role": role, "exp": exp},
+        SECRET_KEY,
+        algorithm="HS256",
+    )
+
+
+async def fake_profile(request):
+    await asyncio.sleep(0.2)
+    return web.json_response(PROFILE)
+
+
+async def fake_destinations(request):
+    DESTINATION_CALLS.append(request.path_qs)
+    await asyncio.sleep(0.2)
+    if request.query:
+        return web.json_response([dict(request.query)], headers={"X-Next-After": "3"})
+    if request.headers.get("If-None-Match") == '"v1"':
+        return web.Response(status=304, headers={"ETag": '"v1"'})
+    return web.json_response(DESTINATIONS, headers={"ETag": '"v1"'})
+
+
+def run_gateway(check, upstream_up=True):
+    """Start fake upstreams and the gateway, then run check(client)"""
+
+    async def main():
+        upstream = web.Application()
+        upstream.router.add_get("/users/profile", fake_profile)
+        upstream.router.add_get("/destinations/", fake_destinations)
+        async with TestServer(upstream) as server:
+            url = str(server.make_url("")).rstrip("/")
+            if not upstream_up:
+                url = "http://127.0.0.1:1"
+            async with TestClient(TestServer(create_gateway(url, url))) as client:
+                return await check(client)
+
+    return asyncio.run(main())
+
+
+def auth(role="User"):
+    return {"Authorization": f"Bearer {make_token(role)}"}
+
+
+def test_gateway_profile():
+    async def check(client):
+        response = await client.get("/auth/profile", headers=auth())
+        return response.status, await response.json()
+
+    assert run_gateway(check) == (200, PROFILE)
+
+
+def test_gateway_missing_token():
+    async def check(client):
+        response = await client.get("/auth/destinations")
+        return response.status, await response.json()
+
+    assert run_gateway(check) == (401, {"message": "Token is missing or invalid"})
+
+
+def test_gateway_forbidden_role():
+    async def check(client):
+        response = await client.get("/auth/destinations", headers=auth("Guest"))
+        return response.status
+
+    assert run_gateway(check) == 403
+
+
+def test_gateway_overview_fetches_concurrently():
+    async def check(client):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        response = await client.get("/auth/overview", headers=auth())
+        return response.status, await response.json(), loop.time() - start
+
+    status, body, elapsed = run_gateway(check)
+    assert status == 200
+    assert body == {"profile": PROFILE, "destinations": DESTINATIONS}
+    # Both upstreams sleep 0.2s; sequential calls would take at least 0.4s
+    assert elapsed < 0.38
+
+
+def test_gateway_upstream_error():
+    async def check(client):
+        response = await client.get("/auth/profile", headers=auth())
+        return response.status, await response.json()
+
+    status, body = run_gateway(check, upstream_up=False)
+    assert status == 500
+    assert "Error communicating with User Service" in body["message"]
+
+
+def test_gateway_revalidates_destinations_with_etag():
+    async def check(client):
+        first = await client.get("/auth/destinations", headers=auth())
+        second = await client.get("/auth/destinations", headers=auth())
+        return await first.json(), second.status, await second.json()
+
+    assert run_gateway(check) == (DESTINATIONS, 200, DESTINATIONS)
+
+
+def test_gateway_passes_page_params_through():
+    async def check(client):
+        response = await client.get(
+            "/auth/destinations?limit=2&after=1&debug=1", headers=auth()
+        )
+        return await response.json(), response.headers.get("X-Next-After")
+
+    assert run_gateway(check) == ([{"after": "1", "limit": "2"}], "3")
+
+
+def test_gateway_shares_identical_concurrent_upstream_calls():
+    async def check(client):
+        DESTINATION_CALLS.clear()
+        responses = await asyncio.gather(
+            *(client.get("/auth/destinations", headers=auth()) for _ in range(5)),
+            client.get("/auth/destinations?limit=1", headers=auth()),
+        )
+        return [await r.json() for r in responses], list(DESTINATION_CALLS)
+
+    bodies, calls = run_gateway(check)
+    assert bodies[:5] == [DESTINATIONS] * 5
+    assert bodies[5] == [{"limit": "1"}]
+    # One call per distinct page instead of one per client request
+    assert sorted(calls) == ["/destinations/", "/destinations/?limit=1"]
+
+
+def test_gateway_client_errors_are_not_breaker_failures():
+    async def expired(request):
+        return web.json_response({"message": "Token has expired"}, status=401)
+
+    async def main():
+        upstream = web.Application()
+        upstream.router.add_get("/users/profile", expired)
+        breaker = CircuitBreaker("user")
+        async with TestServer(upstream) as server, ClientSession() as client:
+            url = str(server.make_url("/users/profile"))
+            _, status, _ = await fetch_json(
+                client, url, "User Service", breaker=breaker
+            )
+        return status, breaker.stats()
+
+    status, stats = asyncio.run(main())
+    assert status == 500
+    assert stats["window_calls"] == 1
+    assert stats["window_failures"] == 0
@@ -0,0 +1,275 @@
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent import futures
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from breaker import CLOSED
+
+
+class UpstreamClient:
+    """Pooled, keep-alive HTTP client for calls to the other services.
+
+    Every thread gets its own ``requests.Session`` (sessions are not
+    thread-safe), but all of them share one connection pool, so sockets are
+    reused across requests and threads. Idempotent GETs are retried with
+    exponential backoff on connection errors and 502/503/504.
+
+    With a ``breaker`` factory, each upstream origin gets a circuit breaker
+    (named after its entry in ``upstreams``, a ``{name: base_url}`` dict)
+    and calls to an unhealthy one fail fast with CircuitOpen. With
+    ``hedge``, a GET still unanswered after the origin's p95 latency (at
+    least ``hedge_min_delay``) is sent a second time and the first response
+    wins; at most ``hedge_budget`` of all requests are hedges.
+    """
+
+    def __init__(
+        self,
+        pool_size=20,
+        connect_timeout=2.0,
+        read_timeout=5.0,
+        retries=2,
+        backoff=0.1,
+        conditional_cache_size=256,
+        upstreams=None,
+        breaker=None,
+        hedge=False,
+        hedge_min_delay=0.02,
+        hedge_budget=0.1,
+    ):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._adapter = None
+        self._adapter_pid = None
+        self._in_flight = 0
+        self._requests = 0
+        self._errors = 0
+        self.conditional_cache_size = conditional_cache_size
+        self._conditional = OrderedDict()
+        self._not_modified = 0
+        self._names = {_origin(url): name for name, url in (upstreams or {}).items()}
+        self._breaker_factory = breaker
+        self._breakers = {}
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_budget = hedge_budget
+        self._hedge_pool = None
+        self._hedge_pool_pid = None
+        self._hedges = 0
+        self._hedge_wins = 0
+
+    def _make_adapter(self):
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.backoff,
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            status_forcelist=(502, 503, 504),
+            raise_on_status=False,
+        )
+        return HTTPAdapter(
+            pool_connections=4, pool_maxsize=self.pool_size, max_retries=retry
+        )
+
+    def _session(self):
+        # Sockets must not be shared with a parent process after a fork
+        with self._lock:
+            if self._adapter is None or self._adapter_pid != os.getpid():
+                self._adapter = self._make_adapter()
+                self._adapter_pid = os.getpid()
+                self._local = threading.local()
+            adapter = self._adapter
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._local.session = session
+        return session
+
+    def breaker(self, url):
+        """The circuit breaker of url's origin, or None without a factory"""
+        if self._breaker_factory is None:
+            return None
+        origin = _origin(url)
+        with self._lock:
+            breaker = self._breakers.get(origin)
+            if breaker is None:
+                name = self._names.get(origin, urlsplit(url).netloc)
+                breaker = self._breakers[origin] = self._breaker_factory(name)
+            return breaker
+
+    def get(self, url, **kwargs):
+        """GET url through the shared pool with the configured timeouts"""
+        if self.hedge:
+            return self._hedged_get(url, **kwargs)
+        return self._send("get", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """POST through the shared pool; never retried, as it may not be idempotent"""
+        return self._send("post", url, **kwargs)
+
+    def _send(self, method, url, **kwargs):
+        breaker = self.breaker(url)
+        probe = breaker.allow() if breaker is not None else False
+        kwargs.setdefault("timeout", self.timeout)
+        session = self._session()
+        with self._lock:
+            self._in_flight += 1
+            self._requests += 1
+        ok = False
+        start = time.perf_counter()
+        try:
+            response = getattr(session, method)(url, **kwargs)
+            # A 4xx is the caller's mistake, not a sign of an unhealthy upstream
+            ok = response.ok or response.status_code < 500
+            return response
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            if breaker is not None:
+                breaker.record(time.perf_counter() - start, ok, probe)
+
+    def _pool(self):
+        with self._lock:
+            if self._hedge_pool is None or self._hedge_pool_pid != os.getpid():
+                self._hedge_pool = futures.ThreadPoolExecutor(
+                    max_workers=2 * self.pool_size, thread_name_prefix="upstream"
+                )
+                self._hedge_pool_pid = os.getpid()
+            return self._hedge_pool
+
+    def _hedged_get(self, url, **kwargs):
+        breaker = self.breaker(url)
+        p95 = breaker.percentile(0.95) if breaker is not None else None
+        if p95 is None or breaker.state != CLOSED:
+            return self._send("get", url, **kwargs)
+        pool = self._pool()
+        # Each attempt runs in the caller's context, like /auth/overview's calls
+        first = pool.submit(
+            contextvars.copy_context().run, self._send, "get", url, **kwargs
+        )
+        try:
+            return first.result(timeout=max(p95, self.hedge_min_delay))
+        except futures.TimeoutError:
+            pass
+        with self._lock:
+            if self._hedges >= self.hedge_budget * self._requests:
+                hedge = None
+            else:
+                self._hedges += 1
+                hedge = pool.submit(
+                    contextvars.copy_context().run, self._send, "get", url, **kwargs
+                )
+        if hedge is None:
+            return first.result()
+        pending = {first, hedge}
+        while pending:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for attempt in done:
+                if attempt.exception() is None:
+                    if attempt is hedge:
+                        with self._lock:
+                            self._hedge_wins += 1
+                    for other in pending:
+                        other.add_done_callback(_discard)
+                    return attempt.result()
+        return first.result()  # Both failed: raise the original attempt's error
+
+    def get_json(self, url, **kwargs):
+        """GET a JSON body, revalidating the last copy with If-None-Match.
+
+        Returns ``(body, headers)``. Responses that carry an ETag are
+        remembered per URL, so an unchanged resource costs a 304 instead of a
+        full transfer and parse. Only use this for responses that do not
+        depend on the caller's credentials.
+        """
+        with self._lock:
+            cached = self._conditional.get(url)
+        headers = dict(kwargs.pop("headers", None) or {})
+        if cached is not None:
+            headers["If-None-Match"] = cached[0]
+        response = self.get(url, headers=headers, **kwargs)
+        if response.status_code == 304 and cached is not None:
+            with self._lock:
+                self._not_modified += 1
+                if url in self._conditional:
+                    self._conditional.move_to_end(url)
+            return cached[1], cached[2]
+        response.raise_for_status()
+        body = response.json()
+        etag = response.headers.get("ETag")
+        with self._lock:
+            if etag:
+                self._conditional[url] = (etag, body, response.headers)
+                self._conditional.move_to_end(url)
+                while len(self._conditional) > self.conditional_cache_size:
+                    self._conditional.popitem(last=False)
+            else:
+                self._conditional.pop(url, None)
+        return body, response.headers
+
+    def stats(self):
+        pools = []
+        with self._lock:
+            adapter = self._adapter
+            stats = {
+                "pool_size": self.pool_size,
+                "in_flight": self._in_flight,
+                "requests": self._requests,
+                "errors": self._errors,
+                "not_modified": self._not_modified,
+                "hedges": self._hedges,
+                "hedge_wins": self._hedge_wins,
+                "conditional_cache_size": len(self._conditional),
+                "pools": pools,
+            }
+        if adapter is not None:
+            manager = adapter.poolmanager
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is None:
+                    continue
+                pools.append(
+                    {
+                        "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                        "connections_opened": pool.num_connections,
+                        "requests": pool.num_requests,
+                        "idle": (
+                            sum(1 for conn in list(pool.pool.queue) if conn is not None)
+                            if pool.pool
+                            else 0
+                        ),
+                    }
+                )
+        return stats
+
+    def breaker_stats(self):
+        """State, trips and window counts of every upstream's breaker"""
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.stats() for breaker in breakers}
+
+
+def _origin(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _discard(attempt):
+    # The losing attempt of a hedged GET: hand its connection back
+    if attempt.exception() is None:
+        attempt.result().close()
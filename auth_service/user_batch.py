@@ -0,0 +1,99 @@
+import threading
+
+
+class _Batch:
+    def __init__(self):
+        self.emails = set()
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.users = None
+        self.error = None
+
+
+class UserBatcher:
+    """Coalesces concurrent user lookups into batched calls.
+
+    The first caller opens a batch and waits up to ``window`` seconds (less
+    if the batch reaches ``max_batch`` emails) for other threads to add
+    theirs, then makes a single ``fetch(emails)`` call that returns
+    ``{email: profile}``. Every caller gets the profiles it asked for, or
+    the exception the fetch raised.
+    """
+
+    def __init__(self, fetch, window=0.002, max_batch=100):
+        self.fetch = fetch
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._open = None
+        self.lookups = 0
+        self.batches = 0
+        self.emails = 0
+        self.errors = 0
+
+    def get(self, email):
+        """Profile of one user, or None if there is no such user"""
+        return self.get_many([email]).get(email)
+
+    def get_many(self, emails):
+        """Return ``{email: profile}`` for the emails that are registered"""
+        emails = list(dict.fromkeys(emails))
+        with self._lock:
+            self.lookups += 1
+        joined = [
+            (chunk, *self._join(chunk))
+            for chunk in (
+                emails[i : i + self.max_batch]
+                for i in range(0, len(emails), self.max_batch)
+            )
+        ]
+        users = {}
+        for chunk, batch, leader in joined:
+            if leader:
+                self._run(batch)
+            else:
+                batch.done.wait()
+            if batch.error is not None:
+                raise batch.error
+            users.update((e, batch.users[e]) for e in chunk if e in batch.users)
+        return users
+
+    def _join(self, chunk):
+        with self._lock:
+            batch = self._open
+            leader = batch is None or len(batch.emails.union(chunk)) > self.max_batch
+            if leader:
+                if batch is not None:
+                    batch.full.set()  # Its leader need not wait any longer
+                batch = self._open = _Batch()
+            batch.emails.update(chunk)
+            if len(batch.emails) >= self.max_batch:
+                self._open = None
+                batch.full.set()
+        return batch, leader
+
+    def _run(self, batch):
+        if self.window:
+            batch.full.wait(self.window)
+        with self._lock:
+            if self._open is batch:
+                self._open = None
+        try:
+            batch.users = self.fetch(sorted(batch.emails))
+        except Exception as e:
+            batch.error = e
+        finally:
+            with self._lock:
+                self.batches += 1
+                self.emails += len(batch.emails)
+                self.errors += batch.error is not None
+            batch.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "lookups": self.lookups,
+                "batches": self.batches,
+                "emails": self.emails,
+                "errors": self.errors,
+            }
@@ -0,0 +1,138 @@
+"""Per-operation cost of the indexed destination store against catalog size.
+
+Times add / get / update / delete / page / search on DestinationStore next to the
+linear scans the routes used before (max() for the next id, a lowercase
+any() for duplicates, next() to find by id or name). File writes are left
+out so the numbers show the in-memory work only.
+
+    python benchmarks/bench_destination_store.py --sizes 10000 100000 1000000
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "destination_service"))
+
+from destination_store import DestinationStore  # noqa: E402
+
+
+def make_catalog(count):
+    return [
+        {
+            "name": f"Destination {i}",
+            "description": f"Description {i}",
+            "location": f"Country {i % 200}",
+            "id": i + 1,
+        }
+        for i in range(count)
+    ]
+
+
+def per_op_us(fn, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        fn(i)
+    return round((time.perf_counter() - start) / repeat * 1e6, 3)
+
+
+def bench_indexed(catalog, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        store = DestinationStore(Path(tmp) / "destinations.json", write_window=0)
+        store.replace(catalog)
+        store._commit = lambda: None  # Keep disk writes out of the timings
+        count = len(catalog)
+        return {
+            "add_us": per_op_us(
+                lambda i: store.add(
+                    {"name": f"New {i}", "description": "d", "location": "l"}
+                ),
+                repeat,
+            ),
+            "get_by_id_us": per_op_us(lambda i: store.get(count - i), repeat),
+            "update_by_name_us": per_op_us(
+                lambda i: store.update(
+                    f"Destination {count - 1 - i}", {"description": "u"}
+                ),
+                repeat,
+            ),
+            "delete_us": per_op_us(lambda i: store.delete(count - i), repeat),
+            "page_us": per_op_us(lambda i: store.page(100, after=count // 2), repeat),
+            "search_us": per_op_us(
+                lambda i: store.search(f"country {i % 200} descr"), repeat
+            ),
+        }
+
+
+def bench_linear(catalog, repeat):
+    catalog = list(catalog)
+    count = len(catalog)
+
+    def add(i):
+        name = f"New {i}"
+        if any(d["name"].lower() == name.lower() for d in catalog):
+            return
+        catalog.append(
+            {
+                "name": name,
+                "description": "d",
+                "location": "l",
+                "id": max(d["id"] for d in catalog) + 1,
+            }
+        )
+
+    def delete(i):
+        dest = next((d for d in catalog if d["id"] == count - i), None)
+        catalog.remove(dest)
+
+    return {
+        "add_us": per_op_us(add, repeat),
+        "get_by_id_us": per_op_us(
+            lambda i: next(d for d in catalog if d["id"] == count - i), repeat
+        ),
+        "update_by_name_us": per_op_us(
+            lambda i: next(
+                d for d in catalog if d["name"] == f"Destination {count - 1 - i}"
+            ),
+            repeat,
+        ),
+        "delete_us": per_op_us(delete, repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000, 1000000]
+    )
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    for count in args.sizes:
+        catalog = make_catalog(count)
+        print(
+            json.dumps(
+                {
+                    "destinations": count,
+                    "store": "indexed",
+                    **bench_indexed(catalog, args.repeat),
+                }
+            )
+        )
+        print(
+            json.dumps(
+                {
+                    "destinations": count,
+                    "store": "linear",
+                    **bench_linear(catalog, args.repeat),
+                }
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Signing and verification throughput of HS256, RS256 and EdDSA tokens.
+
+Uses common.tokens exactly as the services do: a TokenSigner as in
+user_service and a TokenVerifier with a loaded key set as in
+destination_service and auth_service (without the claims cache, so every
+call checks a signature).
+
+    python benchmarks/bench_jwt.py --tokens 2000
+"""
+
+import argparse
+import datetime
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from common.tokens import JwksKeySet, TokenSigner, TokenVerifier  # noqa: E402
+
+ALGORITHMS = ("HS256", "RS256", "EdDSA")
+SECRET = "benchmark-secret-" + "x" * 16  # At least 32 bytes, as PyJWT recommends
+
+
+def rate(fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    elapsed = time.perf_counter() - start
+    return len(items) / elapsed, elapsed / len(items) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument("--algorithms", nargs="*", default=ALGORITHMS)
+    args = parser.parse_args()
+
+    exp = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+    claims = [
+        {"email": f"user{i}@example.com", "role": "User", "exp": exp}
+        for i in range(args.tokens)
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        for algorithm in args.algorithms:
+            signer = TokenSigner(
+                algorithm, secret=SECRET, key_file=Path(tmp) / f"{algorithm}.pem"
+            )
+            verifier = TokenVerifier(
+                algorithm,
+                secret=SECRET,
+                key_set=JwksKeySet("", fetch=signer.jwks),
+            )
+            verifier.warm()
+            sign_rate, sign_us = rate(signer.sign, claims)
+            tokens = [signer.sign(c) for c in claims]
+            verify_rate, verify_us = rate(verifier.decode, tokens)
+            verifier.close()
+            print(
+                json.dumps(
+                    {
+                        "algorithm": algorithm,
+                        "tokens": args.tokens,
+                        "token_bytes": len(tokens[0]),
+                        "sign_per_s": round(sign_rate),
+                        "sign_us": round(sign_us, 1),
+                        "verify_per_s": round(verify_rate),
+                        "verify_us": round(verify_us, 1),
+                    }
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
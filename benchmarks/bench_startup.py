@@ -0,0 +1,88 @@
+"""Startup cost of each service: import, app construction and first request.
+
+Every run is a fresh interpreter started in the service's directory, as a
+gunicorn worker (or a preloading master) would be:
+
+    python benchmarks/bench_startup.py --runs 10
+    python benchmarks/bench_startup.py --swagger on off
+
+``import_ms`` covers ``import app``, ``build_ms`` the construction of the
+Flask app, ``first_request_ms`` one request to /metrics and ``max_rss_kb``
+the peak resident memory of the process afterwards.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SERVICES = ("user_service", "destination_service", "auth_service")
+
+PROBE = """
+import json, resource, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.app
+built = time.perf_counter()
+flask_app.test_client().get("/metrics")
+served = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "build_ms": (built - imported) * 1000,
+    "first_request_ms": (served - built) * 1000,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+"""
+
+
+def probe(service, env):
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=ROOT / service,
+        env={**os.environ, **env},
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--services", nargs="*", default=SERVICES)
+    parser.add_argument("--swagger", nargs="*", default=["on"], choices=["on", "off"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for swagger in args.swagger:
+            env = {
+                "USER_FILE": str(Path(tmp) / "user.json"),
+                "DEST_FILE": str(Path(tmp) / "destinations.json"),
+                "SWAGGER_ENABLED": "true" if swagger == "on" else "false",
+            }
+            for service in args.services:
+                runs = [probe(service, env) for _ in range(args.runs)]
+                print(
+                    json.dumps(
+                        {
+                            "service": service,
+                            "swagger": swagger,
+                            "runs": args.runs,
+                            **{
+                                key: round(statistics.median(r[key] for r in runs), 2)
+                                for key in runs[0]
+                            },
+                        }
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Login/profile latency against user count for the user_service store.
+
+Seeds a temporary user file at each size, then times /users/login and
+/users/profile through the Flask test client, next to the old
+"parse the whole file and scan it" lookup for comparison. Rate limits are
+off and sessions go to the temporary directory for the run.
+
+    python benchmarks/bench_user_store.py --sizes 1000 10000 100000
+"""
+
+import argparse
+import datetime
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "user_service"))
+
+import bcrypt  # noqa: E402
+import jwt  # noqa: E402
+
+import app as user_app  # noqa: E402
+from common.revocation import RevocationList  # noqa: E402
+from sessions import SessionStore  # noqa: E402
+from user_store import UserStore  # noqa: E402
+
+PASSWORD = "SecureP@ss123"
+
+# A low cost factor keeps the seeding and the login timings about lookups;
+# the hasher is set to it too, so logins do not rehash at BCRYPT_ROUNDS
+SEED_ROUNDS = 4
+
+
+def seed(path, count):
+    hashed = bcrypt.hashpw(
+        PASSWORD.encode("utf-8"), bcrypt.gensalt(SEED_ROUNDS)
+    ).decode("utf-8")
+    users = [
+        {
+            "name": f"User {i}",
+            "email": f"user{i}@example.com",
+            "password": hashed,
+            "role": "User",
+        }
+        for i in range(count)
+    ]
+    with open(path, "w") as f:
+        json.dump(users, f, indent=4)
+    return users[-1]["email"]
+
+
+def scan_lookup(path, email):
+    with open(path, "r") as f:
+        users = json.load(f)
+    return next((u for u in users if u["email"] == email), None)
+
+
+def ok(response):
+    # A throttled or failed request would time the error path instead
+    assert response.status_code == 200, response.get_json()
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000
+
+
+def run(count, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "user.json"
+        email = seed(path, count)
+        token = jwt.encode(
+            {
+                "email": email,
+                "role": "User",
+                "exp": datetime.datetime.utcnow() + datetime.timedelta(hours=1),
+            },
+            user_app.app.config["SECRET_KEY"],
+            algorithm="HS256",
+        )
+        store = UserStore(path)
+        store.refresh()
+        sessions = SessionStore(Path(tmp) / "sessions.db")
+        revocations = RevocationList(sessions.revocations)
+        with patch.object(user_app, "user_store", store), patch.object(
+            user_app, "session_store", sessions
+        ), patch.object(user_app, "revocations", revocations), patch.object(
+            user_app.hasher, "rounds", SEED_ROUNDS
+        ), patch.object(
+            user_app.limiter, "enabled", False
+        ):
+            client = user_app.app.test_client()
+            login = timed(
+                lambda: ok(
+                    client.post(
+                        "/users/login", json={"email": email, "password": PASSWORD}
+                    )
+                ),
+                repeat,
+            )
+            profile = timed(
+                lambda: ok(
+                    client.get(
+                        "/users/profile", headers={"Authorization": f"Bearer {token}"}
+                    )
+                ),
+                repeat,
+            )
+        revocations.close()
+        sessions.close()
+        scan = timed(lambda: scan_lookup(path, email), repeat)
+    return {
+        "users": count,
+        "login_ms": round(login, 3),
+        "profile_ms": round(profile, 3),
+        "full_scan_lookup_ms": round(scan, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    for count in args.sizes:
+        print(json.dumps(run(count, args.repeat)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Write throughput of the JSON destination store under contention.
+
+Every writer process runs several threads adding destinations to one
+shared file. Reports writes per second, how many flushes the in-process
+coalescing needed, and checks that no write was lost.
+
+    python benchmarks/bench_write_contention.py --processes 1 2 4 --threads 8
+"""
+
+import argparse
+import json
+import multiprocessing
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "destination_service"))
+
+from destination_store import DestinationStore  # noqa: E402
+
+
+def writer(path, worker, threads, writes, window, batches):
+    store = DestinationStore(path, write_window=window)
+
+    def run(thread):
+        for i in range(writes):
+            store.add(
+                {
+                    "name": f"Place {worker}-{thread}-{i}",
+                    "description": "d",
+                    "location": "l",
+                }
+            )
+
+    pool = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    batches.put(store._writer.stats()["batches"])
+
+
+def bench(processes, threads, writes, window):
+    context = multiprocessing.get_context("fork")
+    batches = context.Queue()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "destinations.json"
+        workers = [
+            context.Process(
+                target=writer, args=(path, p, threads, writes, window, batches)
+            )
+            for p in range(processes)
+        ]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        stored = len(json.loads(path.read_text()))
+    total = processes * threads * writes
+    return {
+        "processes": processes,
+        "threads": threads,
+        "window_ms": window * 1000,
+        "writes": total,
+        "stored": stored,
+        "flushes": sum(batches.get() for _ in workers),
+        "writes_per_s": round(total / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=50)
+    parser.add_argument("--window-ms", type=float, nargs="+", default=[0, 2])
+    args = parser.parse_args()
+    for processes in args.processes:
+        for window_ms in args.window_ms:
+            result = bench(processes, args.threads, args.writes, window_ms / 1000)
+            print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+"""End-to-end load test of user_service, destination_service and auth_service.
+
+Starts the three services on local ports against temporary data files,
+seeds synthetic users and destinations, then drives each endpoint at a
+fixed concurrency and prints one JSON object per endpoint with latency
+percentiles and throughput:
+
+    python benchmarks/loadtest.py --users 10000 --destinations 10000 \\
+        --concurrency 16 --requests 2000 --output before.jsonl
+    python benchmarks/loadtest.py ... --compare before.jsonl
+
+Seeded passwords use a low bcrypt cost (``--bcrypt-rounds``) so the numbers
+show the services rather than the hash function; raise it to measure login
+as deployed.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import bcrypt
+import requests
+
+ROOT = Path(__file__).resolve().parent.parent
+PASSWORD = "SecureP@ss123"
+ADMIN_SECRET = "supersecretkey"
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, round(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def seed(data_dir, users, destinations, rounds):
+    hashed = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(rounds)).decode(
+        "utf-8"
+    )
+    with open(data_dir / "user.json", "w") as f:
+        json.dump(
+            [
+                {
+                    "name": f"User {i}",
+                    "email": f"user{i}@example.com",
+                    "password": hashed,
+                    "role": "User",
+                }
+                for i in range(users)
+            ],
+            f,
+        )
+    with open(data_dir / "destinations.json", "w") as f:
+        json.dump(
+            [
+                {
+                    "name": f"Destination {i}",
+                    "description": f"Description {i}",
+                    "location": f"Country {i % 200}",
+                    "id": i + 1,
+                }
+                for i in range(destinations)
+            ],
+            f,
+        )
+
+
+def start_service(name, port, env, server="gunicorn"):
+    if server == "gunicorn":
+        # The production entry point; WEB_WORKERS/WEB_THREADS come from env
+        command = [sys.executable, "app.py"]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "app", "run"]
+    process = subprocess.Popen(
+        command + ([] if server == "gunicorn" else ["--port", str(port)]),
+        cwd=ROOT / name,
+        env={**os.environ, **env, "PORT": str(port), "HOST": "127.0.0.1"},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{name} exited with code {process.returncode}")
+        try:
+            requests.get(f"{url}/metrics", timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"{name} did not start on port {port}")
+
+
+class Scenario:
+    """One endpoint: a function that sends a request and returns the response"""
+
+    def __init__(self, name, send, expect):
+        self.name = name
+        self.send = send
+        self.expect = expect
+
+
+def build_scenarios(urls, tokens, seeded_users, seeded_destinations):
+    user_url, dest_url, auth_url = urls
+    user_auth = {"Authorization": f"Bearer {tokens['user']}"}
+    admin_auth = {"Authorization": f"Bearer {tokens['admin']}"}
+    counter = itertools.count()
+    created = []
+    created_lock = threading.Lock()
+    # Each refresh consumes a token and puts its successor back
+    refresh_tokens = list(tokens["refresh"])
+
+    def register(session):
+        n = next(counter)
+        return session.post(
+            f"{user_url}/users/register",
+            json={
+                "name": f"Load {n}",
+                "email": f"load{n}-{os.getpid()}@example.com",
+                "password": PASSWORD,
+            },
+        )
+
+    def login(session):
+        n = next(counter) % seeded_users
+        return session.post(
+            f"{user_url}/users/login",
+            json={"email": f"user{n}@example.com", "password": PASSWORD},
+        )
+
+    def refresh(session):
+        with created_lock:
+            refresh_token = refresh_tokens.pop()
+        response = session.post(
+            f"{user_url}/users/refresh", json={"refresh_token": refresh_token}
+        )
+        with created_lock:
+            refresh_tokens.append(
+                response.json()["refresh_token"]
+                if response.status_code == 200
+                else refresh_token
+            )
+        return response
+
+    def create(session):
+        response = session.post(
+            f"{dest_url}/destinations/",
+            json={
+                "name": f"Load place {next(counter)}",
+                "description": "Synthetic",
+                "location": "Loadland",
+            },
+            headers=admin_auth,
+        )
+        if response.status_code == 201:
+            with created_lock:
+                created.append(response.json()["id"])
+        return response
+
+    def update(session):
+        n = next(counter) % seeded_destinations
+        return session.put(
+            f"{dest_url}/destinations/Destination {n}",
+            json={"description": f"Updated {n}"},
+            headers=admin_auth,
+        )
+
+    def delete(session):
+        with created_lock:
+            dest_id = created.pop() if created else None
+        if dest_id is None:
+            return None  # Nothing left to delete; not counted
+        return session.delete(f"{dest_url}/destinations/{dest_id}", headers=admin_auth)
+
+    return [
+        Scenario("user.register", register, 201),
+        Scenario("user.login", login, 200),
+        Scenario("user.refresh", refresh, 200),
+        Scenario(
+            "user.profile",
+            lambda s: s.get(f"{user_url}/users/profile", headers=user_auth),
+            200,
+        ),
+        Scenario(
+            "destination.list_page",
+            lambda s: s.get(f"{dest_url}/destinations/?limit=100"),
+            200,
+        ),
+        Scenario("destination.create", create, 201),
+        Scenario("destination.update", update, 200),
+        Scenario("destination.delete", delete, 200),
+        Scenario(
+            "auth.profile",
+            lambda s: s.get(f"{auth_url}/auth/profile", headers=user_auth),
+            200,
+        ),
+        Scenario(
+            "auth.destinations",
+            lambda s: s.get(
+                f"{auth_url}/auth/destinations?limit=100", headers=user_auth
+            ),
+            200,
+        ),
+        Scenario(
+            "auth.overview",
+            lambda s: s.get(f"{auth_url}/auth/overview", headers=user_auth),
+            200,
+        ),
+    ]
+
+
+def run_scenario(scenario, total, concurrency):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    local = threading.local()
+    remaining = itertools.count()
+
+    def worker():
+        nonlocal errors
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        while next(remaining) < total:
+            start = time.perf_counter()
+            try:
+                response = scenario.send(session)
+            except requests.RequestException:
+                response = False
+            elapsed = (time.perf_counter() - start) * 1000
+            if response is None:
+                continue
+            with lock:
+                latencies.append(elapsed)
+                if response is False or response.status_code != scenario.expect:
+                    errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    wall = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "endpoint": scenario.name,
+        "requests": len(latencies),
+        "errors": errors,
+        "concurrency": concurrency,
+        "p50_ms": round(percentile(latencies, 50), 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 3) if latencies else None,
+        "throughput_rps": round(len(latencies) / wall, 1) if wall else None,
+    }
+
+
+def login(url, email, password):
+    response = requests.post(
+        f"{url}/users/login", json={"email": email, "password": password}
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {
+            row["endpoint"]: row for row in map(json.loads, f) if "endpoint" in row
+        }
+    for row in results:
+        before = baseline.get(row["endpoint"])
+        if not before:
+            continue
+        deltas = {
+            key: round(row[key] / before[key], 3)
+            for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps")
+            if row.get(key) and before.get(key)
+        }
+        print(json.dumps({"endpoint": row["endpoint"], "ratio_vs_baseline": deltas}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--destinations", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=500, help="Per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--bcrypt-rounds", type=int, default=4)
+    parser.add_argument("--base-port", type=int, default=15001)
+    parser.add_argument(
+        "--server",
+        choices=["gunicorn", "flask"],
+        default="gunicorn",
+        help="Production entry point or the Flask development server",
+    )
+    parser.add_argument("--workers", type=int, default=2, help="WEB_WORKERS")
+    parser.add_argument("--threads", type=int, default=8, help="WEB_THREADS")
+    parser.add_argument(
+        "--endpoints", nargs="*", help="Only run endpoints with these names"
+    )
+    parser.add_argument("--output", help="Also write the results to this file")
+    parser.add_argument("--compare", help="Results file of an earlier run")
+    args = parser.parse_args()
+
+    processes = []
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = Path(tmp)
+        seed(data_dir, args.users, args.destinations, args.bcrypt_rounds)
+        env = {
+            "USER_FILE": str(data_dir / "user.json"),
+            "DEST_FILE": str(data_dir / "destinations.json"),
+            "SESSION_DB_FILE": str(data_dir / "sessions.db"),
+            "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+            # Every simulated client shares one address and a few accounts
+            "RATE_LIMIT_ENABLED": "false",
+            "WEB_WORKERS": str(args.workers),
+            "WEB_THREADS": str(args.threads),
+        }
+        try:
+            ports = [args.base_port + i for i in range(3)]
+            user = start_service("user_service", ports[0], env, args.server)
+            # Verifies tokens with the keys user_service publishes, if any
+            dest = start_service(
+                "destination_service",
+                ports[1],
+                {**env, "USER_SERVICE_URL": user[1]},
+                args.server,
+            )
+            processes += [user[0], dest[0]]
+            auth = start_service(
+                "auth_service",
+                ports[2],
+                {
+                    **env,
+                    "USER_SERVICE_URL": user[1],
+                    "DESTINATION_SERVICE_URL": dest[1],
+                },
+                args.server,
+            )
+            processes.append(auth[0])
+            urls = (user[1], dest[1], auth[1])
+
+            requests.post(
+                f"{urls[0]}/users/register",
+                json={
+                    "name": "Load Admin",
+                    "email": "admin@example.com",
+                    "password": PASSWORD,
+                    "role": "Admin",
+                    "secret_key": ADMIN_SECRET,
+                },
+            ).raise_for_status()
+            # One session per concurrent client for the refresh scenario
+            sessions = [
+                login(urls[0], "user0@example.com", PASSWORD)
+                for _ in range(args.concurrency)
+            ]
+            tokens = {
+                "user": sessions[0]["token"],
+                "admin": login(urls[0], "admin@example.com", PASSWORD)["token"],
+                "refresh": [s["refresh_token"] for s in sessions],
+            }
+
+            scenarios = build_scenarios(
+                urls, tokens, max(args.users, 1), max(args.destinations, 1)
+            )
+            meta = {
+                "commit": git_commit(),
+                "users": args.users,
+                "destinations": args.destinations,
+                "bcrypt_rounds": args.bcrypt_rounds,
+                "server": args.server,
+                "workers": args.workers,
+                "threads": args.threads,
+            }
+            results = []
+            for scenario in scenarios:
+                if args.endpoints and scenario.name not in args.endpoints:
+                    continue
+                result = {
+                    **run_scenario(scenario, args.requests, args.concurrency),
+                    **meta,
+                }
+                results.append(result)
+                print(json.dumps(result), flush=True)
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
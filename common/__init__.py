@@ -0,0 +1 @@
+"""Code shared by user_service, destination_service and auth_service."""
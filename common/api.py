@@ -0,0 +1,32 @@
+from flask_restx import Api
+
+from common.config import SWAGGER_ENABLED
+
+# Define the security schema for Swagger UI
+AUTHORIZATIONS = {
+    "Bearer": {
+        "type": "apiKey",
+        "in": "header",
+        "name": "Authorization",
+        "description": "Enter 'Bearer <your-token>'",
+    }
+}
+
+
+def create_api(app, title, namespaces):
+    """Attach a Flask-RESTX Api with the Bearer scheme and the given namespaces.
+
+    With SWAGGER_ENABLED off neither the UI nor /swagger.json is served, so
+    the spec is never generated.
+    """
+    api = Api(
+        doc="/" if SWAGGER_ENABLED else False,
+        title=title,
+        authorizations=AUTHORIZATIONS,
+        security="Bearer",
+    )
+    for namespace in namespaces:
+        api.add_namespace(namespace)
+    # add_specs is only honored by init_app, not by the constructor
+    api.init_app(app, add_specs=SWAGGER_ENABLED)
+    return api
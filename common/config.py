@@ -0,0 +1,70 @@
+"""Settings shared by the services, read once from the environment.
+
+Settings used by a single service stay at the top of its ``app.py``.
+"""
+
+import hashlib
+import hmac
+import os
+
+
+def env_flag(name, default):
+    return os.environ.get(name, default).lower() in ("1", "true", "yes", "on")
+
+
+# Key that signs and verifies every JWT; user_service issues the tokens
+SECRET_KEY = os.environ.get("SECRET_KEY", "supersecretkey")
+
+# JWT signature algorithm: HS256 signs with SECRET_KEY; with RS256 or EdDSA
+# user_service signs with a private key and publishes the public key
+JWT_ALGORITHM = os.environ.get("JWT_ALGORITHM", "HS256")
+
+# Registrations asking for the Admin role must present this value
+ADMIN_SECRET = os.environ.get("ADMIN_SECRET", SECRET_KEY)
+
+# Shared by the services for internal-only endpoints (X-Internal-Key header).
+# The default is derived from SECRET_KEY, which cannot be recovered from it,
+# so a logged header does not give away the key that signs tokens
+INTERNAL_API_KEY = (
+    os.environ.get("INTERNAL_API_KEY")
+    or hmac.new(
+        SECRET_KEY.encode("utf-8"), b"internal-api-key", hashlib.sha256
+    ).hexdigest()
+)
+
+# Most emails one POST /users/batch may look up
+USER_BATCH_MAX = int(os.environ.get("USER_BATCH_MAX", "500"))
+
+USER_SERVICE_URL = os.environ.get("USER_SERVICE_URL", "http://localhost:5001")
+DESTINATION_SERVICE_URL = os.environ.get(
+    "DESTINATION_SERVICE_URL", "http://localhost:5002"
+)
+
+# Public keys of user_service, fetched by the services that verify tokens
+JWKS_URL = os.environ.get("JWKS_URL", f"{USER_SERVICE_URL}/.well-known/jwks.json")
+JWKS_REFRESH_INTERVAL = float(os.environ.get("JWKS_REFRESH_INTERVAL", "300"))
+
+# Log of revoked sessions in user_service, polled every interval seconds
+REVOCATIONS_URL = os.environ.get(
+    "REVOCATIONS_URL", f"{USER_SERVICE_URL}/users/revocations"
+)
+REVOCATION_SYNC_INTERVAL = float(os.environ.get("REVOCATION_SYNC_INTERVAL", "5"))
+
+# Rate limits: off switch, optional Redis shared by all workers, and the
+# number of reverse proxies whose X-Forwarded-For entries are trusted
+RATE_LIMIT_ENABLED = env_flag("RATE_LIMIT_ENABLED", "true")
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL") or None
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get("RATE_LIMIT_TRUSTED_PROXIES", "0"))
+
+# Swagger UI on / and the generated /swagger.json; turn off in production
+SWAGGER_ENABLED = env_flag("SWAGGER_ENABLED", "true")
+
+# Verified claims are cached until the token expires
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "10000"))
+
+# Concurrent writes within this window share one reload and flush of a file
+WRITE_COALESCE_WINDOW = float(os.environ.get("WRITE_COALESCE_WINDOW_MS", "2")) / 1000
+
+# Timeouts of calls to the other services, in seconds
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "2.0"))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", "5.0"))
@@ -0,0 +1,155 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies
+    fcntl = None
+
+
+def file_stamp(path):
+    """Return a stamp that changes whenever the file is rewritten, or None"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    # A rename always brings a new inode, even within one mtime tick
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def atomic_write_json(path, data, indent=None):
+    """Write JSON to a temporary file and rename it over ``path``.
+
+    Readers see either the old or the new content, never a truncated file.
+    """
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class FileLock:
+    """Advisory lock shared by every process that opens the same lock file.
+
+    Re-entrant within a thread; other threads of the same process wait on
+    an in-process lock before the file lock is even tried.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        self._depth += 1
+        if self._depth == 1 and fcntl is not None:
+            try:
+                self._file = open(self.path, "a")
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                self._depth -= 1
+                self._thread_lock.release()
+                raise
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._file is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class _Write:
+    def __init__(self, mutation):
+        self.mutation = mutation
+        self.done = False
+        self.value = None
+        self.error = None
+
+
+class WriteCoalescer:
+    """Group commit for concurrent mutations of one store.
+
+    The first writer waits ``window`` seconds for others to join, then runs
+    every queued mutation inside a single ``transaction()`` (lock, reload,
+    apply, flush). Writers arriving during a flush form the next batch.
+    Each writer gets its own mutation's return value or exception.
+    """
+
+    def __init__(self, transaction, window=0.002):
+        self.transaction = transaction
+        self.window = window
+        self._cond = threading.Condition()
+        self._pending = []
+        self._leader = False
+        self.batches = 0
+        self.writes = 0
+
+    def submit(self, mutation):
+        write = _Write(mutation)
+        with self._cond:
+            self._pending.append(write)
+            if self._leader:
+                while not write.done:
+                    self._cond.wait()
+                return self._result(write)
+            self._leader = True
+        if self.window:
+            time.sleep(self.window)
+        while True:
+            with self._cond:
+                batch, self._pending = self._pending, []
+                if not batch:
+                    self._leader = False
+                    break
+            self._run(batch)
+        return self._result(write)
+
+    def _run(self, batch):
+        try:
+            with self.transaction():
+                for write in batch:
+                    try:
+                        write.value = write.mutation()
+                    except Exception as e:
+                        write.error = e
+        except BaseException as e:
+            # The flush failed, so none of the batch is durable
+            for write in batch:
+                write.error = write.error or e
+        with self._cond:
+            self.batches += 1
+            self.writes += len(batch)
+            for write in batch:
+                write.done = True
+            self._cond.notify_all()
+
+    @staticmethod
+    def _result(write):
+        if write.error is not None:
+            raise write.error
+        return write.value
+
+    def stats(self):
+        with self._cond:
+            return {
+                "batches": self.batches,
+                "writes": self.writes,
+                "pending": len(self._pending),
+            }
@@ -0,0 +1,201 @@
+import contextvars
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import g, request
+
+# Prometheus' default latency buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_spans = contextvars.ContextVar("spans", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        """Yield ``(le, cumulative_count)`` including +Inf"""
+        total = 0
+        for le, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield ("+Inf" if le == float("inf") else repr(le)), total
+
+
+def _labels(pairs):
+    return ",".join(f'{k}="{v}"' for k, v in pairs)
+
+
+def _metric_name(*parts):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", "_".join(str(p) for p in parts if p))
+
+
+def _flatten(prefix, value):
+    """Yield ``(name, number)`` for every numeric leaf of a stats dict"""
+    if isinstance(value, bool):
+        yield prefix, int(value)
+    elif isinstance(value, (int, float)):
+        yield prefix, value
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield from _flatten(_metric_name(prefix, key), item)
+
+
+class Metrics:
+    """Per-process registry of request latencies, spans and stats gauges"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.spans = {}
+        self.in_flight = 0
+        self._collectors = {}
+
+    def observe_request(self, method, route, status, seconds):
+        key = (method, route, str(status))
+        with self._lock:
+            histogram = self.requests.get(key)
+            if histogram is None:
+                histogram = self.requests[key] = Histogram()
+            histogram.observe(seconds)
+
+    def observe_span(self, name, seconds):
+        with self._lock:
+            histogram = self.spans.get(name)
+            if histogram is None:
+                histogram = self.spans[name] = Histogram()
+            histogram.observe(seconds)
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def add_collector(self, prefix, stats):
+        """Export the numbers of ``stats()`` as gauges named ``prefix_<key>``"""
+        self._collectors[prefix] = stats
+
+    def render(self):
+        """Return the registry in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            lines += [
+                "# HELP http_request_duration_seconds Request latency by route",
+                "# TYPE http_request_duration_seconds histogram",
+            ]
+            for (method, route, status), histogram in sorted(self.requests.items()):
+                labels = [("method", method), ("route", route), ("status", status)]
+                lines += self._histogram(
+                    "http_request_duration_seconds", labels, histogram
+                )
+            lines += [
+                "# HELP http_requests_in_flight Requests being served",
+                "# TYPE http_requests_in_flight gauge",
+                f"http_requests_in_flight {self.in_flight}",
+                "# HELP span_duration_seconds Time spent in named spans",
+                "# TYPE span_duration_seconds histogram",
+            ]
+            for name, histogram in sorted(self.spans.items()):
+                lines += self._histogram(
+                    "span_duration_seconds", [("span", name)], histogram
+                )
+        for prefix, stats in self._collectors.items():
+            for name, value in _flatten(prefix, stats()):
+                lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _histogram(name, labels, histogram):
+        for le, count in histogram.samples():
+            yield f"{name}_bucket{{{_labels(labels + [('le', le)])}}} {count}"
+        yield f"{name}_sum{{{_labels(labels)}}} {histogram.sum}"
+        yield f"{name}_count{{{_labels(labels)}}} {histogram.count}"
+
+
+REGISTRY = Metrics()
+
+
+@contextmanager
+def span(name, registry=REGISTRY):
+    """Time a block; it shows up in /metrics and the Server-Timing header"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe_span(name, elapsed)
+        spans = _spans.get()
+        if spans is not None:
+            spans.append((name, elapsed))
+
+
+def server_timing(spans, total):
+    """Format spans (summed per name) and the total as a Server-Timing value"""
+    durations = {}
+    for name, elapsed in spans:
+        durations[name] = durations.get(name, 0.0) + elapsed
+    durations["total"] = total
+    return ", ".join(
+        f"{name};dur={elapsed * 1000:.3f}" for name, elapsed in durations.items()
+    )
+
+
+def instrument(app, registry=REGISTRY):
+    """Time every request of a Flask app and serve the registry on /metrics"""
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        g.request_observed = False
+        _spans.set([])
+        registry.enter()
+
+    @app.after_request
+    def record(response):
+        started = g.get("request_started")
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        registry.observe_request(request.method, route, response.status_code, elapsed)
+        g.request_observed = True
+        response.headers["Server-Timing"] = server_timing(_spans.get() or (), elapsed)
+        return response
+
+    @app.teardown_request
+    def finish(error):
+        # Popped so a request context torn down twice is only counted once
+        started = g.pop("request_started", None)
+        if started is None:
+            return
+        if not g.get("request_observed"):
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            registry.observe_request(
+                request.method, route, 500, time.perf_counter() - started
+            )
+        registry.leave()
+        _spans.set(None)
+
+    def metrics():
+        return app.response_class(
+            registry.render(), mimetype="text/plain; version=0.0.4"
+        )
+
+    app.add_url_rule("/metrics", "metrics", metrics)
+    return registry
@@ -0,0 +1,134 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from flask import current_app, g, request
+from flask_restx import Resource
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_FILE_HEADER = "X-Profile-File"
+MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", tempfile.gettempdir()))
+
+# One sampler and one cProfile session per process at a time
+_sampling = threading.Lock()
+_profiling = threading.Lock()
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds, interval=0.005):
+    """Sample every other thread's stack and return collapsed-stack counts.
+
+    Each key is ``root;...;leaf`` as expected by flamegraph.pl and
+    speedscope. Only the sampling thread does any work, so the profiled
+    threads run at full speed between samples.
+    """
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            stacks[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def collapsed(stacks):
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def register_profiler(api, is_admin):
+    """Add admin-only profiling to a Flask-RESTX app.
+
+    ``GET /debug/profile?seconds=N`` samples the process for N seconds and
+    returns collapsed stacks. A request sent by an admin with an
+    ``X-Profile: 1`` header runs under cProfile; its stats are written to
+    ``PROFILE_DIR`` and the file name is returned in ``X-Profile-File``.
+    ``is_admin`` receives the Authorization header.
+    """
+    app = api.app
+    debug_ns = api.namespace("debug", description="Live profiling (admin-only)")
+
+    @debug_ns.route("/profile")
+    class Profile(Resource):
+        @debug_ns.doc(security="Bearer", params={"seconds": "Sampling time"})
+        def get(self):
+            """Sample all threads and return a collapsed-stack profile"""
+            if not is_admin(request.headers.get("Authorization")):
+                return {"message": "Admin token required"}, 403
+            try:
+                seconds = float(request.args.get("seconds", "5"))
+                interval = float(request.args.get("interval_ms", "5")) / 1000
+            except ValueError:
+                return {"message": "seconds and interval_ms must be numbers"}, 400
+            if not 0 < seconds <= MAX_SECONDS or not 0 < interval <= 1:
+                return {
+                    "message": f"seconds must be in (0, {MAX_SECONDS:g}] "
+                    "and interval_ms in (0, 1000]"
+                }, 400
+            if not _sampling.acquire(blocking=False):
+                return {"message": "A profile is already being taken"}, 409
+            try:
+                stacks = sample_stacks(seconds, interval)
+            finally:
+                _sampling.release()
+            return current_app.response_class(collapsed(stacks), mimetype="text/plain")
+
+    @app.before_request
+    def start_request_profile():
+        if request.headers.get(PROFILE_HEADER) != "1":
+            return
+        if not is_admin(request.headers.get("Authorization")):
+            return
+        if not _profiling.acquire(blocking=False):
+            return  # Another request is being profiled
+        g.request_profile = cProfile.Profile()
+        g.request_profile.enable()
+
+    @app.after_request
+    def finish_request_profile(response):
+        profile = g.pop("request_profile", None)
+        if profile is None:
+            return response
+        profile.disable()
+        _profiling.release()
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        path = PROFILE_DIR / (
+            f"{Path(app.root_path).name}-{int(time.time() * 1000)}-{request.method}-"
+            f"{request.path.strip('/').replace('/', '_') or 'root'}.prof"
+        )
+        profile.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(20)
+        app.logger.info(
+            "Profile of %s %s:\n%s", request.method, request.path, summary.getvalue()
+        )
+        response.headers[PROFILE_FILE_HEADER] = str(path)
+        return response
+
+    @app.teardown_request
+    def release_request_profile(error):
+        # The response never made it through after_request
+        profile = g.pop("request_profile", None)
+        if profile is not None:
+            profile.disable()
+            _profiling.release()
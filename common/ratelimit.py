@@ -0,0 +1,205 @@
+"""Sliding-window rate limits.
+
+Each rule allows ``limit`` requests per ``window`` seconds and key (an IP
+address, an email, a session). Counts are kept per fixed window, and the
+sliding window is estimated from the current window's count plus the
+previous one's, weighted by how much of it still overlaps:
+
+    estimate = previous * (1 - elapsed / window) + current
+
+That needs two counters per key instead of one timestamp per request.
+Rejected requests are not counted, and a rejection costs one dict lookup
+(or one Redis round trip), so a flood never reaches the expensive work.
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # Only the in-process backend is available
+    redis = None
+
+log = logging.getLogger(__name__)
+
+
+def parse_rate(value):
+    """Parse ``"30/60"`` (30 requests per 60 seconds); None disables the rule"""
+    if not value or value.strip().lower() in ("0", "off", "none"):
+        return None
+    limit, _, window = value.partition("/")
+    return int(limit), float(window or 60)
+
+
+class MemoryBackend:
+    """Counters in a dict of this process; each worker counts on its own.
+
+    At most ``max_keys`` keys are kept; the least recently used goes first.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._counters = OrderedDict()
+
+    def hit(self, key, index, weight, limit, window):
+        """Count a request unless it would exceed the limit.
+
+        Returns ``(allowed, current, previous)`` for window ``index``.
+        """
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None:
+                counter = self._counters[key] = [index, 0, 0]
+            else:
+                self._counters.move_to_end(key)
+            if counter[0] != index:
+                # Roll over; a gap of more than one window empties both
+                previous = counter[1] if counter[0] == index - 1 else 0
+                counter[:] = [index, 0, previous]
+            _, current, previous = counter
+            if previous * weight + current + 1 > limit:
+                return False, current, previous
+            counter[1] += 1
+            while len(self._counters) > self.max_keys:
+                self._counters.popitem(last=False)
+            return True, current + 1, previous
+
+    def size(self):
+        with self._lock:
+            return len(self._counters)
+
+
+# Check and increment in one round trip, atomically across processes
+REDIS_HIT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+if previous * tonumber(ARGV[1]) + current + 1 > tonumber(ARGV[2]) then
+    return {0, current, previous}
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return {1, current + 1, previous}
+"""
+
+
+class RedisBackend:
+    """Counters shared by every process and host using the same Redis"""
+
+    def __init__(self, url, prefix="ratelimit"):
+        if redis is None:
+            raise RuntimeError("RATE_LIMIT_REDIS_URL needs the redis package")
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5)
+        self.prefix = prefix
+        self._script = self.client.register_script(REDIS_HIT)
+
+    def hit(self, key, index, weight, limit, window):
+        allowed, current, previous = self._script(
+            keys=[
+                f"{self.prefix}:{key}:{index}",
+                f"{self.prefix}:{key}:{index - 1}",
+            ],
+            # Kept until it stops being the previous window
+            args=[weight, limit, int(math.ceil(window * 2))],
+        )
+        return bool(allowed), int(current), int(previous)
+
+    def size(self):
+        return None
+
+
+class RateLimiter:
+    """Named rules applied to keys, e.g. ``check(("login_ip", ip))``.
+
+    A backend error lets the request through: an unavailable counter store
+    must not take logins down with it.
+    """
+
+    def __init__(self, rules, backend=None, enabled=True, clock=time.time):
+        self.rules = {name: rule for name, rule in rules.items() if rule}
+        self.backend = backend or MemoryBackend()
+        self.enabled = enabled
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+        self.errors = 0
+
+    def hit(self, name, key):
+        """Count a request; return 0 if allowed, else seconds to wait"""
+        rule = self.rules.get(name)
+        if not self.enabled or rule is None or key is None:
+            return 0
+        limit, window = rule
+        now = self._clock()
+        index = int(now // window)
+        elapsed = (now - index * window) / window
+        try:
+            allowed, current, previous = self.backend.hit(
+                f"{name}:{key}", index, 1 - elapsed, limit, window
+            )
+        except Exception as e:
+            log.warning("Rate limit backend failed, allowing request: %s", e)
+            with self._lock:
+                self.errors += 1
+            return 0
+        with self._lock:
+            if allowed:
+                self.allowed += 1
+            else:
+                self.rejected += 1
+        if allowed:
+            return 0
+        if current + 1 > limit:
+            # Only the next window helps
+            wait = (1 - elapsed) * window
+        else:
+            # Wait for enough of the previous window to slide out
+            wait = ((1 - (limit - 1 - current) / previous) - elapsed) * window
+        return max(1, math.ceil(wait))
+
+    def check(self, *hits):
+        """Apply ``(name, key)`` rules in order; return the first wait, or 0.
+
+        Rules after a rejecting one are not counted, so a flood from one
+        address does not also use up the budget of the emails it tries.
+        """
+        for name, key in hits:
+            wait = self.hit(name, key)
+            if wait:
+                return wait
+        return 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "allowed": self.allowed,
+                "rejected": self.rejected,
+                "errors": self.errors,
+                "keys": self.backend.size(),
+            }
+
+
+def open_backend(redis_url=None):
+    """Redis when a URL is configured, otherwise in-process counters"""
+    return RedisBackend(redis_url) if redis_url else MemoryBackend()
+
+
+def client_ip(request, trusted_proxies=0):
+    """The client address, looking through ``trusted_proxies`` reverse proxies"""
+    if trusted_proxies:
+        forwarded = request.access_route  # X-Forwarded-For, client first
+        if len(forwarded) >= trusted_proxies:
+            return forwarded[-trusted_proxies]
+    return request.remote_addr
+
+
+def too_many_requests(retry_after):
+    return (
+        {"message": "Too many requests, please retry later"},
+        429,
+        {"Retry-After": str(retry_after)},
+    )
@@ -0,0 +1,125 @@
+"""In-memory copy of user_service's revoked sessions.
+
+Access tokens carry the id of the session they belong to (``sid``). When a
+session is revoked (logout, or a reused refresh token), user_service adds
+the sid to an append-only log. Every process keeps the live entries in a
+dict and polls the log for entries newer than the last one it has seen, so
+a check is one dict lookup and a sync only transfers new revocations.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import jwt
+import requests
+
+log = logging.getLogger(__name__)
+
+
+class TokenRevoked(jwt.InvalidTokenError):
+    """The token is valid, but its session has been revoked"""
+
+
+def http_fetch(url, timeout=2.0):
+    """Fetch function for a remote ``GET /users/revocations`` endpoint"""
+
+    def fetch(since):
+        response = requests.get(url, params={"since": since}, timeout=timeout)
+        response.raise_for_status()
+        body = response.json()
+        return body["revocations"], body["last"]
+
+    return fetch
+
+
+class RevocationList:
+    """Revoked session ids, synced every ``interval`` seconds.
+
+    ``fetch(since)`` returns ``(entries, last)`` where entries are dicts
+    with ``sid`` and ``expires_at``. Entries are dropped once expired, as
+    no access token of the session can still be valid then. A revocation
+    is seen by every process within about one interval.
+    """
+
+    def __init__(self, fetch, interval=5.0, clock=time.time):
+        self.fetch = fetch
+        self.interval = interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._revoked = {}
+        self._since = 0
+        self._stop = threading.Event()
+        self._thread_pid = None
+        self.syncs = 0
+        self.failures = 0
+
+    def sync(self):
+        """Fetch revocations newer than the last sync; return whether it worked"""
+        since = self._since
+        try:
+            entries, last = self.fetch(since)
+            if last < since:
+                # The log was recreated: start over from its beginning
+                entries, last = self.fetch(0)
+                since = None
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            log.warning("Could not sync revocations: %s", e)
+            with self._lock:
+                self.failures += 1
+            return False
+        now = self._clock()
+        with self._lock:
+            revoked = {} if since is None else self._revoked
+            for entry in entries:
+                revoked[entry["sid"]] = entry["expires_at"]
+            self._revoked = {
+                sid: expires_at
+                for sid, expires_at in revoked.items()
+                if expires_at > now
+            }
+            self._since = last
+            self.syncs += 1
+        return True
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so each worker starts its own
+        with self._lock:
+            if self._thread_pid == os.getpid() or self._stop.is_set():
+                return
+            self._thread_pid = os.getpid()
+        threading.Thread(target=self._run, name="revocation-sync", daemon=True).start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sync()
+            except Exception:
+                # e.g. a locked SQLite log; the thread must keep polling
+                log.exception("Could not sync revocations")
+                with self._lock:
+                    self.failures += 1
+            self._stop.wait(self.interval)
+
+    def is_revoked(self, claims):
+        """Whether the token's session has been revoked"""
+        self._ensure_thread()
+        sid = claims.get("sid")
+        return sid is not None and sid in self._revoked
+
+    def warm(self):
+        """Load the list before the first request needs it"""
+        self.sync()
+
+    def close(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "revoked": len(self._revoked),
+                "since": self._since,
+                "syncs": self.syncs,
+                "failures": self.failures,
+            }
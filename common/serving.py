@@ -0,0 +1,95 @@
+"""Production serving for the services' ``__main__`` entry points.
+
+Runs an app under gunicorn with worker, thread, keep-alive, timeout and
+shutdown settings taken from the environment:
+
+    PORT=5001 WEB_WORKERS=4 WEB_THREADS=8 python app.py
+"""
+
+import logging
+import os
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # Windows, or gunicorn not installed
+    BaseApplication = None
+
+from common.config import env_flag
+
+log = logging.getLogger(__name__)
+
+
+def server_options(default_port, worker_class=None):
+    """Build gunicorn settings from the environment"""
+    threads = int(os.environ.get("WEB_THREADS", "8"))
+    if worker_class is None:
+        worker_class = "gthread" if threads > 1 else "sync"
+    return {
+        "bind": f"{os.environ.get('HOST', '0.0.0.0')}:"
+        f"{os.environ.get('PORT', default_port)}",
+        "workers": int(os.environ.get("WEB_WORKERS", (os.cpu_count() or 1) * 2 + 1)),
+        "threads": threads,
+        "worker_class": worker_class,
+        "keepalive": int(os.environ.get("WEB_KEEPALIVE", "5")),
+        "timeout": int(os.environ.get("WEB_TIMEOUT", "30")),
+        "graceful_timeout": int(os.environ.get("WEB_GRACEFUL_TIMEOUT", "30")),
+        "preload_app": env_flag("WEB_PRELOAD", "true"),
+        "max_requests": int(os.environ.get("WEB_MAX_REQUESTS", "0")),
+        "max_requests_jitter": int(os.environ.get("WEB_MAX_REQUESTS_JITTER", "0")),
+        "backlog": int(os.environ.get("WEB_BACKLOG", "2048")),
+        "accesslog": os.environ.get("WEB_ACCESS_LOG") or None,
+    }
+
+
+if BaseApplication is not None:
+
+    class Server(BaseApplication):
+        """gunicorn application serving an already-built app object.
+
+        ``warm`` runs where the app is loaded: once in the master with
+        preload, so workers fork with the data files already parsed, or
+        once per worker otherwise. ``on_exit`` runs in every worker as it
+        shuts down.
+        """
+
+        def __init__(self, app, options, warm=None, on_exit=None):
+            self.application = app
+            self.options = options
+            self.warm = warm
+            self.on_exit = on_exit
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                if value is not None:
+                    self.cfg.set(key, value)
+            if self.on_exit is not None:
+                self.cfg.set("worker_exit", lambda server, worker: self.on_exit())
+
+        def load(self):
+            if self.warm is not None:
+                self.warm()
+            return self.application
+
+
+def serve(app, default_port, warm=None, on_exit=None, worker_class=None, fallback=None):
+    """Serve app with gunicorn, configured from the environment.
+
+    Without gunicorn, ``fallback(host, port)`` serves instead; by default
+    that is Flask's threaded server, without the reloader and debugger.
+    """
+    options = server_options(default_port, worker_class)
+    if BaseApplication is None:
+        log.warning("gunicorn is not available; serving with a single process")
+        if warm is not None:
+            warm()
+        host, port = options["bind"].rsplit(":", 1)
+        if fallback is None:
+            fallback = lambda host, port: app.run(host=host, port=port, threaded=True)
+        try:
+            fallback(host, int(port))
+        finally:
+            if on_exit is not None:
+                on_exit()
+        return
+    Server(app, options, warm, on_exit).run()
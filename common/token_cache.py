@@ -0,0 +1,80 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenCache:
+    """Bounded LRU cache of verified JWT claims, keyed by a token digest.
+
+    Entries expire at the token's ``exp`` claim (or after ``default_ttl``
+    seconds for tokens without one), so an expired token is never served
+    from the cache. Only successfully verified tokens are ever stored.
+    """
+
+    def __init__(self, maxsize=10000, default_ttl=300, clock=time.time):
+        self.maxsize = maxsize
+        self.default_ttl = default_ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, token):
+        """Return a copy of the cached claims, or None"""
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                claims, expires_at = entry
+                if self._clock() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(claims)
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def put(self, token, claims):
+        expires_at = claims.get("exp", self._clock() + self.default_ttl)
+        if self._clock() >= expires_at or self.maxsize <= 0:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (dict(claims), expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def decode(self, token, decoder):
+        """Return cached claims, or verify with decoder and cache the result.
+
+        Exceptions from decoder propagate and nothing is cached.
+        """
+        claims = self.get(token)
+        if claims is None:
+            claims = decoder(token)
+            self.put(token, claims)
+        return claims
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
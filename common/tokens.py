@@ -0,0 +1,277 @@
+"""JWT signing and verification shared by the services.
+
+user_service signs with a ``TokenSigner`` and publishes its public key as a
+JWKS document; the other services check tokens with a ``TokenVerifier``.
+With HS256 both sides use the shared secret. With RS256 or EdDSA only
+user_service holds a private key, and verifiers look public keys up by the
+token's ``kid`` in a key set that is refreshed in the background, so a
+verification never waits on the network once the first key set is loaded.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import jwt
+import requests
+
+try:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+except ImportError:  # Only HS256 is available without cryptography
+    serialization = None
+
+log = logging.getLogger(__name__)
+
+SYMMETRIC = ("HS256",)
+ASYMMETRIC = ("RS256", "EdDSA")
+
+
+def check_algorithm(algorithm):
+    if algorithm not in SYMMETRIC + ASYMMETRIC:
+        raise ValueError(f"Unsupported JWT algorithm: {algorithm}")
+    if algorithm in ASYMMETRIC and serialization is None:
+        raise RuntimeError(f"{algorithm} needs the cryptography package")
+
+
+def generate_key(algorithm):
+    if algorithm == "RS256":
+        return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return ed25519.Ed25519PrivateKey.generate()
+
+
+def load_or_create_key(path, algorithm):
+    """Load the PEM private key at path, generating it on first use.
+
+    Workers starting together race to create the file; the key is written
+    to a temporary file and linked into place, so every worker ends up
+    reading the same, complete key.
+    """
+    path = Path(path)
+    if not path.exists():
+        pem = generate_key(algorithm).private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(pem)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(tmp, path)
+        except FileExistsError:
+            pass  # Another worker created it first; use theirs
+        finally:
+            os.unlink(tmp)
+    key = serialization.load_pem_private_key(path.read_bytes(), password=None)
+    expected = rsa.RSAPrivateKey if algorithm == "RS256" else ed25519.Ed25519PrivateKey
+    if not isinstance(key, expected):
+        raise ValueError(f"{path} does not hold a key for {algorithm}")
+    return key
+
+
+def public_jwk(public_key, algorithm):
+    """JWK of a public key, with its RFC 7638 thumbprint as ``kid``"""
+    jwk = jwt.get_algorithm_by_name(algorithm).to_jwk(public_key, as_dict=True)
+    jwk.pop("key_ops", None)
+    members = {k: jwk[k] for k in ("crv", "e", "kty", "n", "x") if k in jwk}
+    digest = hashlib.sha256(
+        json.dumps(members, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    ).digest()
+    kid = base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+    return {**jwk, "kid": kid, "alg": algorithm, "use": "sig"}
+
+
+class TokenSigner:
+    """Issues tokens and verifies the ones it issued"""
+
+    def __init__(self, algorithm="HS256", secret=None, key_file=None):
+        check_algorithm(algorithm)
+        self.algorithm = algorithm
+        if algorithm in SYMMETRIC:
+            self._signing_key = self._verifying_key = secret
+            self.kid = None
+            self._jwks = {"keys": []}  # A shared secret is never published
+        else:
+            self._signing_key = load_or_create_key(key_file, algorithm)
+            self._verifying_key = self._signing_key.public_key()
+            jwk = public_jwk(self._verifying_key, algorithm)
+            self.kid = jwk["kid"]
+            self._jwks = {"keys": [jwk]}
+
+    def sign(self, claims):
+        headers = {"kid": self.kid} if self.kid else None
+        return jwt.encode(
+            claims, self._signing_key, algorithm=self.algorithm, headers=headers
+        )
+
+    def decode(self, token):
+        return jwt.decode(token, self._verifying_key, algorithms=[self.algorithm])
+
+    def jwks(self):
+        """The public key set, as served on /.well-known/jwks.json"""
+        return self._jwks
+
+
+class JwksKeySet:
+    """Public keys of a JWKS endpoint, cached by ``kid``.
+
+    A daemon thread refetches the set every ``refresh_interval`` seconds,
+    and sooner (but at most every ``min_refresh_interval`` seconds) when a
+    token names a kid that is not in the cache. Lookups never fetch, except
+    the very first one if no fetch has been tried yet; if that fails, tokens
+    are rejected until the thread loads a key set. A failed fetch keeps the
+    keys of the last good one.
+    """
+
+    def __init__(
+        self,
+        url,
+        refresh_interval=300.0,
+        min_refresh_interval=10.0,
+        timeout=2.0,
+        fetch=None,
+    ):
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._fetch = fetch or self._http_fetch
+        self._keys = {}
+        self._tried = False
+        self._lock = threading.Lock()
+        self._first_load = threading.Lock()
+        self._wake = threading.Event()
+        self._thread_pid = None
+        self._closed = False
+        self._last_refresh = 0.0
+        self.refreshes = 0
+        self.failures = 0
+        self.unknown_kids = 0
+
+    def _http_fetch(self):
+        response = requests.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def refresh(self):
+        """Fetch the key set now; return whether it succeeded"""
+        self._tried = True
+        try:
+            document = self._fetch()
+            keys = {}
+            for data in document.get("keys", []):
+                try:
+                    key = jwt.PyJWK(data)
+                except jwt.PyJWKError:
+                    continue  # Key types this process cannot use
+                if key.key_id:
+                    keys[key.key_id] = key
+        except (requests.RequestException, ValueError, AttributeError) as e:
+            log.warning("Could not refresh JWKS from %s: %s", self.url, e)
+            with self._lock:
+                self.failures += 1
+                self._last_refresh = time.monotonic()
+            return False
+        with self._lock:
+            self._keys = keys
+            self.refreshes += 1
+            self._last_refresh = time.monotonic()
+        return True
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so each worker starts its own
+        with self._lock:
+            if self._thread_pid == os.getpid() or self._closed:
+                return
+            self._thread_pid = os.getpid()
+        threading.Thread(target=self._run, name="jwks-refresh", daemon=True).start()
+
+    def _run(self):
+        pid = os.getpid()
+        while not self._closed and self._thread_pid == pid:
+            woken = self._wake.wait(self.refresh_interval)
+            self._wake.clear()
+            if self._closed:
+                break
+            if woken:
+                delay = self._last_refresh + self.min_refresh_interval
+                time.sleep(max(0.0, delay - time.monotonic()))
+            self.refresh()
+
+    def get(self, kid):
+        """Return the cached key for kid, or None"""
+        self._ensure_thread()
+        if not self._tried:
+            # Only one inline fetch ever; later retries are the thread's job
+            with self._first_load:
+                if not self._tried:
+                    self.refresh()
+        key = self._keys.get(kid)
+        if key is None:
+            with self._lock:
+                self.unknown_kids += 1
+            self._wake.set()  # Maybe a new key: refetch in the background
+        return key
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "keys": len(self._keys),
+                "refreshes": self.refreshes,
+                "failures": self.failures,
+                "unknown_kids": self.unknown_kids,
+            }
+
+
+class TokenVerifier:
+    """Checks tokens issued by user_service.
+
+    HS256 tokens are checked with the shared secret; RS256 and EdDSA tokens
+    with the key their ``kid`` header names in the JWKS at ``jwks_url``.
+    Only the configured algorithm is accepted.
+    """
+
+    def __init__(
+        self, algorithm="HS256", secret=None, jwks_url=None, key_set=None, **options
+    ):
+        check_algorithm(algorithm)
+        self.algorithm = algorithm
+        self.secret = secret
+        self.key_set = None
+        if algorithm in ASYMMETRIC:
+            self.key_set = key_set or JwksKeySet(jwks_url, **options)
+
+    def decode(self, token):
+        if self.key_set is None:
+            return jwt.decode(token, self.secret, algorithms=[self.algorithm])
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = self.key_set.get(kid) if kid else None
+        if key is None:
+            raise jwt.InvalidTokenError("Unknown signing key")
+        return jwt.decode(token, key.key, algorithms=[self.algorithm])
+
+    def warm(self):
+        """Load the key set before the first request needs it"""
+        if self.key_set is not None:
+            self.key_set.refresh()
+
+    def close(self):
+        if self.key_set is not None:
+            self.key_set.close()
+
+    def stats(self):
+        return self.key_set.stats() if self.key_set is not None else {}
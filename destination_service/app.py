@@ -1,43 +1,85 @@
 import re
-from flask import Flask, request
-from flask_restx import Api, Resource, fields
+import hashlib
+import os
+import sys
+import click
+from flask import Flask, current_app, request
+from flask_restx import Namespace, Resource, fields
 import json
 from pathlib import Path
 import jwt
 
-app = Flask(__name__)
-
-# Define the security schema for Swagger UI
-authorizations = {
-    "Bearer": {
-        "type": "apiKey",
-        "in": "header",
-        "name": "Authorization",
-        "description": "Enter 'Bearer <your-token>'",
-    }
-}
-
-# Initialize the API with security definitions
-api = Api(
-    app,
-    doc="/",
-    title="Destination Service API",
-    authorizations=authorizations,
-    security="Bearer",
+# Make the shared "common" package importable when run from this directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.api import create_api
+from common.config import (
+    JWKS_REFRESH_INTERVAL,
+    JWKS_URL,
+    JWT_ALGORITHM,
+    REVOCATION_SYNC_INTERVAL,
+    REVOCATIONS_URL,
+    SECRET_KEY,
+    TOKEN_CACHE_SIZE,
+    WRITE_COALESCE_WINDOW,
 )
+from common.instrumentation import instrument, span
+from common.profiling import register_profiler
+from common.revocation import RevocationList, http_fetch
+from common.token_cache import TokenCache
+from common.tokens import TokenVerifier
+from backends import JsonBackend, SqliteBackend
+from destination_store import FIELDS, DestinationStore, DuplicateDestination
+
+# The file and its directory are created by the store on first use
+DEST_FILE = Path(
+    os.environ.get("DEST_FILE", Path(__file__).parent / "models" / "destinations.json")
+)
+
+DEST_STORE_BACKEND = os.environ.get("DEST_STORE_BACKEND", "json")
+DEST_DB_FILE = Path(
+    os.environ.get("DEST_DB_FILE", Path(__file__).parent / "models" / "destinations.db")
+)
+
+
+def open_backend():
+    """Open the storage backend selected by DEST_STORE_BACKEND"""
+    if DEST_STORE_BACKEND == "sqlite":
+        return SqliteBackend(DEST_DB_FILE)
+    if DEST_STORE_BACKEND == "json":
+        return JsonBackend(DEST_FILE)
+    raise ValueError(f"Unknown destination store backend: {DEST_STORE_BACKEND}")
+
+
+dest_store = DestinationStore(
+    backend=open_backend(), write_window=WRITE_COALESCE_WINDOW
+)
+
+# Page sizes for GET /destinations/ when any query parameter is given
+DEFAULT_PAGE_SIZE = int(os.environ.get("DESTINATIONS_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.environ.get("DESTINATIONS_MAX_PAGE_SIZE", "1000"))
 
-DEST_FILE = Path(__file__).parent / "models" / "destinations.json"
+# Verified claims are cached until the token expires
+token_cache = TokenCache(maxsize=TOKEN_CACHE_SIZE)
 
-DEST_FILE.parent.mkdir(parents=True, exist_ok=True)
-if not DEST_FILE.exists():
-    with open(DEST_FILE, "w") as f:
-        json.dump([], f)
+# Checks signatures with SECRET_KEY, or with user_service's published keys
+verifier = TokenVerifier(
+    JWT_ALGORITHM,
+    secret=SECRET_KEY,
+    jwks_url=JWKS_URL,
+    refresh_interval=JWKS_REFRESH_INTERVAL,
+)
 
-# JWT secret key from user service
-SECRET_KEY = "supersecretkey"
+# Sessions revoked in user_service, synced incrementally in the background;
+# checked after the claims cache, so a cached token is rejected too
+revocations = RevocationList(
+    http_fetch(REVOCATIONS_URL), interval=REVOCATION_SYNC_INTERVAL
+)
+
+# Create an API namespace for destinations
+dest_ns = Namespace("destinations", description="Destination operations")
 
 # Destination model for the API
-destination_model = api.model(
+destination_model = dest_ns.model(
     "Destination",
     {
         "name": fields.String(required=True, description="Destination name"),
@@ -47,22 +89,8 @@ destination_model = api.model(
 )
 
 
-def get_destinations():
-    """Load the destination data from the file"""
-    try:
-        with open(DEST_FILE, "r") as f:
-            return json.load(f)
-    except Exception as e:
-        return {"message": f"Error reading destinations: {str(e)}"}, 500
-
-
-def save_destinations(destinations):
-    """Save destination data to the file"""
-    try:
-        with open(DEST_FILE, "w") as f:
-            json.dump(destinations, f, indent=4)
-    except Exception as e:
-        return {"message": f"Error saving destinations: {str(e)}"}, 500
+def decode_token(token):
+    return verifier.decode(token)
 
 
 def verify_admin_token(auth_header):
@@ -71,7 +99,10 @@ def verify_admin_token(auth_header):
         return False
     token = auth_header.split(" ")[1]  # Extract token from the header
     try:
-        decoded = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        with span("token_verify"):
+            decoded = token_cache.decode(token, decode_token)
+        if revocations.is_revoked(decoded):
+            return False
         return decoded.get("role") == "Admin"  # Check if role is Admin
     except jwt.ExpiredSignatureError:
         return False
@@ -79,25 +110,94 @@ def verify_admin_token(auth_header):
         return False
 
 
-def generate_id(destinations):
-    """Generate a new unique ID for a destination"""
-    if destinations:
-        return max(dest["id"] for dest in destinations) + 1
-    return 1  # Start with 1 if no destinations exist
+def check_strings(data):
+    """Return an error message unless the given fields are all strings"""
+    wrong = [
+        field
+        for field in ("name", "description", "location")
+        if field in data and not isinstance(data[field], str)
+    ]
+    if wrong:
+        return f"Fields must be strings: {', '.join(wrong)}"
+    return None
 
 
-# Create an API namespace for destinations
-dest_ns = api.namespace("destinations", description="Destination operations")
+def json_response(body, etag):
+    """Build a JSON response that honors If-None-Match"""
+    response = current_app.response_class(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+        response.set_data(b"")
+    return response
+
+
+def parse_page_args(args):
+    """Validate the pagination query parameters, or return an error message"""
+    try:
+        limit = int(args.get("limit", DEFAULT_PAGE_SIZE))
+        after = int(args["after"]) if "after" in args else None
+    except ValueError:
+        return None, "limit and after must be integers"
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return None, f"limit must be between 1 and {MAX_PAGE_SIZE}"
+
+    fields = None
+    if args.get("fields"):
+        fields = [f.strip() for f in args["fields"].split(",") if f.strip()]
+        unknown = sorted(set(fields) - set(FIELDS))
+        if unknown:
+            return None, f"Unknown fields: {', '.join(unknown)}"
+
+    return {
+        "limit": limit,
+        "after": after,
+        "location": args.get("location") or None,
+        "fields": fields,
+    }, None
 
 
 @dest_ns.route("/")
 class Destinations(Resource):
+    @dest_ns.doc(
+        params={
+            "limit": f"Page size (default {DEFAULT_PAGE_SIZE}, max {MAX_PAGE_SIZE})",
+            "after": "Return destinations with an id greater than this cursor",
+            "fields": "Comma-separated fields to return, e.g. id,name",
+            "location": "Only destinations in this location (case-insensitive)",
+        }
+    )
     def get(self):
-        """List all destinations"""
-        destinations = get_destinations()
-        if isinstance(destinations, dict):  # In case of error
-            return destinations
-        return destinations, 200
+        """List destinations; any query parameter switches to paged results"""
+        try:
+            if not request.args:
+                # The serialized listing is reused until a mutation changes it
+                body, etag = dest_store.listing()
+                return json_response(body, etag)
+
+            page_args, error = parse_page_args(request.args)
+            if error:
+                return {"message": error}, 400
+            destinations, next_after = dest_store.page(
+                page_args["limit"], page_args["after"], page_args["location"]
+            )
+        except Exception as e:
+            return {"message": f"Error reading destinations: {str(e)}"}, 500
+
+        if page_args["fields"]:
+            destinations = [
+                {f: dest[f] for f in page_args["fields"] if f in dest}
+                for dest in destinations
+            ]
+        body = json.dumps(destinations).encode("utf-8")
+        response = json_response(
+            body, hashlib.blake2b(body, digest_size=12).hexdigest()
+        )
+        if next_after is not None:
+            # Cursor for the next page: pass it back as ?after=
+            response.headers["X-Next-After"] = str(next_after)
+        return response
 
     @dest_ns.expect(destination_model)
     @dest_ns.doc(security="Bearer")  # Security required for this endpoint
@@ -109,7 +209,7 @@ class Destinations(Resource):
 
         data = request.json
         # Validate the input
-        if (
+        if not isinstance(data, dict) or (
             not data.get("name")
             or not data.get("description")
             or not data.get("location")
@@ -117,20 +217,126 @@ class Destinations(Resource):
             return {
                 "message": "All fields (name, description, location) are required."
             }, 400
-
-        destinations = get_destinations()
-
-        # Check if a destination with the same name already exists
-        if any(dest["name"].lower() == data["name"].lower() for dest in destinations):
+        error = check_strings(data)
+        if error:
+            return {"message": error}, 400
+
+        # Add the destination under the next id unless the name is taken
+        try:
+            destination = dest_store.add(data)
+        except DuplicateDestination:
             return {
                 "message": "Destination with this name already exists"
             }, 400  # Bad request if duplicate found
+        return {"message": "Destination added", "id": destination["id"]}, 201
+
+
+@dest_ns.route("/search")
+class DestinationSearch(Resource):
+    @dest_ns.doc(
+        params={
+            "q": "Words to find in name, description or location; "
+            "the last letters of a word may be left out",
+            "limit": f"Maximum results (default 20, max {MAX_PAGE_SIZE})",
+        }
+    )
+    def get(self):
+        """Search destinations, best matches first"""
+        query = request.args.get("q", "").strip()
+        if not query:
+            return {"message": "Query parameter q is required"}, 400
+        try:
+            limit = int(request.args.get("limit", 20))
+        except ValueError:
+            return {"message": "limit must be an integer"}, 400
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            return {"message": f"limit must be between 1 and {MAX_PAGE_SIZE}"}, 400
+        return dest_store.search(query, limit), 200
+
+
+# Rejected lines reported back by a bulk import
+MAX_IMPORT_ERRORS = 100
+
+
+def parse_import_lines(stream, errors):
+    """Yield (line, destination) for valid NDJSON lines, recording bad ones"""
+    for line, raw in enumerate(stream, start=1):
+        if not raw.strip():
+            continue
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            errors.append({"line": line, "message": "Invalid JSON"})
+            continue
+        if not isinstance(data, dict) or not all(
+            isinstance(data.get(field), str) and data.get(field)
+            for field in ("name", "description", "location")
+        ):
+            errors.append(
+                {
+                    "line": line,
+                    "message": "All fields (name, description, location) are required.",
+                }
+            )
+            continue
+        data.pop("id", None)  # Ids are always assigned by the store
+        yield line, data
+
+
+@dest_ns.route("/import")
+class DestinationImport(Resource):
+    @dest_ns.doc(
+        security="Bearer",
+        description="Request body: one JSON destination per line "
+        "(application/x-ndjson). Valid, non-duplicate lines are added in one batch.",
+    )
+    def post(self):
+        """Bulk-import destinations from NDJSON (admin-only)"""
+        auth_header = request.headers.get("Authorization")
+        if not verify_admin_token(auth_header):
+            return {"message": "Admin token required"}, 403  # Forbidden if not Admin
+
+        errors = []
+        # The body is parsed line by line as it arrives, not read in one piece
+        imported, duplicates = dest_store.add_many(
+            parse_import_lines(request.stream, errors)
+        )
+        errors.extend(
+            {"line": line, "message": "Destination with this name already exists"}
+            for line in duplicates
+        )
+        errors.sort(key=lambda error: error["line"])
+        return {
+            "message": f"Imported {imported} destinations",
+            "imported": imported,
+            "rejected": len(errors),
+            "errors": errors[:MAX_IMPORT_ERRORS],
+        }, (201 if imported else 400)
+
+
+@dest_ns.route("/export")
+class DestinationExport(Resource):
+    def get(self):
+        """Stream every destination as NDJSON"""
+
+        def generate():
+            chunk = []
+            for destination in dest_store.iter_all():
+                chunk.append(json.dumps(destination))
+                if len(chunk) == 1000:
+                    yield "\n".join(chunk) + "\n"
+                    chunk = []
+            if chunk:
+                yield "\n".join(chunk) + "\n"
 
-        # If no duplicate, add the new destination with a generated ID
-        data["id"] = generate_id(destinations)
-        destinations.append(data)
-        save_destinations(destinations)
-        return {"message": "Destination added"}, 201
+        return current_app.response_class(generate(), mimetype="application/x-ndjson")
+
+
+@dest_ns.route("/token-cache")
+class TokenCacheStats(Resource):
+    def get(self):
+        """Hit/miss counters of the verified-token cache"""
+        return token_cache.stats(), 200
 
 
 @dest_ns.route("/<int:id>")
@@ -142,11 +348,7 @@ class Destination(Resource):
         if not verify_admin_token(auth_header):
             return {"message": "Admin token required"}, 403  # Forbidden if not Admin
 
-        destinations = get_destinations()
-        destination = next((dest for dest in destinations if dest["id"] == id), None)
-        if destination:
-            destinations.remove(destination)
-            save_destinations(destinations)
+        if dest_store.delete(id):
             return {"message": "Destination deleted"}, 200
         else:
             return {"message": "Destination not found"}, 404
@@ -165,29 +367,75 @@ class Destination(Resource):
 
         # Fetch the updated data from the request body
         data = request.json
-        if not data.get("description") and not data.get("location"):
+        if not isinstance(data, dict) or (
+            not data.get("description") and not data.get("location")
+        ):
             return {
                 "message": "At least one of description or location must be provided to update."
             }, 400
-
-        destinations = get_destinations()
-
-        # Find the destination by name
-        destination = next(
-            (dest for dest in destinations if dest["name"] == name), None
-        )
-
-        if destination:
-            # Update the destination's description and location
-            if "description" in data:
-                destination["description"] = data["description"]
-            if "location" in data:
-                destination["location"] = data["location"]
-            save_destinations(destinations)
+        error = check_strings(data)
+        if error:
+            return {"message": error}, 400
+
+        # Update the destination's description and location
+        changes = {
+            field: data[field] for field in ("description", "location") if field in data
+        }
+        if dest_store.update(name, changes):
             return {"message": "Destination updated"}, 200
         else:
             return {"message": "Destination not found"}, 404
 
 
+@click.command("migrate-sqlite")
+@click.option("--database", default=str(DEST_DB_FILE), help="SQLite file to fill")
+def migrate_sqlite(database):
+    """Copy destinations from the JSON file into a SQLite database"""
+    source = JsonBackend(DEST_FILE)
+    destinations, _ = source.load()
+    target = SqliteBackend(database)
+    # Carry the id counter over so deleted ids are not handed out again
+    target.replace(destinations, next_id=source.next_id())
+    target.close()
+    click.echo(f"Migrated {len(destinations)} destinations to {database}")
+
+
+def create_app():
+    """Build the Flask app; the module-level ``app`` is built on first access"""
+    app = Flask(__name__)
+    api = create_api(app, "Destination Service API", [dest_ns])
+
+    # Request latencies and timing spans, served on /metrics
+    metrics = instrument(app)
+    metrics.add_collector("token_cache", token_cache.stats)
+    metrics.add_collector("jwks", verifier.stats)
+    metrics.add_collector("revocations", revocations.stats)
+    # Admin-only sampling profiler and per-request cProfile
+    register_profiler(api, verify_admin_token)
+
+    app.cli.add_command(migrate_sqlite)
+    return app
+
+
+def __getattr__(name):
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == "__main__":
-    app.run(port=5002, debug=True)
+    from common.serving import serve
+
+    def warm():
+        dest_store.refresh()
+        verifier.warm()
+        revocations.warm()
+
+    def on_exit():
+        dest_store.close()
+        verifier.close()
+        revocations.close()
+
+    serve(create_app(), 5002, warm=warm, on_exit=on_exit)
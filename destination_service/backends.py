@@ -0,0 +1,229 @@
+import json
+import sqlite3
+from contextlib import nullcontext
+from pathlib import Path
+
+from common.fileio import FileLock, atomic_write_json, file_stamp
+from common.sqlite import ConnectionPool
+
+
+def name_key(name):
+    return name.casefold()
+
+
+def location_key(location):
+    return location.casefold()
+
+
+class JsonBackend:
+    """Destinations persisted as one JSON file plus an id counter file.
+
+    Every change rewrites the whole file from the store's in-memory view,
+    under an advisory lock and by renaming a temporary file, so writers in
+    different processes never interleave and readers never see a partial
+    file. The version is the file's stamp.
+    """
+
+    # Writes rewrite everything, so the store batches concurrent ones
+    whole_file = True
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.meta_path = self.path.with_suffix(".meta.json")
+        self._lock = FileLock(self.path.with_suffix(".lock"))
+        self._next_id = 1
+
+    def version(self):
+        return file_stamp(self.path)
+
+    def lock(self):
+        return self._lock
+
+    def _ensure_file(self):
+        if not self.path.exists():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "w") as f:
+                json.dump([], f)
+
+    def _read_next_id(self):
+        try:
+            with open(self.meta_path, "r") as f:
+                return json.load(f).get("next_id", 1)
+        except (FileNotFoundError, ValueError):
+            return 1
+
+    def load(self):
+        """Return ``(destinations, version)``"""
+        self._ensure_file()
+        with open(self.path, "r") as f:
+            destinations = json.load(f)
+        highest = max((dest["id"] for dest in destinations), default=0)
+        self._next_id = max(self._read_next_id(), highest + 1)
+        return destinations, self.version()
+
+    def next_id(self):
+        return self._next_id
+
+    def insert(self, records):
+        """Assign ids to new records; they are written by the next commit"""
+        inserted = []
+        for data in records:
+            inserted.append({**data, "id": self._next_id})
+            self._next_id += 1
+        return inserted
+
+    def update(self, dest):
+        pass
+
+    def delete(self, dest_id):
+        pass
+
+    def commit(self, destinations):
+        """Persist the store's view and return the new version"""
+        # The counter is written first: a crash in between only skips an id
+        atomic_write_json(self.meta_path, {"next_id": self._next_id})
+        atomic_write_json(self.path, list(destinations), indent=4)
+        return self.version()
+
+    def replace(self, destinations, next_id=None):
+        highest = max((dest["id"] for dest in destinations), default=0)
+        self._next_id = max(next_id or 1, highest + 1)
+        return self.commit(destinations)
+
+    def close(self):
+        pass
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS destinations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name_key TEXT NOT NULL UNIQUE,
+    location_key TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS destinations_location ON destinations (location_key, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+"""
+
+INSERT_SQL = (
+    "INSERT INTO destinations (id, name_key, location_key, data) VALUES (?, ?, ?, ?)"
+)
+
+
+def row(dest):
+    # The id lives in its own column and is merged back in on load
+    data = {key: value for key, value in dest.items() if key != "id"}
+    return (
+        dest.get("id"),
+        name_key(dest["name"]),
+        location_key(dest.get("location", "")),
+        json.dumps(data),
+    )
+
+
+class SqliteBackend:
+    """Destinations persisted row by row in SQLite.
+
+    Ids come from AUTOINCREMENT, so they are never reused, and the unique
+    index on the case-folded name rejects duplicates across processes.
+    Every write transaction bumps a version counter that other processes
+    compare against to know when to reload.
+    """
+
+    whole_file = False
+
+    def __init__(self, path):
+        self.pool = ConnectionPool(path)
+        with self.pool.transaction() as conn:
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+        self._seen = None
+
+    def version(self):
+        return (
+            self.pool.connection()
+            .execute("SELECT value FROM meta WHERE key = 'version'")
+            .fetchone()[0]
+        )
+
+    def lock(self):
+        return nullcontext()  # SQLite serializes writers itself
+
+    def load(self):
+        with self.pool.transaction(immediate=False) as conn:
+            rows = conn.execute(
+                "SELECT id, data FROM destinations ORDER BY id"
+            ).fetchall()
+            self._seen = conn.execute(
+                "SELECT value FROM meta WHERE key = 'version'"
+            ).fetchone()[0]
+        return [{**json.loads(data), "id": id} for id, data in rows], self._seen
+
+    def _bump(self, conn):
+        before = conn.execute(
+            "SELECT value FROM meta WHERE key = 'version'"
+        ).fetchone()[0]
+        conn.execute("UPDATE meta SET value = ? WHERE key = 'version'", (before + 1,))
+        # Another process wrote since our last load: make the store reload
+        self._seen = before + 1 if before == self._seen else None
+
+    def insert(self, records):
+        """Insert new records; return them with ids, None where the name is taken"""
+        inserted = []
+        with self.pool.transaction() as conn:
+            for data in records:
+                dest = {key: value for key, value in data.items() if key != "id"}
+                try:
+                    cursor = conn.execute(INSERT_SQL, row(dest))
+                except sqlite3.IntegrityError:
+                    inserted.append(None)
+                    continue
+                inserted.append({**dest, "id": cursor.lastrowid})
+            self._bump(conn)
+        return inserted
+
+    def update(self, dest):
+        with self.pool.transaction() as conn:
+            conn.execute(
+                "UPDATE destinations SET name_key = ?, location_key = ?, data = ? "
+                "WHERE id = ?",
+                row(dest)[1:] + (dest["id"],),
+            )
+            self._bump(conn)
+
+    def delete(self, dest_id):
+        with self.pool.transaction() as conn:
+            conn.execute("DELETE FROM destinations WHERE id = ?", (dest_id,))
+            self._bump(conn)
+
+    def commit(self, destinations):
+        return self._seen
+
+    def replace(self, destinations, next_id=None):
+        with self.pool.transaction() as conn:
+            conn.execute("DELETE FROM destinations")
+            conn.executemany(INSERT_SQL, (row(dest) for dest in destinations))
+            if next_id is not None:
+                # Keep ids handed out by the previous backend from coming back
+                updated = conn.execute(
+                    "UPDATE sqlite_sequence SET seq = MAX(seq, ?) "
+                    "WHERE name = 'destinations'",
+                    (next_id - 1,),
+                )
+                if not updated.rowcount:
+                    conn.execute(
+                        "INSERT INTO sqlite_sequence (name, seq) "
+                        "VALUES ('destinations', ?)",
+                        (next_id - 1,),
+                    )
+            self._bump(conn)
+        self._seen = None
+        return None
+
+    def close(self):
+        self.pool.close()
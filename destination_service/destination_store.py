@@ -0,0 +1,329 @@
+import hashlib
+import json
+import threading
+from contextlib import contextmanager
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+from backends import JsonBackend, location_key, name_key
+from common.fileio import WriteCoalescer
+from common.instrumentation import span
+from search_index import SearchIndex
+
+FIELDS = ("id", "name", "description", "location")
+
+
+def add_sorted(values, value):
+    """Insert value into a sorted list unless it is already there"""
+    position = bisect_left(values, value)
+    if position == len(values) or values[position] != value:
+        values.insert(position, value)
+
+
+def sort_ids(by_id):
+    """Return the sorted ids and the sorted ids of every location"""
+    ids = sorted(by_id)
+    by_location = {}
+    for dest_id in ids:
+        key = location_key(by_id[dest_id].get("location", ""))
+        by_location.setdefault(key, []).append(dest_id)
+    return ids, by_location
+
+
+class DuplicateDestination(ValueError):
+    """Raised when a destination with the same (case-insensitive) name exists"""
+
+
+class DestinationStore:
+    """In-memory view of the destinations held by a storage backend.
+
+    The backend is read once and re-read only when its version changes
+    (the file stamp for JSON, a counter for SQLite). Destinations are
+    indexed by id, by case-folded name and by location, so lookups and
+    mutations cost a dict operation instead of a scan. The serialized
+    listing and its ETag are built once per change instead of once per
+    request.
+
+    Ids are handed out by the backend and never reused, even after the
+    highest one is deleted.
+
+    Every write reloads the backend under its lock before applying, so
+    workers in other processes never lose each other's changes. With a
+    whole-file backend, concurrent writes in one process are coalesced
+    into a single reload and flush.
+    """
+
+    def __init__(self, path=None, backend=None, write_window=0.002):
+        self.backend = backend if backend is not None else JsonBackend(path)
+        self._lock = threading.RLock()
+        self._writer = WriteCoalescer(self._transaction, window=write_window)
+        self._dirty = False
+        self._by_id = {}
+        self._by_name = {}
+        self._ids = []
+        self._by_location = {}
+        self._dead_ids = 0
+        self._search = SearchIndex()
+        self._version = None
+        self._failed = None
+        self._listing = None
+
+    def _index(self, destinations):
+        # Built aside first, so a bad record leaves the previous view in place
+        by_id = {dest["id"]: dest for dest in destinations}
+        by_name = {name_key(dest["name"]): dest for dest in destinations}
+        ids, by_location = sort_ids(by_id)
+        search = SearchIndex(by_id.values())
+        self._by_id, self._by_name, self._search = by_id, by_name, search
+        self._ids, self._by_location, self._dead_ids = ids, by_location, 0
+        self._listing = None
+
+    def _sort(self):
+        self._ids, self._by_location = sort_ids(self._by_id)
+        self._dead_ids = 0
+
+    def refresh(self):
+        """Reload from the backend if it changed since the last load"""
+        with self._lock:
+            version = self.backend.version()
+            if version is not None and version == self._version:
+                return
+            with span("storage_load"):
+                destinations, version = self.backend.load()
+                self._index(destinations)
+                self._version = version
+
+    def all(self):
+        """Return every destination, in file order"""
+        with self._lock:
+            self.refresh()
+            return list(self._by_id.values())
+
+    def get(self, dest_id):
+        """Return the destination with this id, or None"""
+        with self._lock:
+            self.refresh()
+            return self._by_id.get(dest_id)
+
+    def find_by_name(self, name):
+        """Return the destination with this name (case-insensitive), or None"""
+        with self._lock:
+            self.refresh()
+            return self._by_name.get(name_key(name))
+
+    def add(self, data):
+        """Store a new destination under the next id and return it"""
+        return self._write(lambda: self._add(data))
+
+    def _add(self, data):
+        if name_key(data["name"]) in self._by_name:
+            raise DuplicateDestination(data["name"])
+        (dest,) = self.backend.insert([data])
+        if dest is None:
+            # Taken by another process since our last refresh
+            self._version = None
+            raise DuplicateDestination(data["name"])
+        self._insert(dest)
+        return dest
+
+    def add_many(self, records):
+        """Add ``(line, data)`` records under consecutive ids, persisting once.
+
+        Names already taken, including by earlier records of the same batch,
+        are skipped. Returns ``(added, duplicates)`` where duplicates lists
+        the lines that were skipped. If the records iterator raises, nothing
+        is kept.
+        """
+        # Read the records before taking any lock; the source may be slow
+        records = list(records)
+        return self._write(lambda: self._add_many(records))
+
+    def _add_many(self, records):
+        lines, batch, names, duplicates = [], [], set(), []
+        for line, data in records:
+            key = name_key(data["name"])
+            if key in self._by_name or key in names:
+                duplicates.append(line)
+                continue
+            names.add(key)
+            lines.append(line)
+            batch.append(data)
+        if not batch:
+            return 0, duplicates
+        added = 0
+        for line, dest in zip(lines, self.backend.insert(batch)):
+            if dest is None:
+                duplicates.append(line)
+                continue
+            self._insert(dest)
+            added += 1
+        duplicates.sort()
+        return added, duplicates
+
+    def iter_all(self):
+        """Yield every destination from a snapshot taken under the lock.
+
+        The snapshot only holds references, so callers can stream records
+        out without serializing the whole catalog at once.
+        """
+        with self._lock:
+            self.refresh()
+            snapshot = list(self._by_id.values())
+        yield from snapshot
+
+    def update(self, name, changes):
+        """Apply changes to the destination with this exact name.
+
+        Returns the updated destination, or None if there is none.
+        """
+        return self._write(lambda: self._update(name, changes))
+
+    def _update(self, name, changes):
+        dest = self._by_name.get(name_key(name))
+        if dest is None or dest["name"] != name:
+            return None
+        updated = {**dest, **changes}
+        old_location = location_key(dest.get("location", ""))
+        new_location = location_key(updated.get("location", ""))
+        self.backend.update(updated)
+        self._search.add(updated)
+        dest.update(changes)
+        self._dirty = True
+        if new_location != old_location:
+            # The old location list keeps a stale id; page() skips it
+            add_sorted(self._by_location.setdefault(new_location, []), dest["id"])
+        return dest
+
+    def delete(self, dest_id):
+        """Remove the destination with this id; return False if there is none"""
+        return self._write(lambda: self._delete(dest_id))
+
+    def _delete(self, dest_id):
+        dest = self._by_id.get(dest_id)
+        if dest is None:
+            return False
+        self.backend.delete(dest_id)
+        del self._by_id[dest_id]
+        del self._by_name[name_key(dest["name"])]
+        self._dirty = True
+        self._search.remove(dest_id)
+        # Sorted id lists are cleaned lazily instead of shifted on every delete
+        self._dead_ids += 1
+        if self._dead_ids > len(self._by_id):
+            self._sort()
+        return True
+
+    def replace(self, destinations, next_id=None):
+        """Replace the whole destination list and persist it"""
+        destinations = list(destinations)
+        with self._lock, self.backend.lock():
+            self._index(destinations)
+            self._version = self.backend.replace(destinations, next_id)
+
+    def _write(self, mutation):
+        with span("storage_save"):
+            if self.backend.whole_file:
+                return self._writer.submit(lambda: self._apply(mutation))
+            with self._transaction():
+                return self._apply(mutation)
+
+    def _apply(self, mutation):
+        try:
+            return mutation()
+        except DuplicateDestination:
+            raise  # Raised before anything changed
+        except Exception as e:
+            self._failed = e
+            raise
+
+    @contextmanager
+    def _transaction(self):
+        """Reload, apply a batch of writes and persist them once.
+
+        If a mutation fails unexpectedly the view may be half changed, so
+        nothing is persisted: the whole batch fails and the store reloads.
+        """
+        with self._lock, self.backend.lock():
+            self.refresh()
+            self._failed = None
+            try:
+                yield
+            finally:
+                failed, self._failed = self._failed, None
+                if failed is not None:
+                    self._dirty = False
+                    self._version = None
+                elif self._dirty:
+                    self._dirty = False
+                    try:
+                        self._commit()
+                    except BaseException:
+                        self._version = None  # Reload rather than serve lost writes
+                        raise
+            if failed is not None:
+                raise failed
+
+    def _insert(self, dest):
+        key = name_key(dest["name"])
+        location = location_key(dest.get("location", ""))
+        self._search.add(dest)
+        self._by_id[dest["id"]] = dest
+        self._by_name[key] = dest
+        add_sorted(self._ids, dest["id"])
+        add_sorted(self._by_location.setdefault(location, []), dest["id"])
+        self._dirty = True
+
+    def _commit(self):
+        self._version = self.backend.commit(self._by_id.values())
+        self._listing = None
+
+    def close(self):
+        self.backend.close()
+
+    def listing(self):
+        """Return ``(body, etag)`` for the full listing.
+
+        The ETag is a digest of the serialized body, so every worker
+        process agrees on it and it only changes when the data does.
+        """
+        with self._lock:
+            self.refresh()
+            if self._listing is None:
+                body = json.dumps(list(self._by_id.values())).encode("utf-8")
+                etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+                self._listing = (body, etag)
+            return self._listing
+
+    def page(self, limit, after=None, location=None):
+        """Return ``(destinations, next_after)`` ordered by id.
+
+        ``after`` is the last id of the previous page; ``next_after`` is None
+        on the last page. ``location`` restricts the page to one location
+        (case-insensitive) using the location index.
+        """
+        with self._lock:
+            self.refresh()
+            if location is None:
+                ids = self._ids
+            else:
+                ids = self._by_location.get(location_key(location), [])
+            position = bisect_right(ids, after) if after is not None else 0
+            key = location_key(location) if location is not None else None
+            # Skips ids deleted or moved to another location since the last reindex
+            matches = (
+                dest
+                for dest in (self._by_id.get(ids[i]) for i in range(position, len(ids)))
+                if dest is not None
+                and (key is None or location_key(dest.get("location", "")) == key)
+            )
+            page = list(islice(matches, limit + 1))
+            next_after = page[limit - 1]["id"] if len(page) > limit else None
+            return page[:limit], next_after
+
+    def search(self, query, limit=20):
+        """Return the destinations best matching a free-text query"""
+        with self._lock:
+            self.refresh()
+            return [
+                self._by_id[dest_id] for dest_id, _ in self._search.search(query, limit)
+            ]
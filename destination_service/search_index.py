@@ -0,0 +1,141 @@
+import heapq
+import math
+import re
+from bisect import bisect_left, bisect_right, insort
+
+TOKEN_RE = re.compile(r"\w+")
+
+# A match in the name counts more than one in the location or description
+FIELD_WEIGHTS = {"name": 3.0, "location": 2.0, "description": 1.0}
+
+# Prefix matches rank below exact ones. Query words shorter than
+# MIN_PREFIX_LENGTH only match whole words, and longer ones expand to at
+# most MAX_PREFIX_EXPANSION indexed words, so one or two letters cannot
+# pull in most of the index
+PREFIX_WEIGHT = 0.6
+MIN_PREFIX_LENGTH = 3
+MAX_PREFIX_EXPANSION = 1000
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or "").casefold())
+
+
+class SearchIndex:
+    """Inverted index over destination name, description and location.
+
+    Every word maps to the destinations containing it with a field-weighted
+    term frequency. Every query word must match a whole word or a word
+    prefix; results are ranked by weight times inverse document frequency.
+
+    For prefix lookups, words are kept in sorted lists keyed by their first
+    MIN_PREFIX_LENGTH letters. The lists are sorted once when the index is
+    built, and a later change inserts into or deletes from one of them.
+    """
+
+    def __init__(self, dests=()):
+        self._postings = {}
+        self._doc_terms = {}
+        self._vocabulary = {}
+        for dest in dests:
+            self._post(dest["id"], self._weights(dest))
+        for term in self._postings:
+            if len(term) >= MIN_PREFIX_LENGTH:
+                self._vocabulary.setdefault(term[:MIN_PREFIX_LENGTH], []).append(term)
+        for terms in self._vocabulary.values():
+            terms.sort()
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    @staticmethod
+    def _weights(dest):
+        weights = {}
+        for field, field_weight in FIELD_WEIGHTS.items():
+            for term in tokenize(dest.get(field)):
+                weights[term] = weights.get(term, 0.0) + field_weight
+        return weights
+
+    def _post(self, dest_id, weights):
+        """Add a destination's postings; return the words new to the index"""
+        new_terms = []
+        for term, weight in weights.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                new_terms.append(term)
+            postings[dest_id] = weight
+        self._doc_terms[dest_id] = tuple(weights)
+        return new_terms
+
+    def add(self, dest):
+        """Index a destination, replacing any previous version of it"""
+        weights = self._weights(dest)
+        self.remove(dest["id"])
+        for term in self._post(dest["id"], weights):
+            if len(term) >= MIN_PREFIX_LENGTH:
+                key = term[:MIN_PREFIX_LENGTH]
+                insort(self._vocabulary.setdefault(key, []), term)
+
+    def remove(self, dest_id):
+        for term in self._doc_terms.pop(dest_id, ()):
+            postings = self._postings[term]
+            del postings[dest_id]
+            if not postings:
+                del self._postings[term]
+                if len(term) >= MIN_PREFIX_LENGTH:
+                    key = term[:MIN_PREFIX_LENGTH]
+                    terms = self._vocabulary[key]
+                    del terms[bisect_left(terms, term)]
+                    if not terms:
+                        del self._vocabulary[key]
+
+    def _expand(self, word):
+        """Yield (term, factor) for the exact word and the words it prefixes"""
+        if word in self._postings:
+            yield word, 1.0
+        if len(word) < MIN_PREFIX_LENGTH:
+            return
+        terms = self._vocabulary.get(word[:MIN_PREFIX_LENGTH], [])
+        position = bisect_right(terms, word)
+        for term in terms[position : position + MAX_PREFIX_EXPANSION]:
+            if not term.startswith(word):
+                break
+            yield term, PREFIX_WEIGHT
+
+    def search(self, query, limit=20):
+        """Return ``[(dest_id, score), ...]`` best first"""
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words:
+            return []
+        total = len(self._doc_terms)
+        matches = []
+        for word in words:
+            expansions = [
+                (self._postings[term], factor) for term, factor in self._expand(word)
+            ]
+            if not expansions:
+                return []
+            matches.append(expansions)
+
+        # Score the rarest word fully, then only look up its candidates in the
+        # other words' postings instead of walking every posting list
+        matches.sort(key=lambda expansions: sum(len(p) for p, _ in expansions))
+        candidates = None
+        for expansions in matches:
+            scores = {}
+            for postings, factor in expansions:
+                scale = math.log(1 + total / len(postings)) * factor
+                ids = postings if candidates is None else candidates
+                for dest_id in ids:
+                    weight = postings.get(dest_id)
+                    if weight is not None and weight * scale > scores.get(dest_id, 0.0):
+                        scores[dest_id] = weight * scale
+            if candidates is not None:
+                scores = {
+                    dest_id: candidates[dest_id] + s for dest_id, s in scores.items()
+                }
+            if not scores:
+                return []
+            candidates = scores
+        return heapq.nlargest(limit, candidates.items(), key=lambda item: item[1])
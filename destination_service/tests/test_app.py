@@ -1,5 +1,14 @@
 import pytest
-from app import app, SECRET_KEY
+import json
+import multiprocessing
+import pstats
+import shutil
+import threading
+from unittest.mock import patch
+from app import app, create_app, SECRET_KEY, DEST_FILE
+from backends import JsonBackend, SqliteBackend
+from destination_store import DestinationStore, DuplicateDestination
+from search_index import SearchIndex
 import jwt
 
 
@@ -10,6 +19,15 @@ def generate_test_token(role):
 
 
 # Fixtures
+@pytest.fixture(scope="module", autouse=True)
+def dest_store(tmp_path_factory):
+    """Run the tests against a copy of the destinations file."""
+    path = tmp_path_factory.mktemp("models") / "destinations.json"
+    shutil.copy(DEST_FILE, path)
+    with patch("app.dest_store", DestinationStore(path)) as store:
+        yield store
+
+
 @pytest.fixture
 def client():
     """Provide a test client for Flask app."""
@@ -148,3 +166,452 @@ def test_update_destination_invalid_data(client, admin_token):
         response.get_json()["message"]
         == "At least one of description or location must be provided to update."
     )
+
+
+@pytest.mark.parametrize(
+    "method, path, data",
+    [
+        ("post", "/destinations/", {"name": "N", "description": "d", "location": 1}),
+        (
+            "post",
+            "/destinations/",
+            {"name": ["N"], "description": "d", "location": "L"},
+        ),
+        ("put", "/destinations/New York", {"description": "x", "location": None}),
+        ("put", "/destinations/New York", {"description": 5}),
+    ],
+)
+def test_destination_fields_must_be_strings(client, admin_token, method, path, data):
+    before = client.get("/destinations/").get_json()
+    response = getattr(client, method)(
+        path, json=data, headers={"Authorization": admin_token}
+    )
+    assert response.status_code == 400
+    assert response.get_json()["message"].startswith("Fields must be strings")
+    assert client.get("/destinations/").get_json() == before
+
+
+def test_import_rejects_fields_that_are_not_strings(client, admin_token):
+    body = json.dumps({"name": "Quito", "description": "Andes", "location": 12})
+    response = client.post(
+        "/destinations/import",
+        data=body,
+        headers={"Authorization": admin_token, "Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 400
+    assert response.get_json()["rejected"] == 1
+
+
+def test_admin_token_is_verified_once(client, admin_token):
+    """Repeated admin calls are served from the verified-token cache."""
+    from app import token_cache
+
+    headers = {"Authorization": admin_token}
+    before = token_cache.stats()["hits"]
+    client.delete("/destinations/999", headers=headers)
+    client.delete("/destinations/999", headers=headers)
+    assert token_cache.stats()["hits"] >= before + 1
+
+
+def test_mutations_report_storage_spans(client, admin_token):
+    response = client.post(
+        "/destinations/",
+        json={"name": "Porto", "description": "Port wine", "location": "Portugal"},
+        headers={"Authorization": admin_token},
+    )
+    assert response.status_code == 201
+    timing = response.headers["Server-Timing"]
+    assert "token_verify;dur=" in timing and "storage_save;dur=" in timing
+
+    metrics = client.get("/metrics").get_data(as_text=True)
+    assert 'span_duration_seconds_count{span="storage_save"}' in metrics
+    assert "token_cache_hits " in metrics
+
+
+def test_sampling_profile_requires_admin(client, user_token, admin_token):
+    response = client.get("/debug/profile?seconds=0.05")
+    assert response.status_code == 403
+    response = client.get(
+        "/debug/profile?seconds=0.05", headers={"Authorization": user_token}
+    )
+    assert response.status_code == 403
+    response = client.get(
+        "/debug/profile?seconds=120", headers={"Authorization": admin_token}
+    )
+    assert response.status_code == 400
+
+
+def test_sampling_profile_returns_collapsed_stacks(client, admin_token):
+    busy = threading.Event()
+
+    def spin():
+        while not busy.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=spin, name="spinner")
+    worker.start()
+    try:
+        response = client.get(
+            "/debug/profile?seconds=0.2&interval_ms=2",
+            headers={"Authorization": admin_token},
+        )
+    finally:
+        busy.set()
+        worker.join()
+    assert response.status_code == 200
+    lines = response.get_data(as_text=True).splitlines()
+    spinner = [line for line in lines if line.startswith("spinner;")]
+    assert spinner and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any("spin (test_app.py:" in line for line in spinner)
+
+
+def test_profile_header_dumps_request_stats(client, admin_token, user_token, tmp_path):
+    with patch("common.profiling.PROFILE_DIR", tmp_path):
+        response = client.get("/destinations/", headers={"X-Profile": "1"})
+        assert "X-Profile-File" not in response.headers
+        response = client.get(
+            "/destinations/",
+            headers={"X-Profile": "1", "Authorization": user_token},
+        )
+        assert "X-Profile-File" not in response.headers
+        response = client.get(
+            "/destinations/",
+            headers={"X-Profile": "1", "Authorization": admin_token},
+        )
+    path = response.headers["X-Profile-File"]
+    assert path.startswith(str(tmp_path)) and path.endswith(".prof")
+    stats = pstats.Stats(path)
+    assert any(func[2] == "listing" for func in stats.stats)
+
+
+def test_get_destinations_etag_not_modified(client):
+    """A matching If-None-Match is answered with 304 and no body."""
+    response = client.get("/destinations/")
+    etag = response.headers["ETag"]
+    assert etag
+
+    response = client.get("/destinations/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+
+def test_get_destinations_etag_changes_on_mutation(client, admin_token):
+    """Mutations invalidate the cached listing and its ETag."""
+    etag = client.get("/destinations/").headers["ETag"]
+    client.post(
+        "/destinations/",
+        json={"name": "Lisbon", "description": "Hills", "location": "Portugal"},
+        headers={"Authorization": admin_token},
+    )
+    response = client.get("/destinations/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert any(d["name"] == "Lisbon" for d in response.get_json())
+
+
+def test_get_destinations_paginates_by_id(client):
+    """limit/after walk the catalog in id order with a next cursor."""
+    first = client.get("/destinations/?limit=2")
+    assert first.status_code == 200
+    ids = [d["id"] for d in first.get_json()]
+    assert len(ids) == 2 and ids == sorted(ids)
+
+    after = first.headers["X-Next-After"]
+    assert after == str(ids[-1])
+    second = client.get(f"/destinations/?limit=2&after={after}")
+    assert all(d["id"] > ids[-1] for d in second.get_json())
+
+
+def test_get_destinations_last_page_has_no_cursor(client):
+    response = client.get("/destinations/?limit=1000")
+    assert response.status_code == 200
+    assert "X-Next-After" not in response.headers
+
+
+def test_get_destinations_projection_and_location_filter(client):
+    """fields= projects and location= filters case-insensitively."""
+    response = client.get("/destinations/?fields=id,name&location=australia")
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body and all(set(d) == {"id", "name"} for d in body)
+    assert "Sydney" in [d["name"] for d in body]
+
+
+@pytest.mark.parametrize(
+    "query", ["limit=0", "limit=abc", "after=x", "fields=id,password"]
+)
+def test_get_destinations_invalid_query(client, query):
+    response = client.get(f"/destinations/?{query}")
+    assert response.status_code == 400
+
+
+def test_store_never_reuses_deleted_ids(tmp_path):
+    """The persisted id counter survives deleting the highest id."""
+    store = DestinationStore(tmp_path / "destinations.json")
+    first = store.add({"name": "A", "description": "a", "location": "X"})
+    second = store.add({"name": "B", "description": "b", "location": "X"})
+    assert store.delete(second["id"])
+
+    reopened = DestinationStore(tmp_path / "destinations.json")
+    third = reopened.add({"name": "C", "description": "c", "location": "X"})
+    assert third["id"] == second["id"] + 1
+    assert reopened.get(first["id"])["name"] == "A"
+
+
+def test_store_name_index_is_case_insensitive(tmp_path):
+    store = DestinationStore(tmp_path / "destinations.json")
+    store.add({"name": "Kyoto", "description": "Temples", "location": "Japan"})
+    assert store.find_by_name("KYOTO")["name"] == "Kyoto"
+    with pytest.raises(DuplicateDestination):
+        store.add({"name": "kyoto", "description": "x", "location": "y"})
+    # Updates still require the exact name, as before
+    assert store.update("kyoto", {"description": "x"}) is None
+    assert store.update("Kyoto", {"location": "Kansai"})["location"] == "Kansai"
+
+
+def test_store_pages_skip_deleted_and_moved_destinations(tmp_path):
+    store = DestinationStore(tmp_path / "destinations.json")
+    for name in "ABCDE":
+        store.add({"name": name, "description": name, "location": "X"})
+    store.delete(2)
+    store.update("C", {"location": "Y"})
+
+    page, next_after = store.page(2, location="x")
+    assert [d["name"] for d in page] == ["A", "D"]
+    assert next_after == 4
+    page, next_after = store.page(2, after=next_after, location="X")
+    assert [d["name"] for d in page] == ["E"]
+    assert next_after is None
+    assert [d["name"] for d in store.page(10, location="y")[0]] == ["C"]
+
+
+def test_store_does_not_persist_a_failed_mutation(tmp_path):
+    path = tmp_path / "destinations.json"
+    store = DestinationStore(path, write_window=0.2)
+    store.add({"name": "Lima", "description": "Ceviche", "location": "Peru"})
+    saved = path.read_text()
+
+    results = {}
+
+    def add(name, location):
+        try:
+            results[name] = store.add(
+                {"name": name, "description": "x", "location": location}
+            )
+        except Exception as e:
+            results[name] = e
+
+    # Both writes land in one batch; the bad one fails the whole batch
+    writers = [
+        threading.Thread(target=add, args=("Cusco", "Peru")),
+        threading.Thread(target=add, args=("Bad", 123)),
+    ]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+    assert isinstance(results["Bad"], AttributeError)
+    assert isinstance(results["Cusco"], AttributeError)
+    with pytest.raises(AttributeError):
+        store.update("Lima", {"location": None})
+    assert path.read_text() == saved
+    assert [d["name"] for d in store.all()] == ["Lima"]
+    assert store.find_by_name("bad") is None
+    assert store.page(10, location="peru")[0][0]["location"] == "Peru"
+
+
+def test_store_retries_a_failed_reload(tmp_path):
+    path = tmp_path / "destinations.json"
+    store = DestinationStore(path)
+    store.add({"name": "Lima", "description": "Ceviche", "location": "Peru"})
+    path.write_text(json.dumps([{"id": 1, "name": "Lima", "location": None}]))
+    with pytest.raises(AttributeError):
+        store.all()
+    # Not marked current, so the next read tries again
+    with pytest.raises(AttributeError):
+        store.get(1)
+    path.write_text(json.dumps([{"id": 1, "name": "Lima", "location": "Peru"}]))
+    assert store.get(1)["location"] == "Peru"
+
+
+def add_range(path, start, count):
+    store = DestinationStore(path)
+    for i in range(start, start + count):
+        store.add({"name": f"Place {i}", "description": "x", "location": "X"})
+
+
+def test_json_store_concurrent_processes_keep_every_write(tmp_path):
+    path = tmp_path / "destinations.json"
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=add_range, args=(path, i * 25, 25)) for i in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+    destinations = json.loads(path.read_text())
+    assert len(destinations) == 100
+    assert sorted(d["id"] for d in destinations) == list(range(1, 101))
+
+
+def test_sqlite_store_shares_changes_between_processes(tmp_path):
+    """Two stores on one database stand in for two worker processes."""
+    first = DestinationStore(backend=SqliteBackend(tmp_path / "destinations.db"))
+    second = DestinationStore(backend=SqliteBackend(tmp_path / "destinations.db"))
+    a = first.add({"name": "Oslo", "description": "Fjords", "location": "Norway"})
+    assert second.find_by_name("OSLO")["id"] == a["id"]
+
+    # The unique name index catches a duplicate the other store has not seen
+    first.add({"name": "Bergen", "description": "Rain", "location": "Norway"})
+    with pytest.raises(DuplicateDestination):
+        second.add({"name": "bergen", "description": "x", "location": "y"})
+
+    second.update("Oslo", {"location": "Viken"})
+    assert first.get(a["id"])["location"] == "Viken"
+    assert first.delete(a["id"])
+    c = second.add({"name": "Tromso", "description": "Aurora", "location": "Norway"})
+    assert c["id"] == a["id"] + 2
+    assert [d["name"] for d in first.page(10, location="norway")[0]] == [
+        "Bergen",
+        "Tromso",
+    ]
+    first.close()
+    second.close()
+
+
+def test_migrate_sqlite_keeps_ids_and_counter(tmp_path):
+    json_store = DestinationStore(tmp_path / "destinations.json")
+    for name in "ABC":
+        json_store.add({"name": name, "description": name, "location": "X"})
+    json_store.delete(3)
+
+    with patch("app.DEST_FILE", tmp_path / "destinations.json"):
+        result = app.test_cli_runner().invoke(
+            args=["migrate-sqlite", "--database", str(tmp_path / "d.db")]
+        )
+    assert "Migrated 2 destinations" in result.output
+
+    store = DestinationStore(backend=SqliteBackend(tmp_path / "d.db"))
+    assert store.all() == JsonBackend(tmp_path / "destinations.json").load()[0]
+    assert store.add({"name": "D", "description": "d", "location": "X"})["id"] == 4
+    store.close()
+
+
+def test_search_destinations_ranks_name_matches_first(client):
+    """Name matches outrank description matches; prefixes match too."""
+    response = client.get("/destinations/search?q=sydn")
+    assert response.status_code == 200
+    assert response.get_json()[0]["name"] == "Sydney"
+
+    response = client.get("/destinations/search?q=capital city")
+    names = [d["name"] for d in response.get_json()]
+    assert "Rome" in names and "Sydney" not in names
+
+
+def test_search_destinations_requires_query(client):
+    response = client.get("/destinations/search")
+    assert response.status_code == 400
+    assert response.get_json()["message"] == "Query parameter q is required"
+
+
+def test_search_index_follows_mutations(tmp_path):
+    store = DestinationStore(tmp_path / "destinations.json")
+    store.add({"name": "Reykjavik", "description": "Geysers", "location": "Iceland"})
+    assert [d["name"] for d in store.search("geyser")] == ["Reykjavik"]
+
+    store.update("Reykjavik", {"description": "Northern lights"})
+    assert store.search("geyser") == []
+    assert store.search("northern")[0]["name"] == "Reykjavik"
+
+    store.delete(1)
+    assert store.search("reykjavik") == []
+
+
+def test_search_prefix_reaches_every_matching_word():
+    index = SearchIndex()
+    for i in range(100):
+        index.add({"id": i, "name": f"Para{i:03d}", "location": "Nowhere"})
+    index.add({"id": 100, "name": "Paris", "location": "France"})
+    assert 100 in [dest_id for dest_id, _ in index.search("par france")]
+    assert len(index.search("par", limit=500)) == 101
+
+
+def test_search_prefix_expansion_is_capped(monkeypatch):
+    monkeypatch.setattr("search_index.MAX_PREFIX_EXPANSION", 10)
+    index = SearchIndex({"id": i, "name": f"Para{i:03d}"} for i in range(100))
+    assert len(index.search("par", limit=500)) == 10
+    assert len(index.search("para050", limit=500)) == 1
+
+
+def test_search_word_removed_and_added_again_is_listed_once():
+    index = SearchIndex()
+    index.add({"id": 1, "name": "Oslo"})
+    index.search("oslo")
+    index.remove(1)
+    index.add({"id": 2, "name": "Oslo"})
+    assert [dest_id for dest_id, _ in index.search("osl")] == [2]
+    assert index._vocabulary == {"osl": ["oslo"]}
+
+
+def test_search_short_words_only_match_whole_words():
+    index = SearchIndex(
+        [{"id": 1, "name": "Rome", "location": "Italy"}, {"id": 2, "name": "Ro"}]
+    )
+    assert [dest_id for dest_id, _ in index.search("ro")] == [2]
+    assert index.search("r") == []
+    assert [dest_id for dest_id, _ in index.search("rom")] == [1]
+
+
+def test_import_destinations_ndjson(client, admin_token):
+    """Valid lines are imported in one batch; bad and duplicate lines are reported."""
+    body = "\n".join(
+        [
+            json.dumps({"name": "Oslo", "description": "Fjords", "location": "Norway"}),
+            "not json",
+            json.dumps({"name": "Bergen", "description": "Rain"}),
+            json.dumps({"name": "oslo", "description": "Again", "location": "Norway"}),
+            json.dumps(
+                {"name": "Tromso", "description": "Aurora", "location": "Norway"}
+            ),
+        ]
+    )
+    response = client.post(
+        "/destinations/import",
+        data=body,
+        headers={"Authorization": admin_token, "Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 201
+    result = response.get_json()
+    assert result["imported"] == 2
+    assert [e["line"] for e in result["errors"]] == [2, 3, 4]
+
+    names = [d["name"] for d in client.get("/destinations/?location=norway").get_json()]
+    assert names == ["Oslo", "Tromso"]
+
+
+def test_import_destinations_requires_admin(client, user_token):
+    response = client.post(
+        "/destinations/import", data="", headers={"Authorization": user_token}
+    )
+    assert response.status_code == 403
+
+
+def test_export_destinations_streams_ndjson(client):
+    response = client.get("/destinations/export")
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    exported = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert exported == client.get("/destinations/").get_json()
+
+
+def test_create_app_without_swagger(dest_store):
+    with patch("common.api.SWAGGER_ENABLED", False):
+        client = create_app().test_client()
+    assert client.get("/").status_code == 404
+    assert client.get("/swagger.json").status_code == 404
+    response = client.get("/destinations/?limit=1")
+    assert response.status_code == 200
+    assert response.get_json() == dest_store.all()[:1]
+    assert client.get("/metrics").status_code == 200
@@ -1,46 +1,140 @@
 import re
+import click
 from flask import Flask, request, jsonify
-from flask_restx import Api, Resource, fields
-import bcrypt
+from flask_restx import Namespace, Resource, fields
 import jwt
 import datetime
-import json
+import hmac
+import secrets
+import os
+import sys
 from pathlib import Path
 
-app = Flask(__name__)
-
-# Define the security schema for Swagger
-authorizations = {
-    "Bearer": {
-        "type": "apiKey",
-        "in": "header",
-        "name": "Authorization",
-        "description": "Enter 'Bearer <your-token>'",
-    }
-}
-
-# Initialize API with security definitions
-api = Api(
-    app,
-    doc="/",
-    title="User Service API",
-    authorizations=authorizations,
-    security="Bearer",
+# Make the shared helpers in the repository root importable
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.api import create_api
+from common.config import (
+    ADMIN_SECRET,
+    INTERNAL_API_KEY,
+    JWT_ALGORITHM,
+    RATE_LIMIT_ENABLED,
+    RATE_LIMIT_REDIS_URL,
+    RATE_LIMIT_TRUSTED_PROXIES,
+    REVOCATION_SYNC_INTERVAL,
+    SECRET_KEY,
+    USER_BATCH_MAX,
+    WRITE_COALESCE_WINDOW,
+)
+from common.instrumentation import instrument, span
+from common.profiling import register_profiler
+from common.ratelimit import (
+    RateLimiter,
+    client_ip,
+    open_backend,
+    parse_rate,
+    too_many_requests,
+)
+from common.revocation import RevocationList, TokenRevoked
+from common.tokens import TokenSigner
+from passwords import PasswordHasher, PoolSaturated, recommend_cost
+from sessions import InvalidRefreshToken, SessionStore
+from user_store import DuplicateUser, UserStore
+
+# The file and its directory are created by the store on first write
+USER_FILE = Path(
+    os.environ.get("USER_FILE", Path(__file__).parent / "models" / "user.json")
+)
+
+# Private key for RS256/EdDSA tokens; generated on first start if missing
+JWT_PRIVATE_KEY_FILE = Path(
+    os.environ.get(
+        "JWT_PRIVATE_KEY_FILE", Path(__file__).parent / "models" / "jwt_signing_key.pem"
+    )
+)
+
+# Access tokens are short-lived; clients renew them with a refresh token
+# instead of logging in (and paying for bcrypt) again
+ACCESS_TOKEN_TTL = int(os.environ.get("ACCESS_TOKEN_TTL", "900"))
+REFRESH_TOKEN_TTL = int(os.environ.get("REFRESH_TOKEN_TTL", str(14 * 24 * 3600)))
+SESSION_DB_FILE = Path(
+    os.environ.get("SESSION_DB_FILE", Path(__file__).parent / "models" / "sessions.db")
+)
+
+USER_STORE_BACKEND = os.environ.get("USER_STORE_BACKEND", "json")
+USER_DB_FILE = Path(
+    os.environ.get("USER_DB_FILE", Path(__file__).parent / "models" / "users.db")
+)
+
+
+def open_json_store():
+    # Storage mode: "snapshot" rewrites user.json on every change, "journal"
+    # appends to user.journal and compacts it into user.json in the background
+    return UserStore(
+        USER_FILE,
+        mode=os.environ.get("USER_STORE_MODE", "snapshot"),
+        fsync=os.environ.get("USER_JOURNAL_FSYNC", "always"),
+        fsync_batch=int(os.environ.get("USER_JOURNAL_FSYNC_BATCH", "32")),
+        fsync_interval=float(os.environ.get("USER_JOURNAL_FSYNC_INTERVAL", "1.0")),
+        compact_interval=float(os.environ.get("USER_JOURNAL_COMPACT_INTERVAL", "60")),
+        compact_threshold=int(
+            os.environ.get("USER_JOURNAL_COMPACT_THRESHOLD", "10000")
+        ),
+        write_window=WRITE_COALESCE_WINDOW,
+    )
+
+
+def open_user_store():
+    """Open the storage backend selected by USER_STORE_BACKEND"""
+    if USER_STORE_BACKEND == "sqlite":
+        from sqlite_store import SqliteUserStore
+
+        return SqliteUserStore(USER_DB_FILE)
+    if USER_STORE_BACKEND == "json":
+        return open_json_store()
+    raise ValueError(f"Unknown user store backend: {USER_STORE_BACKEND}")
+
+
+user_store = open_user_store()
+
+# bcrypt runs on a bounded pool; a full pool answers 503 instead of queueing
+hasher = PasswordHasher(
+    rounds=int(os.environ.get("BCRYPT_ROUNDS", "12")),
+    workers=int(os.environ.get("PASSWORD_POOL_WORKERS", "0")) or None,
+    max_queue=int(os.environ.get("PASSWORD_POOL_QUEUE", "64")),
+    kind=os.environ.get("PASSWORD_POOL_KIND", "thread"),
+)
+
+# Signs issued tokens; its public key is served on /.well-known/jwks.json
+signer = TokenSigner(JWT_ALGORITHM, secret=SECRET_KEY, key_file=JWT_PRIVATE_KEY_FILE)
+
+# Sliding-window limits checked before any password is hashed or checked;
+# "N/S" allows N requests per S seconds, "off" disables a rule
+limiter = RateLimiter(
+    {
+        "login_ip": parse_rate(os.environ.get("LOGIN_RATE_LIMIT_IP", "30/60")),
+        "login_email": parse_rate(os.environ.get("LOGIN_RATE_LIMIT_EMAIL", "10/60")),
+        "register_ip": parse_rate(os.environ.get("REGISTER_RATE_LIMIT_IP", "10/60")),
+        "register_email": parse_rate(
+            os.environ.get("REGISTER_RATE_LIMIT_EMAIL", "5/60")
+        ),
+    },
+    backend=open_backend(RATE_LIMIT_REDIS_URL),
+    enabled=RATE_LIMIT_ENABLED,
 )
 
-app.config["SECRET_KEY"] = "supersecretkey"
-secret_key_admin = app.config["SECRET_KEY"]
+# Refresh tokens and the log of revoked sessions
+session_store = SessionStore(
+    SESSION_DB_FILE, refresh_ttl=REFRESH_TOKEN_TTL, revocation_ttl=ACCESS_TOKEN_TTL
+)
 
-USER_FILE = Path(__file__).parent / "models" / "user.json"
-USER_FILE.parent.mkdir(parents=True, exist_ok=True)
-# Initialize the file with an empty array if it doesn't exist or is empty
-if not USER_FILE.exists() or USER_FILE.stat().st_size == 0:
-    with open(USER_FILE, "w") as f:
-        json.dump([], f)  # Initialize with an empty array
+# Revoked sessions, read from the local log like the other services do remotely
+revocations = RevocationList(
+    lambda since: session_store.revocations(since), interval=REVOCATION_SYNC_INTERVAL
+)
 
-user_ns = api.namespace("users", description="User operations")
+user_ns = Namespace("users", description="User operations")
 
-user_model = api.model(
+user_model = user_ns.model(
     "User",
     {
         "name": fields.String(required=True, description="Full name"),
@@ -53,7 +147,7 @@ user_model = api.model(
     },
 )
 
-login_model = api.model(
+login_model = user_ns.model(
     "Login",
     {
         "email": fields.String(required=True, description="Email address"),
@@ -61,21 +155,32 @@ login_model = api.model(
     },
 )
 
+refresh_model = user_ns.model(
+    "Refresh",
+    {
+        "refresh_token": fields.String(
+            required=True, description="Refresh token from login or refresh"
+        ),
+    },
+)
+
+batch_model = user_ns.model(
+    "UserBatch",
+    {
+        "emails": fields.List(
+            fields.String, required=True, description="Emails to look up"
+        ),
+    },
+)
+
 
 # Utility functions
 def get_users():
-    if not USER_FILE.exists() or USER_FILE.stat().st_size == 0:
-        with open(USER_FILE, "w") as f:
-            json.dump(
-                [], f
-            )  # Initialize with an empty array if the file is empty or missing
-    with open(USER_FILE, "r") as f:
-        return json.load(f)
+    return user_store.all()
 
 
 def save_users(users):
-    with open(USER_FILE, "w") as f:
-        json.dump(users, f, indent=4)
+    user_store.replace(users)
 
 
 def is_strong_password(password):
@@ -86,20 +191,75 @@ def is_strong_password(password):
     return bool(pattern.match(password))
 
 
+def public_profile(user):
+    """The fields of a user record that other callers may see"""
+    return {"name": user["name"], "email": user["email"], "role": user["role"]}
+
+
+def issue_tokens(user, sid, refresh_token):
+    """Login/refresh response with a new access token for the session"""
+    with span("token_sign"):
+        token = signer.sign(
+            {
+                "email": user["email"],
+                "role": user["role"],
+                "sid": sid,
+                "jti": secrets.token_hex(16),
+                "exp": datetime.datetime.now(datetime.timezone.utc)
+                + datetime.timedelta(seconds=ACCESS_TOKEN_TTL),
+            }
+        )
+    return {
+        "token": token,
+        "refresh_token": refresh_token,
+        "expires_in": ACCESS_TOKEN_TTL,
+    }, 200
+
+
+def decode_token(token):
+    """Verify a token and reject it if its session was revoked"""
+    with span("token_verify"):
+        decoded = signer.decode(token)
+    if revocations.is_revoked(decoded):
+        raise TokenRevoked("Token has been revoked")
+    return decoded
+
+
+def throttle(action, data):
+    """Apply the per-IP and per-email limits of an action; 0 if allowed"""
+    email = data.get("email")
+    return limiter.check(
+        (f"{action}_ip", client_ip(request, RATE_LIMIT_TRUSTED_PROXIES)),
+        (f"{action}_email", email.strip().lower() if isinstance(email, str) else None),
+    )
+
+
+def pool_busy_response(error):
+    return (
+        {"message": "Password service is busy, please retry later"},
+        503,
+        {"Retry-After": str(error.retry_after)},
+    )
+
+
 @user_ns.route("/register")
 class Register(Resource):
     @user_ns.expect(user_model)
     def post(self):
         try:
             data = request.json
-            users = get_users()
+
+            # Rejected before any lookup or hashing, so a flood stays cheap
+            retry_after = throttle("register", data)
+            if retry_after:
+                return too_many_requests(retry_after)
 
             # Validate email format
             if not re.match(r"[^@]+@[^@]+\.[^@]+", data.get("email", "")):
                 return {"message": "Invalid email format"}, 400
 
             # Check if the user already exists
-            if any(u["email"] == data["email"] for u in users):
+            if user_store.exists(data["email"]):
                 return {"message": "User already exists"}, 400
 
             # Check if password is strong
@@ -113,7 +273,7 @@ class Register(Resource):
             role = data.get("role", "User")  # Default to 'User' if no role is specified
 
             if role == "Admin":
-                if secret_key != secret_key_admin:
+                if secret_key != ADMIN_SECRET:
                     return {"message": "Invalid secret key for Admin role"}, 403
                 role = "Admin"
 
@@ -121,26 +281,30 @@ class Register(Resource):
                 return {"message": "Invalid role specified"}, 400
 
             # Hash the password
-            hashed_password = bcrypt.hashpw(
-                data["password"].encode("utf-8"), bcrypt.gensalt()
-            )
+            with span("password_hash"):
+                hashed_password = hasher.hash(data["password"])
 
             # Create the new user object with the determined role
             new_user = {
                 "name": data["name"],
                 "email": data["email"],
-                "password": hashed_password.decode("utf-8"),
+                "password": hashed_password,
                 "role": role,
             }
 
-            # Save the new user to the users list and persist to the file
-            users.append(new_user)
-            save_users(users)
+            # Save the new user; a concurrent registration of the same
+            # email is rejected by the store
+            try:
+                user_store.add(new_user)
+            except DuplicateUser:
+                return {"message": "User already exists"}, 400
 
             return {
                 "message": f'{new_user["name"]} registered successfully as {role}'
             }, 201
 
+        except PoolSaturated as e:
+            return pool_busy_response(e)
         except Exception as e:
             return {"message": str(e)}, 500
 
@@ -151,28 +315,36 @@ class Login(Resource):
     def post(self):
         try:
             data = request.json
-            users = get_users()
-            user = next((u for u in users if u["email"] == data["email"]), None)
 
-            # Validate user credentials
-            if not user or not bcrypt.checkpw(
-                data["password"].encode("utf-8"), user["password"].encode("utf-8")
-            ):
-                return {"message": "Invalid credentials"}, 401
+            # Rejected before bcrypt ever runs
+            retry_after = throttle("login", data)
+            if retry_after:
+                return too_many_requests(retry_after)
 
-            # Generate JWT token including the user's role
-            token = jwt.encode(
-                {
-                    "email": user["email"],
-                    "role": user["role"],
-                    "exp": datetime.datetime.utcnow() + datetime.timedelta(hours=1),
-                },
-                app.config["SECRET_KEY"],
-                algorithm="HS256",
-            )
+            user = user_store.get(data["email"])
 
-            return {"token": token}, 200
+            # Validate user credentials
+            with span("password_check"):
+                valid = user and hasher.check(data["password"], user["password"])
+            if not valid:
+                return {"message": "Invalid credentials"}, 401
 
+            # Upgrade (or downgrade) the stored hash to the configured cost
+            if hasher.needs_rehash(user["password"]):
+                try:
+                    with span("password_hash"):
+                        rehashed = hasher.hash(data["password"])
+                    user_store.put({**user, "password": rehashed})
+                except PoolSaturated:
+                    pass  # Retried on the next login; the login itself succeeded
+
+            # Start a session: a short-lived JWT including the user's role,
+            # and a refresh token that renews it without the password
+            refresh_token, sid = session_store.start(user["email"])
+            return issue_tokens(user, sid, refresh_token)
+
+        except PoolSaturated as e:
+            return pool_busy_response(e)
         except Exception as e:
             return {"message": str(e)}, 500
 
@@ -189,20 +361,15 @@ class Profile(Resource):
             token = auth_header.split(" ")[1]  # Extract token from the header
             try:
                 # Decode the JWT token
-                decoded = jwt.decode(
-                    token, app.config["SECRET_KEY"], algorithms=["HS256"]
-                )
-                users = get_users()
-                user = next((u for u in users if u["email"] == decoded["email"]), None)
+                decoded = decode_token(token)
+                user = user_store.get(decoded["email"])
                 if not user:
                     return {"message": "User not found"}, 404
-                return {
-                    "name": user["name"],
-                    "email": user["email"],
-                    "role": user["role"],
-                }, 200
+                return public_profile(user), 200
             except jwt.ExpiredSignatureError:
                 return {"message": "Token has expired"}, 401
+            except TokenRevoked:
+                return {"message": "Token has been revoked"}, 401
             except jwt.InvalidTokenError:
                 return {"message": "Invalid token"}, 401
 
@@ -210,5 +377,172 @@ class Profile(Resource):
             return {"message": str(e)}, 500
 
 
+@user_ns.route("/refresh")
+class Refresh(Resource):
+    @user_ns.expect(refresh_model)
+    def post(self):
+        """Trade a refresh token for a new access token and refresh token"""
+        data = request.json or {}
+        try:
+            refresh_token, sid, email = session_store.rotate(
+                data.get("refresh_token", "")
+            )
+        except InvalidRefreshToken as e:
+            return {"message": str(e)}, 401
+        user = user_store.get(email)
+        if not user:
+            return {"message": "User not found"}, 401
+        return issue_tokens(user, sid, refresh_token)
+
+
+@user_ns.route("/logout")
+class Logout(Resource):
+    @user_ns.expect(refresh_model)
+    def post(self):
+        """End the session: its refresh and access tokens stop working"""
+        data = request.json or {}
+        if not session_store.revoke(data.get("refresh_token", "")):
+            return {"message": "Invalid refresh token"}, 401
+        return {"message": "Logged out"}, 200
+
+
+@user_ns.route("/revocations")
+class Revocations(Resource):
+    @user_ns.doc(params={"since": "Sequence number of the last revocation seen"})
+    def get(self):
+        """Revoked sessions whose access tokens have not expired yet"""
+        try:
+            since = int(request.args.get("since", 0))
+        except ValueError:
+            return {"message": "since must be an integer"}, 400
+        entries, last = session_store.revocations(since)
+        return {"revocations": entries, "last": last}, 200
+
+
+@user_ns.route("/batch")
+class Batch(Resource):
+    @user_ns.expect(batch_model)
+    @user_ns.doc(params={"X-Internal-Key": {"in": "header", "required": True}})
+    def post(self):
+        """Profiles of many users in one call (internal services only)"""
+        key = request.headers.get("X-Internal-Key", "")
+        if not hmac.compare_digest(
+            key.encode("utf-8"), INTERNAL_API_KEY.encode("utf-8")
+        ):
+            return {"message": "Internal key is missing or invalid"}, 403
+
+        emails = (request.get_json(silent=True) or {}).get("emails")
+        if not isinstance(emails, list) or not all(
+            isinstance(email, str) for email in emails
+        ):
+            return {"message": "emails must be a list of strings"}, 400
+        if len(emails) > USER_BATCH_MAX:
+            return {"message": f"At most {USER_BATCH_MAX} emails per request"}, 413
+
+        # One reload check and a dict lookup per email, not one load per user
+        with span("storage_batch"):
+            users = user_store.get_many(emails)
+        return {
+            "users": {email: public_profile(user) for email, user in users.items()},
+            "missing": [email for email in dict.fromkeys(emails) if email not in users],
+        }, 200
+
+
+@user_ns.route("/password-pool")
+class PasswordPool(Resource):
+    def get(self):
+        """Queue depth and latency of the password hashing pool"""
+        return hasher.stats(), 200
+
+
+def jwks():
+    """Public keys that verify this service's tokens (RFC 7517)"""
+    response = jsonify(signer.jwks())
+    response.headers["Cache-Control"] = "max-age=300"
+    return response
+
+
+def is_admin(auth_header):
+    """Whether the Authorization header carries a valid Admin token"""
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return False
+    try:
+        decoded = decode_token(auth_header.split(" ")[1])
+    except jwt.InvalidTokenError:
+        return False
+    return decoded.get("role") == "Admin"
+
+
+@click.command("bcrypt-cost")
+@click.option("--target-ms", default=250.0, help="Latency budget for one hash")
+@click.option("--samples", default=3, help="Hashes measured per cost factor")
+def bcrypt_cost(target_ms, samples):
+    """Recommend a BCRYPT_ROUNDS value for this host"""
+    cost, timings = recommend_cost(target_ms, samples=samples)
+    for rounds, elapsed_ms in timings.items():
+        click.echo(f"cost {rounds:>2}: {elapsed_ms:>8.1f} ms")
+    click.echo(f"Recommended BCRYPT_ROUNDS={cost} (target {target_ms:g} ms)")
+
+
+@click.command("migrate-sqlite")
+@click.option("--database", default=str(USER_DB_FILE), help="SQLite file to fill")
+def migrate_sqlite(database):
+    """Copy users from the JSON files into a SQLite database"""
+    from sqlite_store import SqliteUserStore
+
+    # Journal mode also picks up records not yet compacted into user.json
+    source = UserStore(USER_FILE, mode="journal")
+    users = source.all()
+    source.close()
+    target = SqliteUserStore(database)
+    target.replace(users)
+    target.close()
+    click.echo(f"Migrated {len(users)} users to {database}")
+
+
+def create_app():
+    """Build the Flask app.
+
+    Importing this module does not build it: the module-level ``app`` is
+    created on first access, so tools that only need the helpers above
+    (and workers forked from a preloading master) skip the work.
+    """
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = SECRET_KEY
+    api = create_api(app, "User Service API", [user_ns])
+
+    # Request latencies and timing spans, served on /metrics
+    metrics = instrument(app)
+    metrics.add_collector("password_pool", hasher.stats)
+    metrics.add_collector("revocations", revocations.stats)
+    metrics.add_collector("ratelimit", limiter.stats)
+    # Admin-only sampling profiler and per-request cProfile
+    register_profiler(api, is_admin)
+    app.add_url_rule("/.well-known/jwks.json", "jwks", jwks)
+
+    app.cli.add_command(bcrypt_cost)
+    app.cli.add_command(migrate_sqlite)
+    return app
+
+
+def __getattr__(name):
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == "__main__":
-    app.run(port=5001, debug=True)
+    from common.serving import serve
+
+    def warm():
+        user_store.refresh()
+        revocations.warm()
+
+    def on_exit():
+        revocations.close()
+        user_store.close()
+        session_store.close()
+
+    serve(create_app(), 5001, warm=warm, on_exit=on_exit)
@@ -0,0 +1,155 @@
+import math
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import bcrypt
+
+
+class PoolSaturated(Exception):
+    """Raised when the password pool has no free worker or queue slot"""
+
+    def __init__(self, retry_after):
+        super().__init__("Password pool is saturated")
+        self.retry_after = retry_after
+
+
+def hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode(
+        "utf-8"
+    )
+
+
+def check_password(password, hashed):
+    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+
+def hash_cost(hashed):
+    """Return the cost factor encoded in a "$2b$12$..." bcrypt hash"""
+    return int(hashed.split("$")[2])
+
+
+def measure_cost(rounds, samples=3):
+    """Median seconds one bcrypt hash takes at this cost on this host"""
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        hash_password("benchmark-password", rounds)
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+def recommend_cost(target_ms, min_cost=4, max_cost=16, samples=3):
+    """Pick the highest cost whose hash time stays within target_ms.
+
+    Returns ``(cost, timings)`` where timings maps each measured cost to
+    milliseconds. Every extra round doubles the work, so measuring stops at
+    the first cost over budget.
+    """
+    timings = {}
+    best = min_cost
+    for rounds in range(min_cost, max_cost + 1):
+        elapsed_ms = measure_cost(rounds, samples) * 1000
+        timings[rounds] = round(elapsed_ms, 1)
+        if elapsed_ms > target_ms:
+            break
+        best = rounds
+    return best, timings
+
+
+class PasswordHasher:
+    """Runs bcrypt off the request thread on a bounded worker pool.
+
+    At most ``workers + max_queue`` operations may be pending at once; any
+    further call fails fast with :class:`PoolSaturated` instead of queueing
+    behind a burst. bcrypt releases the GIL, so the default thread pool
+    already hashes in parallel; ``kind="process"`` isolates it completely.
+    """
+
+    def __init__(self, rounds=12, workers=None, max_queue=64, kind="thread"):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown password pool kind: {kind}")
+        self.rounds = rounds
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.kind = kind
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.workers + max_queue)
+        self._executor = None
+        self._executor_pid = None
+        self._pending = 0
+        self._rejected = 0
+        self._latency = {}
+
+    def _pool(self):
+        # Created lazily and per process so forked workers get their own
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                executor_class = (
+                    ProcessPoolExecutor
+                    if self.kind == "process"
+                    else ThreadPoolExecutor
+                )
+                self._executor = executor_class(max_workers=self.workers)
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def hash(self, password):
+        """Return the bcrypt hash of password at the configured cost"""
+        return self._run("hash", hash_password, password, self.rounds)
+
+    def check(self, password, hashed):
+        """Return True if password matches the stored bcrypt hash"""
+        return self._run("check", check_password, password, hashed)
+
+    def needs_rehash(self, hashed):
+        """True if a stored hash was made with a cost other than the target"""
+        return hash_cost(hashed) != self.rounds
+
+    def _run(self, op, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise PoolSaturated(self._retry_after())
+        with self._lock:
+            self._pending += 1
+        start = time.perf_counter()
+        try:
+            return self._pool().submit(fn, *args).result()
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._pending -= 1
+                count, total, peak = self._latency.get(op, (0, 0.0, 0.0))
+                self._latency[op] = (count + 1, total + elapsed, max(peak, elapsed))
+            self._slots.release()
+
+    def _retry_after(self):
+        """Seconds until the current backlog should have drained"""
+        with self._lock:
+            count = sum(c for c, _, _ in self._latency.values())
+            total = sum(t for _, t, _ in self._latency.values())
+            pending = self._pending
+        average = total / count if count else 0.25
+        return max(1, math.ceil(average * pending / self.workers))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "rounds": self.rounds,
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "pending": self._pending,
+                "queue_depth": max(0, self._pending - self.workers),
+                "rejected": self._rejected,
+                "latency": {
+                    op: {
+                        "count": count,
+                        "avg_ms": round(total / count * 1000, 3),
+                        "max_ms": round(peak * 1000, 3),
+                    }
+                    for op, (count, total, peak) in self._latency.items()
+                },
+            }
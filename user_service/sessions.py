@@ -0,0 +1,173 @@
+import hashlib
+import secrets
+import threading
+import time
+
+from common.sqlite import ConnectionPool
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS refresh_tokens (
+    token_hash TEXT PRIMARY KEY,
+    sid TEXT NOT NULL,
+    email TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    used INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS refresh_tokens_sid ON refresh_tokens (sid);
+CREATE INDEX IF NOT EXISTS refresh_tokens_expiry ON refresh_tokens (expires_at);
+CREATE TABLE IF NOT EXISTS revocations (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    sid TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS revocations_expiry ON revocations (expires_at);
+"""
+
+
+class InvalidRefreshToken(ValueError):
+    """Unknown, expired or revoked refresh token"""
+
+
+class RefreshTokenReused(InvalidRefreshToken):
+    """A rotated refresh token was presented again; its session is revoked"""
+
+
+def token_hash(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class SessionStore:
+    """Refresh tokens and revoked sessions, in SQLite.
+
+    A login starts a session (``sid``) with one refresh token. Each refresh
+    consumes the token and issues the next one in the same session, so a
+    token can be used once; presenting a consumed token again means it was
+    copied, and the whole session is revoked. Only token hashes are stored.
+
+    Revoking a session deletes its refresh tokens and appends the sid to
+    the revocation log, which the services poll with ``revocations(since)``.
+    An entry is kept for ``revocation_ttl`` seconds, the lifetime of the
+    session's last access token.
+    """
+
+    def __init__(
+        self,
+        path,
+        refresh_ttl=14 * 24 * 3600,
+        revocation_ttl=900,
+        purge_interval=3600,
+        clock=time.time,
+    ):
+        self.pool = ConnectionPool(path)
+        self.refresh_ttl = refresh_ttl
+        self.revocation_ttl = revocation_ttl
+        self.purge_interval = purge_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._schema_ready = False
+        self._last_purge = clock()
+
+    def _transaction(self, immediate=True):
+        # The schema is created on first use, not when the app is imported
+        if not self._schema_ready:
+            with self._lock:
+                if not self._schema_ready:
+                    self.pool.connection().executescript(SCHEMA)
+                    self._schema_ready = True
+        return self.pool.transaction(immediate)
+
+    def _issue(self, conn, sid, email):
+        token = secrets.token_urlsafe(32)
+        conn.execute(
+            "INSERT INTO refresh_tokens (token_hash, sid, email, expires_at) "
+            "VALUES (?, ?, ?, ?)",
+            (token_hash(token), sid, email, self._clock() + self.refresh_ttl),
+        )
+        return token
+
+    def _revoke(self, conn, sid):
+        conn.execute("DELETE FROM refresh_tokens WHERE sid = ?", (sid,))
+        conn.execute(
+            "INSERT INTO revocations (sid, expires_at) VALUES (?, ?)",
+            (sid, self._clock() + self.revocation_ttl),
+        )
+
+    def start(self, email):
+        """Start a session; return ``(refresh_token, sid)``"""
+        self._maybe_purge()
+        sid = secrets.token_hex(16)
+        with self._transaction() as conn:
+            return self._issue(conn, sid, email), sid
+
+    def rotate(self, refresh_token):
+        """Consume a refresh token; return ``(next_token, sid, email)``"""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT sid, email, expires_at, used FROM refresh_tokens "
+                "WHERE token_hash = ?",
+                (token_hash(refresh_token),),
+            ).fetchone()
+            if row is None or row[2] <= self._clock():
+                raise InvalidRefreshToken("Invalid refresh token")
+            sid, email, _, used = row
+            if used:
+                self._revoke(conn, sid)
+            else:
+                conn.execute(
+                    "UPDATE refresh_tokens SET used = 1 WHERE token_hash = ?",
+                    (token_hash(refresh_token),),
+                )
+                return self._issue(conn, sid, email), sid, email
+        # Raised after the commit so the revocation is kept
+        raise RefreshTokenReused("Refresh token already used; session revoked")
+
+    def revoke(self, refresh_token):
+        """Revoke the session of a refresh token; return whether it existed"""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT sid FROM refresh_tokens WHERE token_hash = ? AND used = 0",
+                (token_hash(refresh_token),),
+            ).fetchone()
+            if row is None:
+                return False
+            self._revoke(conn, row[0])
+            return True
+
+    def revocations(self, since=0):
+        """Return ``(entries, last)``: live revocations after ``since``.
+
+        ``last`` is the newest sequence number; pass it as the next
+        ``since``. It only goes down if the database was replaced.
+        """
+        with self._transaction(immediate=False) as conn:
+            entries = [
+                {"seq": seq, "sid": sid, "expires_at": expires_at}
+                for seq, sid, expires_at in conn.execute(
+                    "SELECT seq, sid, expires_at FROM revocations "
+                    "WHERE seq > ? AND expires_at > ? ORDER BY seq",
+                    (since, self._clock()),
+                )
+            ]
+            last = conn.execute("SELECT MAX(seq) FROM revocations").fetchone()[0]
+        return entries, last or 0
+
+    def _maybe_purge(self):
+        if self._clock() - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = self._clock()
+        self.purge()
+
+    def purge(self):
+        """Delete expired refresh tokens and revocations"""
+        now = self._clock()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM refresh_tokens WHERE expires_at <= ?", (now,))
+            # The newest entry stays so the sequence never goes backwards
+            conn.execute(
+                "DELETE FROM revocations WHERE expires_at <= ? "
+                "AND seq < (SELECT MAX(seq) FROM revocations)",
+                (now,),
+            )
+
+    def close(self):
+        self.pool.close()
@@ -0,0 +1,104 @@
+import json
+import sqlite3
+
+from common.instrumentation import span
+from common.sqlite import ConnectionPool
+from user_store import DuplicateUser
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    data TEXT NOT NULL
+)
+"""
+
+
+class SqliteUserStore:
+    """User store backed by SQLite, with the same interface as UserStore.
+
+    Lookups go through the unique email index, so nothing is cached in
+    memory and every worker process sees every committed registration.
+    Concurrent registrations of the same email are rejected by the index
+    instead of overwriting each other.
+    """
+
+    def __init__(self, path):
+        self.pool = ConnectionPool(path)
+        self.pool.connection().execute(SCHEMA)
+
+    def refresh(self):
+        pass  # Every read goes to the database
+
+    def all(self):
+        rows = self.pool.connection().execute("SELECT data FROM users ORDER BY id")
+        return [json.loads(data) for (data,) in rows]
+
+    def get(self, email):
+        with span("storage_load"):
+            row = (
+                self.pool.connection()
+                .execute("SELECT data FROM users WHERE email = ?", (email,))
+                .fetchone()
+            )
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, emails):
+        """Return ``{email: user}`` for the emails that are registered"""
+        emails = list(dict.fromkeys(emails))
+        users = {}
+        with span("storage_load"):
+            conn = self.pool.connection()
+            # Stays below SQLite's limit on bound parameters per statement
+            for i in range(0, len(emails), 500):
+                chunk = emails[i : i + 500]
+                rows = conn.execute(
+                    "SELECT data FROM users WHERE email IN "
+                    f"({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for (data,) in rows:
+                    user = json.loads(data)
+                    users[user["email"]] = user
+        return users
+
+    def exists(self, email):
+        return (
+            self.pool.connection()
+            .execute("SELECT 1 FROM users WHERE email = ?", (email,))
+            .fetchone()
+            is not None
+        )
+
+    def add(self, user):
+        try:
+            with span("storage_save"):
+                self.pool.connection().execute(
+                    "INSERT INTO users (email, data) VALUES (?, ?)",
+                    (user["email"], json.dumps(user)),
+                )
+        except sqlite3.IntegrityError:
+            raise DuplicateUser(user["email"])
+
+    def put(self, user):
+        with span("storage_save"):
+            self.pool.connection().execute(
+                "INSERT INTO users (email, data) VALUES (?, ?) "
+                "ON CONFLICT (email) DO UPDATE SET data = excluded.data",
+                (user["email"], json.dumps(user)),
+            )
+
+    def replace(self, users):
+        with self.pool.transaction() as conn:
+            conn.execute("DELETE FROM users")
+            conn.executemany(
+                "INSERT INTO users (email, data) VALUES (?, ?) "
+                "ON CONFLICT (email) DO UPDATE SET data = excluded.data",
+                ((u["email"], json.dumps(u)) for u in users),
+            )
+
+    def compact(self):
+        pass
+
+    def close(self):
+        self.pool.close()
@@ -1,9 +1,18 @@
 import pytest
 from unittest.mock import patch, MagicMock
 from app import app, get_users, save_users
+import app as app_module
+from common.ratelimit import RateLimiter
+from common.revocation import RevocationList
+from passwords import PasswordHasher, hash_cost, recommend_cost
+from sessions import SessionStore
+from sqlite_store import SqliteUserStore
+from user_store import UserStore
 import bcrypt
 import jwt
+import json
 import datetime
+import threading
 
 VALID_USER = {
     "name": "John Doe",
@@ -22,18 +31,36 @@ def client():
         yield client
 
 
-def mock_get_users():
-    return [VALID_USER]
+@pytest.fixture
+def store(tmp_path):
+    """Swap the app's user store for one backed by a temporary file"""
+    path = tmp_path / "user.json"
+    path.write_text(json.dumps([VALID_USER]))
+    with patch("app.user_store", UserStore(path)) as user_store:
+        yield user_store
+
+
+@pytest.fixture(autouse=True)
+def sessions(tmp_path):
+    """Keep refresh tokens and revoked sessions in a temporary database"""
+    session_store = SessionStore(tmp_path / "sessions.db")
+    revocations = RevocationList(session_store.revocations, interval=3600)
+    with patch("app.session_store", session_store), patch(
+        "app.revocations", revocations
+    ):
+        yield revocations
+    revocations.close()
+    session_store.close()
 
 
-def mock_save_users(users):
-    # Mock save_users function (no-op for testing)
-    pass
+@pytest.fixture(autouse=True)
+def limiter():
+    """Fresh rate limit counters for every test"""
+    with patch("app.limiter", RateLimiter(app_module.limiter.rules)) as limiter:
+        yield limiter
 
 
-@patch("app.get_users", side_effect=mock_get_users)
-@patch("app.save_users", side_effect=mock_save_users)
-def test_register_success(mock_save_users, mock_get_users, client):
+def test_register_success(store, client):
     new_user = {
         "name": "Jane Doe",
         "email": "jane.doe@example.com",
@@ -43,11 +70,10 @@ def test_register_success(mock_save_users, mock_get_users, client):
     response = client.post("/users/register", json=new_user)
     assert response.status_code == 201
     assert "registered successfully as User" in response.json["message"]
+    assert store.get("jane.doe@example.com")["name"] == "Jane Doe"
 
 
-@patch("app.get_users", side_effect=mock_get_users)
-@patch("app.save_users", side_effect=mock_save_users)
-def test_register_duplicate_email(mock_save_users, mock_get_users, client):
+def test_register_duplicate_email(store, client):
     duplicate_user = {
         "name": "John Doe",
         "email": "john.doe@example.com",
@@ -71,9 +97,7 @@ def test_register_invalid_password(client):
     assert "Password must be at least 8 characters long" in response.json["message"]
 
 
-@patch("app.get_users", side_effect=mock_get_users)
-@patch("app.save_users", side_effect=mock_save_users)
-def test_register_invalid_role(mock_save_users, mock_get_users, client):
+def test_register_invalid_role(store, client):
     invalid_user = {
         "name": "Jane Doe",
         "email": "jane.doe@example.com",
@@ -85,24 +109,21 @@ def test_register_invalid_role(mock_save_users, mock_get_users, client):
     assert response.json["message"] == "Invalid role specified"
 
 
-@patch("app.get_users", side_effect=mock_get_users)
-def test_login_success(mock_get_users, client):
+def test_login_success(store, client):
     login_data = {"email": VALID_USER["email"], "password": "SecureP@ss123"}
     response = client.post("/users/login", json=login_data)
     assert response.status_code == 200
     assert "token" in response.json
 
 
-@patch("app.get_users", side_effect=mock_get_users)
-def test_login_invalid_credentials(mock_get_users, client):
+def test_login_invalid_credentials(store, client):
     login_data = {"email": VALID_USER["email"], "password": "WrongP@ss123"}
     response = client.post("/users/login", json=login_data)
     assert response.status_code == 401
     assert response.json["message"] == "Invalid credentials"
 
 
-@patch("app.get_users", side_effect=mock_get_users)
-def test_profile_success(mock_get_users, client):
+def test_profile_success(store, client):
     token = jwt.encode(
         {
             "email": VALID_USER["email"],
@@ -120,6 +141,154 @@ def test_profile_success(mock_get_users, client):
     assert response.json["email"] == VALID_USER["email"]
 
 
+def test_batch_returns_profiles_of_known_users(store, client):
+    response = client.post(
+        "/users/batch",
+        json={"emails": [VALID_USER["email"], "nobody@example.com"]},
+        headers={"X-Internal-Key": app_module.INTERNAL_API_KEY},
+    )
+    assert response.status_code == 200
+    assert response.json == {
+        "users": {
+            VALID_USER["email"]: {
+                "name": VALID_USER["name"],
+                "email": VALID_USER["email"],
+                "role": "User",
+            }
+        },
+        "missing": ["nobody@example.com"],
+    }
+
+
+def test_batch_is_internal_only(store, client):
+    body = {"emails": [VALID_USER["email"]]}
+    assert client.post("/users/batch", json=body).status_code == 403
+    response = client.post(
+        "/users/batch", json=body, headers={"X-Internal-Key": "guess"}
+    )
+    assert response.status_code == 403
+    # The default internal key is not the token signing key
+    response = client.post(
+        "/users/batch", json=body, headers={"X-Internal-Key": app_module.SECRET_KEY}
+    )
+    assert response.status_code == 403
+
+
+def test_batch_rejects_bad_or_oversized_requests(store, client):
+    headers = {"X-Internal-Key": app_module.INTERNAL_API_KEY}
+    response = client.post("/users/batch", json={"emails": "a"}, headers=headers)
+    assert response.status_code == 400
+    with patch("app.USER_BATCH_MAX", 2):
+        response = client.post(
+            "/users/batch", json={"emails": ["a", "b", "c"]}, headers=headers
+        )
+    assert response.status_code == 413
+
+
+def test_get_and_save_users(store):
+    users = get_users()
+    users.append({**VALID_USER, "email": "new@example.com"})
+    save_users(users)
+    assert [u["email"] for u in get_users()] == [
+        VALID_USER["email"],
+        "new@example.com",
+    ]
+
+
+def test_store_reloads_when_file_changes(store):
+    assert store.get("other@example.com") is None
+    store.path.write_text(
+        json.dumps([VALID_USER, {**VALID_USER, "email": "other@example.com"}])
+    )
+    assert store.get("other@example.com")["email"] == "other@example.com"
+
+
+def test_migrate_sqlite_copies_snapshot_and_journal(store, tmp_path):
+    store.path.with_suffix(".journal").write_text(
+        json.dumps({"op": "put", "user": {**VALID_USER, "email": "j@example.com"}})
+        + "\n"
+    )
+    with patch("app.USER_FILE", store.path):
+        result = app.test_cli_runner().invoke(
+            args=["migrate-sqlite", "--database", str(tmp_path / "users.db")]
+        )
+    assert "Migrated 2 users" in result.output
+    migrated = SqliteUserStore(tmp_path / "users.db")
+    assert migrated.get("j@example.com")["name"] == "John Doe"
+    assert migrated.all()[0] == VALID_USER
+    migrated.close()
+
+
+def test_login_rehashes_to_configured_cost(store, client):
+    assert hash_cost(VALID_USER["password"]) == 12
+    login_data = {"email": VALID_USER["email"], "password": "SecureP@ss123"}
+    with patch("app.hasher", PasswordHasher(rounds=4)):
+        response = client.post("/users/login", json=login_data)
+        assert response.status_code == 200
+        assert hash_cost(store.get(VALID_USER["email"])["password"]) == 4
+        # The rehashed password still verifies
+        assert client.post("/users/login", json=login_data).status_code == 200
+
+
+def test_recommend_cost_stays_within_budget():
+    cost, timings = recommend_cost(target_ms=60000, min_cost=4, max_cost=5, samples=1)
+    assert cost == 5
+    assert list(timings) == [4, 5]
+
+
+def test_login_returns_503_when_password_pool_is_saturated(store, client):
+    hasher = PasswordHasher(rounds=4, workers=1, max_queue=0)
+    started, release = threading.Event(), threading.Event()
+
+    def slow_check(password, hashed):
+        started.set()
+        release.wait(5)
+        return True
+
+    with patch("app.hasher", hasher), patch("passwords.check_password", slow_check):
+        worker = threading.Thread(target=hasher.check, args=("x", "y"))
+        worker.start()
+        started.wait(5)
+        login_data = {"email": VALID_USER["email"], "password": "SecureP@ss123"}
+        response = client.post("/users/login", json=login_data)
+        release.set()
+        worker.join()
+
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert hasher.stats()["rejected"] == 1
+
+
+def test_password_pool_stats(store, client):
+    login_data = {"email": VALID_USER["email"], "password": "SecureP@ss123"}
+    client.post("/users/login", json=login_data)
+    response = client.get("/users/password-pool")
+    assert response.status_code == 200
+    assert response.json["latency"]["check"]["count"] >= 1
+    assert response.json["queue_depth"] == 0
+
+
+def test_login_reports_timing_spans_and_metrics(store, client):
+    response = client.post(
+        "/users/login",
+        json={"email": "john.doe@example.com", "password": "SecureP@ss123"},
+    )
+    assert response.status_code == 200
+    spans = dict(
+        part.split(";dur=") for part in response.headers["Server-Timing"].split(", ")
+    )
+    assert {"password_check", "token_sign", "total"} <= spans.keys()
+    assert float(spans["total"]) >= float(spans["password_check"])
+
+    metrics = client.get("/metrics").get_data(as_text=True)
+    assert (
+        'http_request_duration_seconds_count{method="POST",route="/users/login",'
+        'status="200"}' in metrics
+    )
+    assert "http_requests_in_flight 1" in metrics  # The /metrics request itself
+    assert "password_pool_rejected " in metrics
+
+
 def test_profile_missing_token(client):
     response = client.get("/users/profile")
     assert response.status_code == 401
@@ -132,3 +301,124 @@ def test_profile_invalid_token(client):
     )
     assert response.status_code == 401
     assert response.json["message"] == "Invalid token"
+
+
+def login(client):
+    response = client.post(
+        "/users/login",
+        json={"email": VALID_USER["email"], "password": "SecureP@ss123"},
+    )
+    assert response.status_code == 200
+    return response.json
+
+
+def profile(client, token):
+    return client.get("/users/profile", headers={"Authorization": f"Bearer {token}"})
+
+
+def test_refresh_rotates_tokens_without_password_check(store, client, sessions):
+    tokens = login(client)
+    assert tokens["expires_in"] == 900
+    with patch("app.hasher") as hasher:
+        response = client.post(
+            "/users/refresh", json={"refresh_token": tokens["refresh_token"]}
+        )
+    assert response.status_code == 200
+    hasher.check.assert_not_called()
+    renewed = response.json
+    assert renewed["refresh_token"] != tokens["refresh_token"]
+    assert profile(client, renewed["token"]).status_code == 200
+
+    # The first refresh token was consumed; presenting it again means it
+    # leaked, so the whole session is revoked
+    response = client.post(
+        "/users/refresh", json={"refresh_token": tokens["refresh_token"]}
+    )
+    assert response.status_code == 401
+    sessions.sync()
+    response = profile(client, renewed["token"])
+    assert response.status_code == 401
+    assert response.json["message"] == "Token has been revoked"
+    assert (
+        client.post(
+            "/users/refresh", json={"refresh_token": renewed["refresh_token"]}
+        ).status_code
+        == 401
+    )
+
+
+def test_logout_publishes_revocation(store, client, sessions):
+    tokens = login(client)
+    other = login(client)
+    response = client.post(
+        "/users/logout", json={"refresh_token": tokens["refresh_token"]}
+    )
+    assert response.status_code == 200
+
+    log = client.get("/users/revocations?since=0").json
+    (entry,) = log["revocations"]
+    assert (
+        entry["sid"]
+        == jwt.decode(tokens["token"], options={"verify_signature": False})["sid"]
+    )
+    assert client.get(f"/users/revocations?since={log['last']}").json == {
+        "revocations": [],
+        "last": log["last"],
+    }
+
+    sessions.sync()
+    assert profile(client, tokens["token"]).status_code == 401
+    assert profile(client, other["token"]).status_code == 200  # Other session
+    assert (
+        client.post(
+            "/users/logout", json={"refresh_token": tokens["refresh_token"]}
+        ).status_code
+        == 401
+    )
+
+
+def test_login_flood_is_rejected_before_bcrypt(store, client, limiter):
+    limiter.rules["login_ip"] = (3, 60)
+    login_data = {"email": VALID_USER["email"], "password": "WrongP@ss123"}
+    for _ in range(3):
+        assert client.post("/users/login", json=login_data).status_code == 401
+    with patch("app.hasher") as hasher, patch("app.user_store") as user_store:
+        response = client.post("/users/login", json=login_data)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    hasher.check.assert_not_called()
+    user_store.get.assert_not_called()
+
+
+def test_login_email_limit_applies_across_addresses(store, client, limiter):
+    limiter.rules["login_email"] = (2, 60)
+    login_data = {"email": VALID_USER["email"].upper(), "password": "WrongP@ss123"}
+    for n in range(2):
+        response = client.post(
+            "/users/login",
+            json=login_data,
+            environ_base={"REMOTE_ADDR": f"10.0.0.{n}"},
+        )
+        assert response.status_code == 401
+    response = client.post(
+        "/users/login", json=login_data, environ_base={"REMOTE_ADDR": "10.0.0.9"}
+    )
+    assert response.status_code == 429
+    assert limiter.stats()["rejected"] == 1
+
+
+def test_server_options_come_from_environment(monkeypatch):
+    from common.serving import server_options
+
+    options = server_options(5001)
+    assert options["bind"].endswith(":5001")
+    assert options["worker_class"] == "gthread" and options["preload_app"]
+
+    monkeypatch.setenv("PORT", "8001")
+    monkeypatch.setenv("WEB_WORKERS", "3")
+    monkeypatch.setenv("WEB_THREADS", "1")
+    monkeypatch.setenv("WEB_PRELOAD", "false")
+    options = server_options(5001)
+    assert options["bind"].endswith(":8001")
+    assert (options["workers"], options["worker_class"]) == (3, "sync")
+    assert not options["preload_app"]
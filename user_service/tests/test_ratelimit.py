@@ -0,0 +1,83 @@
+import pytest
+
+from app import app
+from common.ratelimit import MemoryBackend, RateLimiter, client_ip, parse_rate
+
+
+@pytest.fixture
+def clock():
+    return [6000.0]  # The start of a 60 s window
+
+
+def limiter_for(clock, limit=10, window=60, **kwargs):
+    return RateLimiter({"test": (limit, window)}, clock=lambda: clock[0], **kwargs)
+
+
+def test_parse_rate():
+    assert parse_rate("30/60") == (30, 60.0)
+    assert parse_rate("5") == (5, 60.0)
+    assert parse_rate("off") is None and parse_rate("") is None
+
+
+def test_previous_window_slides_out(clock):
+    limiter = limiter_for(clock)
+    assert all(limiter.hit("test", "k") == 0 for _ in range(10))
+    assert limiter.hit("test", "k") == 60  # Full: wait for the next window
+
+    # Half-way through the next window half of the previous one still counts
+    clock[0] += 90
+    assert all(limiter.hit("test", "k") == 0 for _ in range(5))
+    assert limiter.hit("test", "k") == 6  # Until one more tenth slides out
+    clock[0] += 6
+    assert limiter.hit("test", "k") == 0
+
+    # After a whole idle window nothing is left
+    clock[0] += 120
+    assert all(limiter.hit("test", "k") == 0 for _ in range(10))
+
+
+def test_keys_and_rejections_are_separate(clock):
+    limiter = limiter_for(clock, limit=1)
+    assert limiter.check(("test", "a"), ("test", "b")) == 0
+    assert limiter.check(("test", "a")) > 0
+    assert limiter.check(("test", "c"), ("test", "a"), ("test", "d")) > 0
+    assert limiter.check(("test", "d")) == 0  # Not counted after a rejection
+    assert limiter.check(("unknown", "a"), ("test", None)) == 0
+    assert limiter.stats()["rejected"] == 2
+
+
+def test_memory_backend_keeps_recent_keys(clock):
+    limiter = limiter_for(clock, limit=1, backend=MemoryBackend(max_keys=2))
+    for key in "abc":
+        limiter.hit("test", key)
+    assert limiter.stats()["keys"] == 2
+    assert limiter.hit("test", "a") == 0  # Evicted, so counted afresh
+    assert limiter.hit("test", "c") > 0
+
+
+def test_backend_failure_lets_requests_through(clock):
+    class Down:
+        def hit(self, *args):
+            raise ConnectionError("unreachable")
+
+        def size(self):
+            return None
+
+    limiter = limiter_for(clock, limit=1, backend=Down())
+    assert limiter.hit("test", "k") == 0 and limiter.hit("test", "k") == 0
+    assert limiter.stats()["errors"] == 2
+
+
+def test_disabled_limiter_allows_everything(clock):
+    limiter = limiter_for(clock, limit=1, enabled=False)
+    assert limiter.hit("test", "k") == 0 and limiter.hit("test", "k") == 0
+
+
+def test_client_ip_trusts_only_configured_proxies():
+    with app.test_request_context(
+        headers={"X-Forwarded-For": "203.0.113.7, 10.0.0.2"},
+        environ_base={"REMOTE_ADDR": "10.0.0.1"},
+    ) as ctx:
+        assert client_ip(ctx.request) == "10.0.0.1"
+        assert client_ip(ctx.request, trusted_proxies=1) == "10.0.0.2"
+        assert client_ip(ctx.request, trusted_proxies=2) == "203.0.113.7"
@@ -0,0 +1,112 @@
+import sqlite3
+import time
+
+import pytest
+
+from common.revocation import RevocationList
+from sessions import InvalidRefreshToken, RefreshTokenReused, SessionStore
+
+
+@pytest.fixture
+def clock():
+    return [1000.0]
+
+
+@pytest.fixture
+def sessions(tmp_path, clock):
+    store = SessionStore(
+        tmp_path / "sessions.db",
+        refresh_ttl=100,
+        revocation_ttl=10,
+        clock=lambda: clock[0],
+    )
+    yield store
+    store.close()
+
+
+def test_refresh_token_expires(sessions, clock):
+    token, _ = sessions.start("a@example.com")
+    clock[0] += 100
+    with pytest.raises(InvalidRefreshToken):
+        sessions.rotate(token)
+
+
+def test_reused_refresh_token_revokes_session(sessions):
+    first, sid = sessions.start("a@example.com")
+    second, same_sid, email = sessions.rotate(first)
+    assert (same_sid, email) == (sid, "a@example.com")
+    with pytest.raises(RefreshTokenReused):
+        sessions.rotate(first)
+    with pytest.raises(InvalidRefreshToken):
+        sessions.rotate(second)
+    entries, last = sessions.revocations()
+    assert [e["sid"] for e in entries] == [sid] and last == 1
+
+
+def test_purge_keeps_the_sequence(sessions, clock):
+    for _ in range(3):
+        sessions.revoke(sessions.start("a@example.com")[0])
+    clock[0] += 100
+    sessions.purge()
+    assert sessions.revocations(0) == ([], 3)
+    sessions.revoke(sessions.start("a@example.com")[0])
+    assert [e["seq"] for e in sessions.revocations(3)[0]] == [4]
+
+
+def test_revocation_list_syncs_incrementally(sessions, clock):
+    calls = []
+
+    def fetch(since):
+        calls.append(since)
+        return sessions.revocations(since)
+
+    revocations = RevocationList(fetch, clock=lambda: clock[0])
+    _, sid = sessions.start("a@example.com")
+    sessions.revoke(sessions.start("b@example.com")[0])
+    revocations.sync()
+    revocations.sync()
+    assert calls == [0, 1]
+    assert not revocations.is_revoked({"sid": sid})
+    assert revocations.stats()["revoked"] == 1
+
+    # Dropped once no access token of the session can still be valid
+    clock[0] += 10
+    revocations.sync()
+    assert revocations.stats()["revoked"] == 0
+    revocations.close()
+
+
+def test_revocation_list_starts_over_when_the_log_is_recreated():
+    log = {"entries": [{"sid": "old", "expires_at": 2e9}], "last": 5}
+
+    def fetch(since):
+        return [e for e in log["entries"]], log["last"]
+
+    revocations = RevocationList(fetch)
+    revocations.sync()
+    assert revocations.is_revoked({"sid": "old"})
+    log.update(entries=[{"sid": "new", "expires_at": 2e9}], last=1)
+    revocations.sync()
+    assert revocations.is_revoked({"sid": "new"})
+    assert not revocations.is_revoked({"sid": "old"})
+    assert not revocations.is_revoked({"email": "no-sid@example.com"})
+    revocations.close()
+
+
+def test_revocation_thread_survives_a_locked_database():
+    calls = []
+
+    def fetch(since):
+        calls.append(since)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return [{"sid": "gone", "expires_at": 2e9}], 1
+
+    revocations = RevocationList(fetch, interval=0.01)
+    revocations.is_revoked({})  # Starts the sync thread
+    deadline = time.monotonic() + 2
+    while revocations.stats()["syncs"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert revocations.is_revoked({"sid": "gone"})
+    assert revocations.stats()["failures"] == 1
+    revocations.close()
@@ -0,0 +1,126 @@
+import threading
+import time
+from unittest.mock import patch
+
+import jwt
+import pytest
+import requests
+
+from app import app
+from common.tokens import JwksKeySet, TokenSigner, TokenVerifier
+
+CLAIMS = {"email": "john.doe@example.com", "role": "User"}
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize("algorithm", ["RS256", "EdDSA"])
+def test_verifier_checks_tokens_with_published_keys(tmp_path, algorithm):
+    signer = TokenSigner(algorithm, key_file=tmp_path / "key.pem")
+    verifier = TokenVerifier(algorithm, key_set=JwksKeySet("", fetch=signer.jwks))
+    token = signer.sign(CLAIMS)
+
+    assert jwt.get_unverified_header(token)["kid"] == signer.kid
+    assert verifier.decode(token) == CLAIMS
+    assert signer.decode(token) == CLAIMS
+    # The key file is reused, so tokens survive a restart
+    assert TokenSigner(algorithm, key_file=tmp_path / "key.pem").kid == signer.kid
+    verifier.close()
+
+
+def test_verifier_rejects_other_algorithms(tmp_path):
+    signer = TokenSigner("EdDSA", key_file=tmp_path / "key.pem")
+    verifier = TokenVerifier("EdDSA", key_set=JwksKeySet("", fetch=signer.jwks))
+    forged = jwt.encode(CLAIMS, "supersecretkey", headers={"kid": signer.kid})
+    with pytest.raises(jwt.InvalidTokenError):
+        verifier.decode(forged)
+    with pytest.raises(jwt.InvalidTokenError):
+        verifier.decode(jwt.encode(CLAIMS, None, algorithm="none"))
+    verifier.close()
+
+
+def test_unknown_kid_is_refetched_in_the_background(tmp_path):
+    old = TokenSigner("EdDSA", key_file=tmp_path / "old.pem")
+    new = TokenSigner("EdDSA", key_file=tmp_path / "new.pem")
+    published = [old.jwks()]
+    fetches = []
+    release = threading.Event()
+
+    def fetch():
+        fetches.append(1)
+        if len(fetches) > 1:
+            release.wait(2)  # A slow JWKS endpoint
+        return published[-1]
+
+    key_set = JwksKeySet("", min_refresh_interval=0, fetch=fetch)
+    verifier = TokenVerifier("EdDSA", key_set=key_set)
+    assert verifier.decode(old.sign(CLAIMS)) == CLAIMS
+
+    # The key rotates: the first token signed with it fails fast instead
+    # of waiting for the fetch, which the refresh thread runs meanwhile
+    published.append({"keys": old.jwks()["keys"] + new.jwks()["keys"]})
+    start = time.monotonic()
+    with pytest.raises(jwt.InvalidTokenError, match="Unknown signing key"):
+        verifier.decode(new.sign(CLAIMS))
+    assert time.monotonic() - start < 0.5
+    release.set()
+    wait_for(lambda: key_set.stats()["keys"] == 2)
+    assert verifier.decode(new.sign(CLAIMS)) == CLAIMS
+    assert key_set.stats()["unknown_kids"] == 1
+    verifier.close()
+
+
+def test_failed_refresh_keeps_the_last_keys(tmp_path):
+    signer = TokenSigner("EdDSA", key_file=tmp_path / "key.pem")
+    responses = [signer.jwks(), ValueError("bad JSON")]
+
+    def fetch():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    key_set = JwksKeySet("", fetch=fetch)
+    assert key_set.refresh()
+    assert not key_set.refresh()
+    assert TokenVerifier("EdDSA", key_set=key_set).decode(signer.sign(CLAIMS))
+    assert key_set.stats()["failures"] == 1
+
+
+def test_jwks_endpoint_publishes_the_signing_key(tmp_path):
+    signer = TokenSigner("EdDSA", key_file=tmp_path / "key.pem")
+    with patch("app.signer", signer):
+        response = app.test_client().get("/.well-known/jwks.json")
+    assert response.status_code == 200
+    (key,) = response.get_json()["keys"]
+    assert key["kid"] == signer.kid
+    assert key["alg"] == "EdDSA"
+    assert "d" not in key  # Never the private part
+
+
+def test_jwks_endpoint_hides_the_shared_secret():
+    response = app.test_client().get("/.well-known/jwks.json")
+    assert response.get_json() == {"keys": []}
+
+
+def test_unreachable_jwks_is_fetched_inline_only_once():
+    fetches = []
+
+    def fetch():
+        fetches.append(1)
+        raise requests.ConnectionError("JWKS endpoint down")
+
+    key_set = JwksKeySet("", fetch=fetch)
+    verifier = TokenVerifier("EdDSA", key_set=key_set)
+    token = jwt.encode(CLAIMS, "x" * 32, headers={"kid": "k1"})
+    for _ in range(5):
+        with pytest.raises(jwt.InvalidTokenError, match="Unknown signing key"):
+            verifier.decode(token)
+    # The background thread retries no sooner than min_refresh_interval
+    assert len(fetches) == 1
+    verifier.close()
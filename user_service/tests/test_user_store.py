@@ -0,0 +1,184 @@
+import json
+import multiprocessing
+import threading
+import pytest
+from unittest.mock import patch
+from sqlite_store import SqliteUserStore
+from user_store import DuplicateUser, Journal, UserStore
+
+
+def make_user(i):
+    return {
+        "name": f"User {i}",
+        "email": f"user{i}@example.com",
+        "password": "hash",
+        "role": "User",
+    }
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    path = tmp_path / "user.json"
+    path.write_text(json.dumps([make_user(0)]))
+    return path
+
+
+def test_journal_mode_appends_without_rewriting_snapshot(snapshot):
+    store = UserStore(snapshot, mode="journal")
+    before = snapshot.read_text()
+    store.add(make_user(1))
+    store.add(make_user(2))
+    assert snapshot.read_text() == before
+    assert len(snapshot.with_suffix(".journal").read_text().splitlines()) == 2
+    assert store.get("user2@example.com")["name"] == "User 2"
+    store.close()
+
+
+def test_journal_recovery_replays_snapshot_and_journal(snapshot):
+    store = UserStore(snapshot, mode="journal")
+    store.add(make_user(1))
+    store.put({**make_user(0), "name": "Renamed"})
+    store.close()
+
+    recovered = UserStore(snapshot, mode="journal")
+    assert [u["name"] for u in recovered.all()] == ["Renamed", "User 1"]
+
+
+def test_journal_recovery_discards_torn_tail(snapshot):
+    journal = snapshot.with_suffix(".journal")
+    good = json.dumps({"op": "put", "user": make_user(1)}) + "\n"
+    journal.write_text(good + '{"op": "put", "us')
+
+    store = UserStore(snapshot, mode="journal")
+    assert store.exists("user1@example.com")
+    assert journal.read_text() == good
+    store.add(make_user(2))
+    store.close()
+    assert UserStore(snapshot, mode="journal").exists("user2@example.com")
+
+
+def test_compaction_folds_journal_into_snapshot(snapshot):
+    store = UserStore(snapshot, mode="journal", compact_threshold=3)
+    for i in range(1, 4):
+        store.add(make_user(i))
+    assert snapshot.with_suffix(".journal").stat().st_size == 0
+    assert len(json.loads(snapshot.read_text())) == 4
+    store.close()
+
+
+def test_reader_between_compaction_rename_and_truncate(snapshot):
+    """A reader must not pair the new snapshot with the old journal's offset"""
+    writer = UserStore(snapshot, mode="journal")
+    reader = UserStore(snapshot, mode="journal")
+    for i in range(1, 4):
+        writer.add(make_user(i))
+    reader.refresh()
+
+    readers = []
+    truncate = writer.journal.truncate
+
+    def truncate_after_reader_refresh(size=0):
+        # Another worker refreshes after the rename, before the truncate
+        readers.append(threading.Thread(target=reader.refresh))
+        readers[0].start()
+        readers[0].join(0.2)
+        truncate(size)
+
+    with patch.object(writer.journal, "truncate", truncate_after_reader_refresh):
+        writer.compact()
+    readers[0].join()
+    for i in range(4, 7):
+        writer.add({**make_user(i), "name": f"User {i} " + "x" * i})
+
+    assert len(reader.all()) == 7
+    reader.compact()
+    writer.close()
+    reader.close()
+    assert len(UserStore(snapshot, mode="journal").all()) == 7
+
+
+def test_journal_rejects_unknown_fsync_policy(tmp_path):
+    with pytest.raises(ValueError):
+        Journal(tmp_path / "user.journal", fsync="sometimes")
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_add_rejects_registered_email(tmp_path, backend):
+    if backend == "sqlite":
+        store = SqliteUserStore(tmp_path / "users.db")
+    else:
+        store = UserStore(tmp_path / "user.json")
+    store.add(make_user(1))
+    with pytest.raises(DuplicateUser):
+        store.add({**make_user(1), "name": "Someone else"})
+    store.put({**make_user(1), "password": "new"})
+    assert store.get("user1@example.com")["password"] == "new"
+    assert store.get("user1@example.com")["name"] == "User 1"
+    store.close()
+
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_get_many_returns_only_registered_users(tmp_path, backend):
+    if backend == "sqlite":
+        store = SqliteUserStore(tmp_path / "users.db")
+    else:
+        store = UserStore(tmp_path / "user.json")
+    store.replace([make_user(i) for i in range(1000)])
+    emails = [f"user{i}@example.com" for i in range(0, 1200, 2)]
+    users = store.get_many(emails)
+    assert len(users) == 500
+    assert users["user998@example.com"] == make_user(998)
+    assert "user1000@example.com" not in users
+    store.close()
+
+
+def test_sqlite_store_is_shared_between_processes(tmp_path):
+    """Two stores on one database stand in for two worker processes."""
+    first = SqliteUserStore(tmp_path / "users.db")
+    second = SqliteUserStore(tmp_path / "users.db")
+    first.add(make_user(1))
+    assert second.exists("user1@example.com")
+    with pytest.raises(DuplicateUser):
+        second.add(make_user(1))
+    second.replace([make_user(2), make_user(3)])
+    assert [u["email"] for u in first.all()] == [
+        "user2@example.com",
+        "user3@example.com",
+    ]
+    first.close()
+    second.close()
+
+
+def register_range(path, mode, start, count):
+    store = UserStore(path, mode=mode)
+    for i in range(start, start + count):
+        store.add(make_user(i))
+    store.close()
+
+
+@pytest.mark.parametrize("mode", ["snapshot", "journal"])
+def test_concurrent_processes_do_not_lose_registrations(snapshot, mode):
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=register_range, args=(snapshot, mode, 1 + i * 25, 25))
+        for i in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+    assert len(UserStore(snapshot, mode=mode).all()) == 101
+
+
+def test_concurrent_writes_are_coalesced(snapshot):
+    store = UserStore(snapshot, write_window=0.01)
+    threads = [
+        threading.Thread(target=store.add, args=(make_user(i),)) for i in range(1, 21)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(json.loads(snapshot.read_text())) == 21
+    assert store._writer.stats()["batches"] < 20
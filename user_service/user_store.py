@@ -0,0 +1,335 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from common.fileio import FileLock, WriteCoalescer, atomic_write_json, file_stamp
+from common.instrumentation import span
+
+FSYNC_POLICIES = ("always", "batch", "interval")
+
+
+class DuplicateUser(ValueError):
+    """Raised when adding a user whose email is already registered"""
+
+
+class Journal:
+    """Append-only log of user records, one JSON object per line.
+
+    ``fsync`` controls durability: ``always`` syncs every append, ``batch``
+    syncs every ``batch_size`` appends and ``interval`` leaves syncing to
+    a background flush every ``interval`` seconds.
+    """
+
+    def __init__(self, path, fsync="always", batch_size=32, interval=1.0):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.path = Path(path)
+        self.fsync = fsync
+        self.batch_size = batch_size
+        self.interval = interval
+        self._file = None
+        self._unsynced = 0
+
+    def _handle(self):
+        if self._file is None:
+            self._file = open(self.path, "ab")
+        return self._file
+
+    def append(self, record):
+        """Write one record and return the journal size after the write"""
+        return self.append_many([record])
+
+    def append_many(self, records):
+        """Write records with one write call; return the journal size after it"""
+        f = self._handle()
+        f.write(b"".join(json.dumps(r).encode("utf-8") + b"\n" for r in records))
+        f.flush()
+        self._unsynced += len(records)
+        if self.fsync == "always" or (
+            self.fsync == "batch" and self._unsynced >= self.batch_size
+        ):
+            self.sync()
+        return f.tell()
+
+    def sync(self):
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def replay(self, offset=0):
+        """Yield ``(record, end_offset)`` for every complete line after offset"""
+        if not self.path.exists():
+            return
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Torn write from a crash; the tail is discarded
+                offset += len(line)
+                yield json.loads(line), offset
+
+    def truncate(self, size=0):
+        self.close()
+        if self.path.exists():
+            with open(self.path, "r+b") as f:
+                f.truncate(size)
+                os.fsync(f.fileno())
+
+    def size(self):
+        try:
+            return self.path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+
+class UserStore:
+    """In-memory view of the users file, indexed by email.
+
+    The file is parsed once and then only re-read when its mtime or size
+    changes, so lookups cost a dict access instead of a full load and scan.
+
+    In ``journal`` mode new and updated users are appended to a journal next
+    to the snapshot instead of rewriting it, and a background compaction
+    folds the journal back into the snapshot.
+
+    Writes are safe across worker processes: they run under an advisory
+    lock on ``user.lock``, reload whatever another process wrote first, and
+    replace the snapshot by renaming a temporary file. In ``journal`` mode
+    reads that find a change also reload under the lock, so a snapshot is
+    never combined with an offset into a journal compacted since. Concurrent
+    writes in one process are coalesced into a single reload and flush.
+    """
+
+    def __init__(
+        self,
+        path,
+        mode="snapshot",
+        fsync="always",
+        fsync_batch=32,
+        fsync_interval=1.0,
+        compact_interval=60.0,
+        compact_threshold=10000,
+        write_window=0.002,
+    ):
+        if mode not in ("snapshot", "journal"):
+            raise ValueError(f"Unknown user store mode: {mode}")
+        self.path = Path(path)
+        self.mode = mode
+        self.compact_interval = compact_interval
+        self.compact_threshold = compact_threshold
+        self.journal = None
+        if mode == "journal":
+            self.journal = Journal(
+                self.path.with_suffix(".journal"),
+                fsync=fsync,
+                batch_size=fsync_batch,
+                interval=fsync_interval,
+            )
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(self.path.with_suffix(".lock"))
+        self._writer = WriteCoalescer(self._transaction, window=write_window)
+        self._unflushed = []
+        self._by_email = {}
+        self._stamp = None
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._worker = None
+        self._worker_pid = None
+        self._stop = threading.Event()
+
+    def _ensure_file(self):
+        if not self.path.exists() or self.path.stat().st_size == 0:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "w") as f:
+                json.dump([], f)  # Initialize with an empty array
+
+    def refresh(self):
+        """Reload the file if it changed on disk since the last load"""
+        with self._lock:
+            stamp = file_stamp(self.path)
+            if stamp is not None and stamp == self._stamp:
+                if self.journal is None or self.journal.size() == self._journal_offset:
+                    return
+            if self.journal is None:
+                self._load_snapshot()
+                return
+            # Compaction replaces the snapshot and truncates the journal under
+            # the file lock, so only under it do the two belong together and
+            # an unchanged snapshot mean the journal offset is still valid
+            with self._file_lock:
+                stamp = file_stamp(self.path)
+                if stamp is None or stamp != self._stamp:
+                    self._load_snapshot()
+                self._replay_journal()
+
+    def _load_snapshot(self):
+        self._ensure_file()
+        with span("storage_load"), open(self.path, "r") as f:
+            self._by_email = {u["email"]: u for u in json.load(f)}
+        self._stamp = file_stamp(self.path)
+        self._journal_offset = 0
+        self._journal_entries = 0
+
+    def _replay_journal(self):
+        size = self.journal.size()
+        if size == self._journal_offset:
+            return
+        if size < self._journal_offset:
+            # Truncated without a new snapshot: start over from the snapshot
+            self._load_snapshot()
+        self._apply_journal()
+        if self._journal_offset < self.journal.size():
+            # Appends also hold the lock, so a partial line is crash debris
+            self.journal.truncate(self._journal_offset)
+
+    def _apply_journal(self):
+        for record, offset in self.journal.replay(self._journal_offset):
+            user = record["user"]
+            self._by_email[user["email"]] = user
+            self._journal_offset = offset
+            self._journal_entries += 1
+
+    def all(self):
+        """Return a copy of every user record, in file order"""
+        with self._lock:
+            self.refresh()
+            return list(self._by_email.values())
+
+    def get(self, email):
+        """Return the user with the given email, or None"""
+        with self._lock:
+            self.refresh()
+            return self._by_email.get(email)
+
+    def get_many(self, emails):
+        """Return ``{email: user}`` for the emails that are registered"""
+        with self._lock:
+            self.refresh()
+            by_email = self._by_email
+            return {email: by_email[email] for email in emails if email in by_email}
+
+    def exists(self, email):
+        return self.get(email) is not None
+
+    def add(self, user):
+        """Add a new user and persist it; raise DuplicateUser if taken"""
+
+        def add():
+            # Checked after reloading under the lock, so no other worker
+            # can have registered the email in between
+            if user["email"] in self._by_email:
+                raise DuplicateUser(user["email"])
+            self._put(user)
+
+        with span("storage_save"):
+            self._writer.submit(add)
+
+    def put(self, user):
+        """Insert or replace the user with this email and persist it"""
+        with span("storage_save"):
+            self._writer.submit(lambda: self._put(user))
+
+    def _put(self, user):
+        self._by_email[user["email"]] = user
+        self._unflushed.append({"op": "put", "user": user})
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, self._file_lock:
+            yield
+
+    @contextmanager
+    def _transaction(self):
+        """Reload, apply a batch of writes and persist them once"""
+        with self._locked():
+            self.refresh()
+            try:
+                yield
+                self._flush()
+            except BaseException:
+                self._unflushed = []
+                self._stamp = None  # Drop unpersisted changes on the next refresh
+                raise
+
+    def _flush(self):
+        if not self._unflushed:
+            return
+        records, self._unflushed = self._unflushed, []
+        if self.journal is None:
+            self._write_snapshot()
+            return
+        self._journal_offset = self.journal.append_many(records)
+        self._journal_entries += len(records)
+        self._ensure_worker()
+        if self._journal_entries >= self.compact_threshold:
+            self.compact()
+
+    def replace(self, users):
+        """Replace the whole user table and persist it"""
+        with self._locked():
+            self._by_email = {u["email"]: u for u in users}
+            self._write_snapshot()
+            if self.journal is not None:
+                self.journal.truncate()
+                self._journal_offset = 0
+                self._journal_entries = 0
+
+    def compact(self):
+        """Fold the journal into a fresh snapshot and truncate the journal"""
+        if self.journal is None:
+            return
+        with self._locked():
+            self.refresh()
+            if not self._journal_entries:
+                return
+            self._write_snapshot()
+            # Replaying the journal is idempotent, so a crash between the
+            # snapshot rename and the truncate loses nothing
+            self.journal.truncate()
+            self._journal_offset = 0
+            self._journal_entries = 0
+
+    def _write_snapshot(self):
+        atomic_write_json(self.path, list(self._by_email.values()), indent=4)
+        self._stamp = file_stamp(self.path)
+
+    def _ensure_worker(self):
+        # Started lazily and per process so forked workers get their own
+        if self._worker is not None and self._worker_pid == os.getpid():
+            return
+        self._stop.clear()
+        self._worker_pid = os.getpid()
+        self._worker = threading.Thread(
+            target=self._run_background, name="user-journal", daemon=True
+        )
+        self._worker.start()
+
+    def _run_background(self):
+        next_compaction = time.monotonic() + self.compact_interval
+        tick = min(self.journal.interval, self.compact_interval)
+        while not self._stop.wait(tick):
+            with self._lock:
+                if self.journal.fsync == "interval":
+                    self.journal.sync()
+                if time.monotonic() >= next_compaction:
+                    self.compact()
+                    next_compaction = time.monotonic() + self.compact_interval
+
+    def close(self):
+        """Stop background work and sync any pending journal writes"""
+        self._stop.set()
+        if self._worker is not None and self._worker_pid == os.getpid():
+            self._worker.join()
+        self._worker = None
+        if self.journal is not None:
+            with self._lock:
+                self.journal.close()